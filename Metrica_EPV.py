@@ -9,6 +9,7 @@ Inspiration by: Friends-of-Tracking-Data-LaurieOnTracking
 
 import numpy as np
 import Metrica_Pitch_Control as mpc
+import Metrica_Monitor as mmon
 
 def load_EPV_grid(file_name="EPV_grid.csv"):
     '''
@@ -68,7 +69,8 @@ def __get_EPV_at_location(start_pos,epv_grid,team_with_possession,field_dimensio
 
     return epv_grid[int(y_ind),int(x_ind)]
 
-def calculate_EPV_added(event_id,event,tracking_home,tracking_away,GK_NAMES,params,epv_grid):
+@mmon.timed
+def calculate_EPV_added(event_id,event,tracking_home,tracking_away,GK_NAMES,params,epv_grid,event_index=None):
     '''
     Calculates the EPV added by a pass.
     
@@ -81,24 +83,107 @@ def calculate_EPV_added(event_id,event,tracking_home,tracking_away,GK_NAMES,para
     GK_NAMES: tuple with goalkeeper names like (GK_Home_Team,GK_Away_Team)
     params: dictionary with model parameters
     epv_grid: Grid with Expected possession values at each cell of the grid.
+    event_index: Join index from Metrica_IO.build_event_tracking_index. If given, tracking rows are found by position. Default is None.
+    
+    Returns
+    -------
+    epv_added: Expected EPV added by the pass.
     
     '''
     
-    # Starting and Ending Frame
-    start_frame,end_frame=event.loc[event_id,["Start Frame","End Frame"]].values
-    # Ball Start and Target position
-    start_pos=np.array(event.loc[event_id,["Start X","Start Y"]],dtype='float')
-    target_pos=np.array(event.loc[event_id,["End X","End Y"]],dtype='float')
-    # Attacking team
-    team_with_possession=event.loc[event_id,"Team"]
+    if event_index is None:
+        # Starting and Ending Frame
+        start_frame,end_frame=event.loc[event_id,["Start Frame","End Frame"]].values
+        # Ball Start and Target position
+        start_pos=np.array(event.loc[event_id,["Start X","Start Y"]],dtype='float')
+        target_pos=np.array(event.loc[event_id,["End X","End Y"]],dtype='float')
+        # Attacking team
+        team_with_possession=event.loc[event_id,"Team"]
+        home_frame=tracking_home.loc[start_frame]
+        away_frame=tracking_away.loc[start_frame]
+    else: # Positional lookups
+        import Metrica_IO as mio # pandas is imported only when tracking data is joined with events
+        pos,row=mio.get_event_row(event_index,event_id)
+        start_pos=event_index["start_pos"][pos]
+        target_pos=event_index["end_pos"][pos]
+        team_with_possession=mio.get_team_name(event_index["team"][pos])
+        home_frame=tracking_home.iloc[row]
+        away_frame=tracking_away.iloc[row]
+    
+    return __EPV_added_at_frame(home_frame,away_frame,start_pos,target_pos,team_with_possession,GK_NAMES,params,epv_grid)
+
+
+@mmon.timed
+def calculate_EPV_added_for_events(event_ids,event_index,tracking_home,tracking_away,GK_NAMES,params,epv_grid):
+    '''
+    Calculates the EPV added for many passes at once. Start frames of all events are gathered from the tracking data
+    with a single positional (fancy) indexing step, instead of one label-based lookup per event.
+    
+    Parameters
+    ----------
+    event_ids: Iterable of valid event ids.
+    event_index: Join index from Metrica_IO.build_event_tracking_index.
+    tracking_home: pd.Dataframe with Tracking Data for Home Team.
+    tracking_away: pd.Dataframe with Tracking Data for Away Team.
+    GK_NAMES: tuple with goalkeeper names like (GK_Home_Team,GK_Away_Team)
+    params: dictionary with model parameters
+    epv_grid: Grid with Expected possession values at each cell of the grid.
+    
+    Returns
+    -------
+    epv_added: pd.Series with the EPV added indexed by event id. NaN for events whose Start Frame is not tracked or without team.
+    '''
+    
+    import pandas as pd # pandas is imported only when tracking data is joined with events
+    import Metrica_IO as mio
+    
+    event_ids=list(event_ids)
+    home_frames,valid=mio.get_event_frames(event_index,tracking_home,event_ids)
+    away_frames,_=mio.get_event_frames(event_index,tracking_away,event_ids)
+    positions=np.array([event_index["positions"][event_id] for event_id in event_ids],dtype=np.int64)[valid]
+    
+    epv_added=np.full(len(event_ids),np.nan)
+    values=[]
+    for k,pos in enumerate(positions):
+        if event_index["team"][pos]==0: # Attacking team is unknown
+            values.append(np.nan)
+        else:
+            values.append(__EPV_added_at_frame(home_frames.iloc[k],away_frames.iloc[k],event_index["start_pos"][pos],event_index["end_pos"][pos],
+                                               mio.get_team_name(event_index["team"][pos]),GK_NAMES,params,epv_grid))
+        mmon.progress("calculate_EPV_added_for_events",k+1,len(positions))
+    epv_added[valid]=values
+    epv_added=pd.Series(epv_added,index=event_ids)
+    
+    return epv_added
+
+
+def __EPV_added_at_frame(home_frame,away_frame,start_pos,target_pos,team_with_possession,GK_NAMES,params,epv_grid):
+    '''
+    Calculates the EPV added by a pass, given the tracking rows at its Start Frame.
+    
+    Parameters
+    ----------
+    home_frame: pd.Series with Tracking Data of Home Team at the Start Frame.
+    away_frame: pd.Series with Tracking Data of Away Team at the Start Frame.
+    start_pos: np.array with (x,y) of ball start position.
+    target_pos: np.array with (x,y) of ball target position.
+    team_with_possession: Attacking team. "Home" or "Away".
+    GK_NAMES: tuple with goalkeeper names like (GK_Home_Team,GK_Away_Team)
+    params: dictionary with model parameters
+    epv_grid: Grid with Expected possession values at each cell of the grid.
+    
+    Returns
+    -------
+    epv_added: Expected EPV added by the pass.
+    '''
  
     # Initialise Players positions , velocities etc. for Home and Away Team
     if team_with_possession=="Home":
-        attacking_players=mpc.init_players(tracking_home.loc[start_frame],"Home",params,GK_NAMES[0])
-        defending_players=mpc.init_players(tracking_away.loc[start_frame],"Away",params,GK_NAMES[1])
+        attacking_players=mpc.init_players(home_frame,"Home",params,GK_NAMES[0])
+        defending_players=mpc.init_players(away_frame,"Away",params,GK_NAMES[1])
     else: # Away
-        defending_players=mpc.init_players(tracking_home.loc[start_frame],"Home",params,GK_NAMES[0])
-        attacking_players=mpc.init_players(tracking_away.loc[start_frame],"Away",params,GK_NAMES[1])   
+        defending_players=mpc.init_players(home_frame,"Home",params,GK_NAMES[0])
+        attacking_players=mpc.init_players(away_frame,"Away",params,GK_NAMES[1])   
     
     attacking_players=mpc.check_offsides(team_with_possession,attacking_players,defending_players,start_pos)
     
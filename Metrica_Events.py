@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+
+Indexed Event Data of one or many games.
+EventStore is built once and keeps, for Type, Subtype, Team, Period, Game, players (From/To) and possession chain,
+the sorted row positions of every value, so queries intersect short position arrays instead of filtering the whole
+DataFrame with string operations. Subtypes are indexed by their "-" separated parts, e.g. "ON TARGET-GOAL" is found
+with subtype "GOAL". Frame ranges are found with binary search over the Start Frames of every game.
+
+Usage:
+    store=EventStore({1:event_1,2:event_2})
+    positions=store.query(event_type="PASS",team="Home",period=2,end_x=(106/6,53)) # Home passes into the final third, meters
+    passes=store.select(event_type="PASS",team="Home",period=2,end_x=(106/6,53))
+
+
+@author: Apatsidis Ioannis
+"""
+
+import numpy as np
+import pandas as pd
+import Metrica_IO as mio
+import Metrica_Monitor as mmon
+
+
+class EventStore():
+    '''
+    This class represents the Event Data of one or many games, indexed for queries and split in possession chains.
+
+    '''
+
+    POSSESSION_TYPES=mio.POSSESSION_TYPES # Events that give possession to their team
+
+    def __init__(self,events,possession_types=POSSESSION_TYPES):
+        '''
+        Builds the indices and the possession chains.
+
+        Parameters
+        ----------
+        events: pd.DataFrame with Event Data of a game or dictionary from game id to pd.DataFrame with Event Data.
+        possession_types: Types of events that give possession to their team. Default is POSSESSION_TYPES.
+
+        '''
+
+        if isinstance(events,dict):
+            self.event=pd.concat([event.assign(Game=game_id) for game_id,event in events.items()],ignore_index=True)
+        else:
+            self.event=events.assign(Game=None)
+        self.possession_types=tuple(possession_types)
+        self.__values={column:self.event[column].to_numpy(dtype=float) for column in ["Start X","Start Y","End X","End Y"]}
+
+        self.__index={}
+        for column in ["Type","Team","Period","Game","From","To"]:
+            self.__index[column]=self.__build_index(self.event[column].to_numpy(dtype=object))
+        # Every part of a Subtype, e.g. "HEAD","ON TARGET","GOAL" for "HEAD-ON TARGET-GOAL"
+        subtypes=self.event["Subtype"].to_numpy(dtype=object)
+        parts=[(part,position) for position,subtype in enumerate(subtypes) if isinstance(subtype,str) for part in subtype.split("-")]
+        self.__index["Subtype"]=self.__build_index(np.array([part for part,_ in parts],dtype=object),np.array([position for _,position in parts],dtype=np.int64))
+
+        # Events of every game sorted by Start Frame, for frame ranges
+        self.__frames={}
+        games=self.event["Game"].to_numpy(dtype=object)
+        start_frames=self.event["Start Frame"].to_numpy()
+        for game_id,positions in self.__index["Game"].items():
+            order=positions[np.argsort(start_frames[positions],kind="mergesort")]
+            self.__frames[game_id]=(start_frames[order],order)
+        if len(self.__index["Game"])==0 and len(games)>0: # single game without id
+            order=np.argsort(start_frames,kind="mergesort")
+            self.__frames[None]=(start_frames[order],order)
+
+        self.chains=self.__find_possession_chains()
+        self.__index["Chain"]=self.__build_index(self.chains.astype(object))
+
+
+    @staticmethod
+    def __build_index(values,positions=None):
+        '''
+        Dictionary from every value (except NaN and None) to the sorted positions of its rows.
+        '''
+
+        positions=np.arange(len(values)) if positions is None else positions
+        codes,keys=pd.factorize(values) # -1 for NaN and None
+        known=codes>=0
+        codes,positions=codes[known],positions[known]
+        order=np.argsort(codes,kind="mergesort")
+        groups=np.split(positions[order],np.cumsum(np.bincount(codes,minlength=len(keys)))[:-1])
+
+        return {key:np.unique(group) for key,group in zip(keys,groups)}
+
+
+    def __find_possession_chains(self):
+        '''
+        Chain id of every event. Chains are runs of possession events (possession_types) of the same team, in order of Start Frame
+        within a game and Period. A new chain starts when the team changes, at a SET PIECE and at a new Period or game.
+        Other events (e.g. CHALLENGE, BALL OUT) belong to the chain of the last possession event before them, -1 if none.
+        '''
+
+        n_events=len(self.event)
+        chains=np.full(n_events,-1,dtype=np.int64)
+        if n_events==0:
+            return chains
+        games=pd.factorize(self.event["Game"].to_numpy(dtype=object))[0]
+        periods=self.event["Period"].to_numpy()
+        order=np.lexsort((np.arange(n_events),self.event["Start Frame"].to_numpy(),periods,games))
+        types=self.event["Type"].to_numpy(dtype=object)[order]
+        teams=self.event["Team"].to_numpy(dtype=object)[order]
+        games,periods=games[order],periods[order]
+
+        possession=np.isin(types,self.possession_types)
+        owners=np.flatnonzero(possession)
+        if owners.size==0:
+            return chains
+        new_chain=np.ones(owners.size,dtype=bool)
+        new_chain[1:]=((teams[owners][1:]!=teams[owners][:-1]) | (periods[owners][1:]!=periods[owners][:-1]) |
+                       (games[owners][1:]!=games[owners][:-1]) | (types[owners][1:]=="SET PIECE"))
+        owner_chains=np.cumsum(new_chain)-1
+
+        # Every event gets the chain of the last possession event at or before it, in the same game and Period
+        last=np.searchsorted(owners,np.arange(n_events),side="right")-1
+        owner=owners[np.maximum(last,0)]
+        same_phase=(last>=0) & (games[owner]==games) & (periods[owner]==periods)
+        chains[order]=np.where(same_phase,owner_chains[np.maximum(last,0)],-1)
+
+        return chains
+
+
+    @staticmethod
+    def __intersect(a,b):
+        '''
+        Common values of two sorted arrays of unique positions.
+        '''
+
+        if len(a)>len(b):
+            a,b=b,a
+        found=np.searchsorted(b,a)
+        found[found==len(b)]=0
+
+        return a[b[found]==a] if len(b)>0 else a[:0]
+
+
+    def __lookup(self,column,values):
+        '''
+        Sorted positions of the rows with any of the values in column.
+        '''
+
+        if isinstance(values,(list,tuple,set,np.ndarray)):
+            groups=[self.__index[column].get(value,np.empty(0,dtype=np.int64)) for value in values]
+            return np.unique(np.concatenate(groups)) if len(groups)>0 else np.empty(0,dtype=np.int64)
+
+        return self.__index[column].get(values,np.empty(0,dtype=np.int64))
+
+
+    def query(self,event_type=None,subtype=None,team=None,period=None,player=None,from_player=None,to_player=None,game=None,chain=None,
+              frames=None,start_x=None,start_y=None,end_x=None,end_y=None):
+        '''
+        Row positions of the events that match all the given filters. Every filter is a value or a list of values (any of them).
+
+        Parameters
+        ----------
+        event_type: Type like "PASS". Default is None, that is no filter.
+        subtype: Part of Subtype like "GOAL", "CROSS" or "HEAD". Default is None.
+        team: "Home" or "Away". Default is None.
+        period: Period like 1 or 2. Default is None.
+        player: Player like "Player9" in From or To. Default is None.
+        from_player: Player in From. Default is None.
+        to_player: Player in To. Default is None.
+        game: Game id, as the keys of the events given to EventStore. Default is None.
+        chain: Possession chain id, see get_possession_chains. Default is None.
+        frames: (first,last) range of Start Frame, inclusive. Default is None.
+        start_x,start_y,end_x,end_y: (low,high) range of the coordinate, inclusive. Default is None.
+
+        Returns
+        -------
+        positions: Sorted np.array with row positions in self.event.
+        '''
+
+        lists=[]
+        for column,values in [("Type",event_type),("Subtype",subtype),("Team",team),("Period",period),("From",from_player),
+                              ("To",to_player),("Game",game),("Chain",chain)]:
+            if values is not None:
+                lists.append(self.__lookup(column,values))
+        if player is not None:
+            lists.append(np.union1d(self.__lookup("From",player),self.__lookup("To",player)))
+        if frames is not None:
+            in_range=[]
+            for game_id in (self.__frames if game is None else np.atleast_1d(game)):
+                if game_id in self.__frames:
+                    start_frames,order=self.__frames[game_id]
+                    in_range.append(order[np.searchsorted(start_frames,frames[0],side="left"):np.searchsorted(start_frames,frames[1],side="right")])
+            lists.append(np.sort(np.concatenate(in_range)) if len(in_range)>0 else np.empty(0,dtype=np.int64))
+
+        if len(lists)==0:
+            positions=np.arange(len(self.event))
+        else:
+            lists.sort(key=len)
+            positions=lists[0]
+            for other in lists[1:]:
+                positions=self.__intersect(positions,other)
+
+        for column,bounds in [("Start X",start_x),("Start Y",start_y),("End X",end_x),("End Y",end_y)]:
+            if bounds is not None:
+                values=self.__values[column][positions]
+                positions=positions[(values>=bounds[0]) & (values<=bounds[1])]
+
+        return positions
+
+
+    def select(self,**filters):
+        '''
+        Events that match all the given filters, see query.
+
+        Returns
+        -------
+        event: pd.DataFrame with the matching rows of self.event.
+        '''
+
+        return self.event.iloc[self.query(**filters)]
+
+
+    def get_possession_chains(self):
+        '''
+        Summary of every possession chain.
+
+        Returns
+        -------
+        chains: pd.DataFrame indexed by chain id with "Game", "Period", "Team", "Start Frame", "End Frame" (last End Frame),
+                "Events" (number of events), "Passes" (number of passes), "Shot" (True if it has a SHOT) and "End Type"
+                (Type of its last possession event).
+        '''
+
+        event=self.event.assign(Chain=self.chains)[self.chains>=0].sort_values("Start Frame",kind="mergesort")
+        grouped=event.groupby("Chain")
+        owners=event[event["Type"].isin(self.possession_types)].groupby("Chain")
+
+        summary=pd.DataFrame({"Game":grouped["Game"].first(),"Period":grouped["Period"].first(),"Team":owners["Team"].first(),
+                              "Start Frame":grouped["Start Frame"].min(),"End Frame":grouped["End Frame"].max(),"Events":grouped.size(),
+                              "Passes":(event["Type"]=="PASS").groupby(event["Chain"]).sum(),
+                              "Shot":(event["Type"]=="SHOT").groupby(event["Chain"]).any(),"End Type":owners["Type"].last()})
+        summary.index.name="Chain"
+
+        return summary
+
+
+    def __str__(self):
+        '''
+        String represantation of an EventStore.
+        '''
+
+        return "EventStore: {0} events, {1} games, {2} possession chains".format(len(self.event),max(1,len(self.__index["Game"])),
+                                                                                 int(self.chains.max())+1)
+
+
+@mmon.timed
+def read_event_store(DATA_DIR,game_ids,possession_types=EventStore.POSSESSION_TYPES):
+    '''
+    Reads the Event Data of many games into an EventStore.
+
+    Parameters
+    ----------
+    DATA_DIR: Directory of the data, as in Metrica_IO.read_event_data.
+    game_ids: List with ids of games.
+    possession_types: Types of events that give possession to their team. Default is EventStore.POSSESSION_TYPES.
+
+    Returns
+    -------
+    store: EventStore with the events of all the games, "Game" has the game id.
+    '''
+
+    return EventStore({game_id:mio.read_event_data(DATA_DIR,game_id) for game_id in game_ids},possession_types)
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+
+Occupancy heatmaps and average positions of players.
+Heatmaps of all players are counted at once with np.bincount over the (frames,players) arrays of the Tracking Data,
+with optional filters for Period and possession phase and optional Gaussian smoothing.
+Heatmaps of many games are summed per player, see get_games_heatmaps. Plots are in Metrica_Vizuals (plot_heatmap, plot_average_positions).
+
+
+@author: Apatsidis Ioannis
+"""
+
+import numpy as np
+import pandas as pd
+import Metrica_IO as mio
+
+
+def get_heatmap_parameters():
+    '''
+    Setting the grid and smoothing of heatmaps.
+
+    Returns
+    -------
+    params: Dictionary with heatmap parameters
+    '''
+    params={}
+    params["n_bins"]=(53,34) # Cells along x and y, 2m x 2m for a 106m x 68m field
+    params["sigma"]=None # Standard deviation of Gaussian smoothing in meters, None for no smoothing
+    params["frame_duration"]=None # Seconds between frames, None for the sampling interval of the data (Metrica_IO.get_frame_duration)
+    # Events that give possession to their team, until the next one of them
+    params["possession_types"]=list(mio.POSSESSION_TYPES)
+
+    return params
+
+
+def get_possession_mask(event,tracking,team_name,params=None):
+    '''
+    Frames in which the given team is in possession: the team of the last possession event (params["possession_types"])
+    that started at or before the frame. Frames before the first possession event are in possession of no team.
+
+    Parameters
+    ----------
+    event: pd.Dataframe with Event Data.
+    tracking: pd.DataFrame with Tracking Data (only the "Frame" index is used).
+    team_name: "Home" or "Away".
+    params: Dictionary with heatmap parameters. Default is None, that is get_heatmap_parameters().
+
+    Returns
+    -------
+    mask: Boolean np.array over the frames of tracking.
+    '''
+
+    params=get_heatmap_parameters() if params is None else params
+
+    possession=event[event["Type"].isin(params["possession_types"])]
+    event_frames=possession["Start Frame"].to_numpy()
+    order=np.argsort(event_frames,kind="mergesort")
+    positions=np.searchsorted(event_frames[order],tracking.index.to_numpy(),side="right")-1
+    teams=possession["Team"].to_numpy(dtype=object)[order]
+
+    return (positions>=0) & (teams[np.maximum(positions,0)]==team_name)
+
+
+def __get_frame_duration(team,params):
+    '''
+    Seconds per frame, params["frame_duration"] or the sampling interval of the data when it is None.
+    '''
+
+    return mio.get_frame_duration(team) if params["frame_duration"] is None else params["frame_duration"]
+
+
+def __select_frames(team,event=None,period=None,possession=None,params=None):
+    """
+    Boolean mask over the frames of team for the given Period and possession phase ("In", "Out" or None).
+    """
+
+    mask=np.ones(len(team),dtype=bool)
+    if period is not None:
+        mask&=(team["Period"]==period).to_numpy()
+    if possession is not None:
+        assert possession in ("In","Out"),"Invalid possession phase. Acceptable values are 'In', 'Out'."
+        assert event is not None,"Event Data are needed for possession phases."
+        team_name="Home" if any(col.startswith("Home_") for col in team.columns) else "Away"
+        in_possession=get_possession_mask(event,team,team_name,params)
+        mask&=in_possession if possession=="In" else ~in_possession
+
+    return mask
+
+
+def get_players_heatmaps(team,event=None,period=None,possession=None,params=None,field_dimensions=(106.,68.)):
+    '''
+    Time that each player spent in every cell of the field, for all players in one pass.
+    Frames that a player is not in (NaN positions) add nothing, positions out of the field are counted in the closest cell.
+
+    Parameters
+    ----------
+    team: pd.DataFrame of Tracking data for teams' players, in meters.
+    event: pd.Dataframe with Event Data, needed for possession phases. Default is None.
+    period: Only frames of this Period. Default is None, that is all Periods.
+    possession: "In" for frames in possession of the team, "Out" for frames out of possession (see get_possession_mask).
+                Default is None, that is all frames.
+    params: Dictionary with heatmap parameters. Default is None, that is get_heatmap_parameters().
+    field_dimensions: Field dimensions in meters (Width x Height). Default is (106,68).
+
+    Returns
+    -------
+    heatmaps: Dictionary with:
+        "players": np.array with players like "Home_1".
+        "heatmaps": np.array in shape (players,n_bins_y,n_bins_x) with seconds per cell. Row 0 is the bottom of the field (lowest y).
+                    Sum over axis 0 for the heatmap of the team.
+        "x_edges","y_edges": Edges of the cells in meters.
+    '''
+
+    params=get_heatmap_parameters() if params is None else params
+    n_bins_x,n_bins_y=params["n_bins"]
+
+    player_indices=np.unique([x[:-2] for x in team.columns if x[-2:]=='_x' and 'ball' not in x])
+    mask=__select_frames(team,event,period,possession,params)
+    x=team[[p+"_x" for p in player_indices]].to_numpy(dtype=float)[mask]
+    y=team[[p+"_y" for p in player_indices]].to_numpy(dtype=float)[mask]
+
+    x_edges=np.linspace(-field_dimensions[0]/2,field_dimensions[0]/2,n_bins_x+1)
+    y_edges=np.linspace(-field_dimensions[1]/2,field_dimensions[1]/2,n_bins_y+1)
+
+    # Flat cell of every (frame,player), offset by player, so that a single bincount counts all players
+    valid=~(np.isnan(x) | np.isnan(y))
+    columns=np.clip(np.floor((x[valid]-x_edges[0])/(x_edges[1]-x_edges[0])).astype(np.int64),0,n_bins_x-1)
+    rows=np.clip(np.floor((y[valid]-y_edges[0])/(y_edges[1]-y_edges[0])).astype(np.int64),0,n_bins_y-1)
+    players=np.nonzero(valid)[1]
+    cells=(players*n_bins_y+rows)*n_bins_x+columns
+    counts=np.bincount(cells,minlength=len(player_indices)*n_bins_y*n_bins_x)
+
+    heatmaps={}
+    heatmaps["players"]=player_indices
+    heatmaps["heatmaps"]=counts.reshape(len(player_indices),n_bins_y,n_bins_x)*__get_frame_duration(team,params)
+    heatmaps["x_edges"]=x_edges
+    heatmaps["y_edges"]=y_edges
+    if params["sigma"] is not None:
+        heatmaps["heatmaps"]=smooth_heatmaps(heatmaps["heatmaps"],params["sigma"],x_edges,y_edges)
+
+    return heatmaps
+
+
+def smooth_heatmaps(heatmaps,sigma,x_edges,y_edges):
+    '''
+    Gaussian smoothing of heatmaps, as two matrix products with a Gaussian kernel per axis.
+    Kernels are normalized inside the field, so the total time of every heatmap stays the same.
+
+    Parameters
+    ----------
+    heatmaps: np.array in shape (...,n_bins_y,n_bins_x), e.g. from get_players_heatmaps.
+    sigma: Standard deviation of the Gaussian in meters.
+    x_edges,y_edges: Edges of the cells in meters.
+
+    Returns
+    -------
+    heatmaps: Smoothed np.array in the same shape.
+    '''
+
+    kernels=[]
+    for edges in [y_edges,x_edges]:
+        centers=(edges[:-1]+edges[1:])/2
+        kernel=np.exp(-0.5*((centers[:,np.newaxis]-centers[np.newaxis,:])/sigma)**2)
+        kernels.append(kernel/kernel.sum(axis=0)) # every cell spreads all its time
+
+    return kernels[0] @ heatmaps @ kernels[1].T
+
+
+def get_average_positions(team,event=None,period=None,possession=None,params=None):
+    '''
+    Average position of every player, with the same filters as get_players_heatmaps.
+
+    Parameters
+    ----------
+    team: pd.DataFrame of Tracking data for teams' players, in meters.
+    event: pd.Dataframe with Event Data, needed for possession phases. Default is None.
+    period: Only frames of this Period. Default is None, that is all Periods.
+    possession: "In", "Out" or None, see get_players_heatmaps. Default is None.
+    params: Dictionary with heatmap parameters. Default is None, that is get_heatmap_parameters().
+
+    Returns
+    -------
+    positions: pd.DataFrame with a row per player and columns "x","y" and "Time [s]" (time of the frames the player was in).
+    '''
+
+    params=get_heatmap_parameters() if params is None else params
+
+    player_indices=np.unique([x[:-2] for x in team.columns if x[-2:]=='_x' and 'ball' not in x])
+    mask=__select_frames(team,event,period,possession,params)
+    x=team[[p+"_x" for p in player_indices]].to_numpy(dtype=float)[mask]
+    y=team[[p+"_y" for p in player_indices]].to_numpy(dtype=float)[mask]
+
+    valid=~(np.isnan(x) | np.isnan(y))
+    n_valid=valid.sum(axis=0)
+    with np.errstate(invalid='ignore'):
+        positions=pd.DataFrame({"x":np.where(valid,x,0.).sum(axis=0)/n_valid,"y":np.where(valid,y,0.).sum(axis=0)/n_valid,
+                                "Time [s]":n_valid*__get_frame_duration(team,params)},index=player_indices)
+
+    return positions
+
+
+def get_games_heatmaps(DATA_DIR,game_ids,team_name,period=None,possession=None,params=None,field_dimensions=(106.,68.),player_ids=None):
+    '''
+    Heatmaps of the players of a team over many games, summed per player.
+    Every game is turned so that the team attacks from left to right in both Periods, so games are comparable.
+    Without player_ids players are their labels in Tracking Data (like "Home_1"), so sums are per label only: the same label
+    can be another player in another game.
+
+    Parameters
+    ----------
+    DATA_DIR: Directory of the data, as in Metrica_IO.read_tracking_data.
+    game_ids: List with ids of games.
+    team_name: "Home" or "Away", or a dictionary from game id to "Home" or "Away" (e.g. the side of a club in every game).
+    period: Only frames of this Period. Default is None, that is all Periods.
+    possession: "In", "Out" or None, see get_players_heatmaps. Default is None.
+    params: Dictionary with heatmap parameters. Default is None, that is get_heatmap_parameters().
+            Smoothing is applied once, to the sums.
+    field_dimensions: Field dimensions in meters (Width x Height). Default is (106,68).
+    player_ids: Dictionary from game id to a dictionary from the labels of the players in the game to stable player ids,
+                given for every player. Default is None, that is the labels.
+
+    Returns
+    -------
+    heatmaps: Dictionary as in get_players_heatmaps, with the players (ids) of all games and also:
+        "games": np.array with the number of games of each player.
+    '''
+
+    params=get_heatmap_parameters() if params is None else params
+    count_params=dict(params,sigma=None)
+
+    totals={}
+    games={}
+    for game_id in game_ids:
+        event=mio.transform_coord_system(mio.read_event_data(DATA_DIR,game_id),field_dimensions=field_dimensions)
+        tracking_home=mio.transform_coord_system(mio.read_tracking_data(DATA_DIR,game_id,"Home"),field_dimensions=field_dimensions)
+        tracking_away=mio.transform_coord_system(mio.read_tracking_data(DATA_DIR,game_id,"Away"),field_dimensions=field_dimensions)
+        event,tracking_home,tracking_away=mio.set_single_playing_direction(event,tracking_home,tracking_away)
+        game_team=team_name[game_id] if isinstance(team_name,dict) else team_name
+        team=tracking_home if game_team=="Home" else tracking_away
+
+        game=get_players_heatmaps(team,event,period,possession,count_params,field_dimensions)
+        if game_team=="Away": # Away attacks from right to left, turn the field
+            game["heatmaps"]=game["heatmaps"][:,::-1,::-1]
+        for player,heatmap in zip(game["players"],game["heatmaps"]):
+            if heatmap.sum()==0: # Player didn't play
+                continue
+            if player_ids is not None:
+                assert player in player_ids[game_id],"Player {} without id in game {}.".format(player,game_id)
+                player=player_ids[game_id][player]
+            totals[player]=totals.get(player,0)+heatmap
+            games[player]=games.get(player,0)+1
+
+    players=np.array(sorted(totals))
+    heatmaps={}
+    heatmaps["players"]=players
+    heatmaps["heatmaps"]=np.array([totals[player] for player in players]).reshape(len(players),params["n_bins"][1],params["n_bins"][0])
+    heatmaps["x_edges"]=np.linspace(-field_dimensions[0]/2,field_dimensions[0]/2,params["n_bins"][0]+1)
+    heatmaps["y_edges"]=np.linspace(-field_dimensions[1]/2,field_dimensions[1]/2,params["n_bins"][1]+1)
+    heatmaps["games"]=np.array([games[player] for player in players],dtype=np.int64)
+    if params["sigma"] is not None:
+        heatmaps["heatmaps"]=smooth_heatmaps(heatmaps["heatmaps"],params["sigma"],heatmaps["x_edges"],heatmaps["y_edges"])
+
+    return heatmaps
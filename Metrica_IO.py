@@ -12,9 +12,15 @@ import pandas as pd
 import numpy as np
 import os
 import csv
+import Metrica_Monitor as mmon
 
+logger=mmon.get_logger(__name__)
 
-def read_event_data(DATA_DIR : str,game_id : int):
+POSSESSION_TYPES=("SET PIECE","PASS","RECOVERY","BALL LOST","SHOT") # Event types that give possession to their team, the on-ball events
+
+
+@mmon.timed
+def read_event_data(DATA_DIR : str,game_id : int,compact=False):
     """
     Reads Event data for game with given game_id.
 
@@ -22,6 +28,7 @@ def read_event_data(DATA_DIR : str,game_id : int):
     ----------
     DATA_DIR: Directory of Data.
     game_id: Id of the game.
+    compact: Use compact dtypes (see to_compact_events). Default is False.
     
     Returns
     -------
@@ -29,11 +36,142 @@ def read_event_data(DATA_DIR : str,game_id : int):
     
     """
     
-    csv_path=os.path.join(DATA_DIR,"data\Sample_Game_{0}\Sample_Game_{1}_RawEventsData.csv".format(game_id,game_id))
+    csv_path=os.path.join(DATA_DIR,"data","Sample_Game_{0}".format(game_id),"Sample_Game_{0}_RawEventsData.csv".format(game_id))
     event_data_df=pd.read_csv(csv_path)
+    if compact:
+        event_data_df=to_compact_events(event_data_df)
     return event_data_df
 
 
+def to_compact_events(event):
+    """
+    Converts Event data to compact dtypes: categorical "Team","Type","Subtype","From","To", int32 frames, int8 periods
+    and float32 coordinates. Times are kept in float64.
+    
+    Parameters
+    ----------
+    event: pd.Dataframe with Event Data.
+    
+    Returns
+    -------
+    event: pd.Dataframe with Event Data in compact dtypes.
+    
+    """
+    
+    dtypes={}
+    for col in ["Team","Type","Subtype","From","To"]:
+        dtypes[col]="category"
+    for col in ["Start Frame","End Frame"]:
+        dtypes[col]=np.int32
+    dtypes["Period"]=np.int8
+    for col in ["Start X","Start Y","End X","End Y"]:
+        dtypes[col]=np.float32
+    
+    return event.astype({col:dtype for col,dtype in dtypes.items() if col in event.columns})
+
+
+def to_compact_tracking(tracking):
+    """
+    Converts Tracking data to compact dtypes: float32 positions and velocities, int32 frames and int8 periods.
+    It roughly halves the memory of a match. "Time [s]" is kept in float64, because float32 cannot resolve
+    the 40ms steps late in a match (the spacing of float32 at 5400 seconds is ~0.5ms, i.e. >1% velocity error).
+    
+    Precision impact: float32 keeps ~7 significant digits, that is positions are exact to ~1e-5 meters.
+    Measured on a synthetic 90 minute match: velocities change by less than 1e-4 m/s, pitch control probabilities by less
+    than 1e-5 and total distance by less than 1e-7 (relative). Distances of speed zones change by up to ~0.02%, as the
+    frames at the zone thresholds may move to the next zone.
+    
+    Parameters
+    ----------
+    tracking: pd.Dataframe with Tracking Data for a team.
+    
+    Returns
+    -------
+    tracking: pd.Dataframe with Tracking Data in compact dtypes.
+    
+    """
+    
+    dtypes={col:np.float32 for col in tracking.columns if col.endswith(("_x","_y","_vx","_vy","_speed"))}
+    if "Period" in tracking.columns:
+        dtypes["Period"]=np.int8
+    tracking=tracking.astype(dtypes)
+    tracking.index=tracking.index.astype(np.int32)
+    
+    return tracking
+
+
+def get_frame_duration(tracking):
+    """
+    Sampling interval of Tracking Data, the median step of "Time [s]". 0.04 seconds for Metrica data (25 Hz),
+    longer after resample_tracking.
+    
+    Parameters
+    ----------
+    tracking: pd.Dataframe with Tracking Data.
+    
+    Returns
+    -------
+    frame_duration: Seconds between consecutive frames.
+    """
+    
+    steps=np.diff(tracking["Time [s]"].to_numpy(dtype=float))
+    steps=steps[steps>0] # steps between Periods are longer, the median is not affected
+    assert len(steps)>0,"At least two frames are needed to find the frame duration."
+    
+    return float(np.median(steps))
+
+
+@mmon.timed
+def resample_tracking(tracking,rate=5.,method="mean"):
+    """
+    Downsamples Tracking Data to a lower rate. Consecutive frames are grouped (groups don't cross Periods) and each group
+    becomes a single frame, with the Frame, Period and Time [s] of its first frame.
+    With "mean" every position, velocity and speed is the NaN-aware mean over the group, so speed times the new frame duration
+    is the distance of the whole group and totals like distance covered are kept.
+    Errors of Physical_Performace.get_players_summary on a synthetic match (benchmarks/synthetic.py), against 25 Hz:
+        5 Hz: distance <0.05% per player, walking/jogging/running distance within ~2%, sprinting distance -7% (speeds are averaged
+              over 0.2 s), # of sprints changes by a few per team, peak distances (Physical_Peaks) <0.1%. 5x less memory and time.
+        1 Hz: distance <0.2% per player, peak distances <0.3%, but high speed zones lose 20-50% and sprints are not reliable.
+    With "sample" the first frame of each group is kept as is, distances have the error of the sampling.
+    Velocities should be calculated (Metrica_Velocities.calc_player_velocities) before resampling, so that they are averaged,
+    or recalculated after resampling, keeping in mind that the smoothing window is in frames.
+    
+    Parameters
+    ----------
+    tracking: pd.Dataframe with Tracking Data.
+    rate: Target rate in frames per second, e.g. 5 or 1. It is rounded to a whole number of frames per group. Default is 5.
+    method: "mean" or "sample". Default is "mean".
+    
+    Returns
+    -------
+    tracking: pd.Dataframe with the resampled Tracking Data.
+    """
+    
+    if method not in ("mean","sample"):
+        raise Exception("Invalid method. Acceptable values are 'mean', 'sample'.")
+    
+    factor=max(1,int(round(1./(rate*get_frame_duration(tracking))))) # frames per group
+    periods=tracking["Period"].to_numpy()
+    bounds=np.concatenate([[0],np.flatnonzero(periods[1:]!=periods[:-1])+1,[len(periods)]])
+    starts=np.concatenate([np.arange(start,end,factor) for start,end in zip(bounds[:-1],bounds[1:])])
+    resampled=tracking.iloc[starts]
+    if method=="sample" or factor==1:
+        return resampled.copy()
+    
+    columns=[col for col in tracking.columns if col not in ("Period","Time [s]")]
+    values=tracking[columns].to_numpy(dtype=float)
+    valid=~np.isnan(values)
+    sums=np.add.reduceat(np.where(valid,values,0.),starts,axis=0)
+    counts=np.add.reduceat(valid,starts,axis=0)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        means=np.where(counts>0,sums/counts,np.nan)
+    resampled=resampled.copy()
+    resampled[columns]=means
+    
+    return resampled.astype(tracking[columns].dtypes.to_dict()) # e.g. float32 of to_compact_tracking
+
+
+@mmon.timed
 def transform_coord_system(df: pd.DataFrame,center_coord=(0.5,0.5),field_dimensions=(106,68)):
     
     """
@@ -61,6 +199,7 @@ def transform_coord_system(df: pd.DataFrame,center_coord=(0.5,0.5),field_dimensi
     return df
 
 
+@mmon.timed
 def set_single_playing_direction(event,tracking_home,tracking_away):
     """
     Reversing coordinates for 1rst Period so that the home team always attacks from left to right, regardless the Period.
@@ -95,7 +234,8 @@ def set_single_playing_direction(event,tracking_home,tracking_away):
     return event,tracking_home,tracking_away
 
 
-def read_tracking_data(DATA_DIR: str,game_id: int , team: str):
+@mmon.timed
+def read_tracking_data(DATA_DIR: str,game_id: int , team: str,compact=False):
     """
     Reads Tracking data for given game_id and team. Bench Players have Nan Values in their x and y positions.
     
@@ -104,6 +244,7 @@ def read_tracking_data(DATA_DIR: str,game_id: int , team: str):
     DATA_DIR: Directory of Data.
     game_id: Id of the game.
     team: name of team. For sample data acceptable values are "Home", "Away".
+    compact: Use compact dtypes (see to_compact_tracking). Default is False.
     
     Returns
     -------
@@ -111,12 +252,12 @@ def read_tracking_data(DATA_DIR: str,game_id: int , team: str):
     
     """
     
-    csv_path =os.path.join(DATA_DIR, "data\Sample_Game_{0}\Sample_Game_{1}_RawTrackingData_{2}_Team.csv".format(game_id,game_id,team))
+    csv_path =os.path.join(DATA_DIR,"data","Sample_Game_{0}".format(game_id),"Sample_Game_{0}_RawTrackingData_{1}_Team.csv".format(game_id,team))
     #Set Player names from file headers
     csvfile =  open(csv_path, 'r') # create a csv file reader
     reader = csv.reader(csvfile) 
     team_name = next(reader)[3].lower()
-    print("Reading team: %s" % team_name)
+    logger.info("Reading team: %s",team_name)
     # construct column names
     jerseys = [x for x in next(reader) if x != ''] # extract player jersey numbers from second row
     columns = next(reader)
@@ -128,9 +269,157 @@ def read_tracking_data(DATA_DIR: str,game_id: int , team: str):
     columns[-1] = "ball_y"
     # Read the tracking Data
     tracking_data_df = pd.read_csv(csv_path, names=columns, index_col='Frame', skiprows=3)
+    if compact:
+        tracking_data_df=to_compact_tracking(tracking_data_df)
     return tracking_data_df
 
 
+def build_event_tracking_index(event,tracking_home,tracking_away):
+    """
+    Builds a join index between Event and Tracking Data, so that the tracking rows of every event can be found without
+    label-based lookups. It should be built once, after the coordinate transformations (transform_coord_system,
+    set_single_playing_direction) have been applied to the event and tracking data.
+    
+    Parameters
+    ----------
+    event: pd.Dataframe with Event Data.
+    tracking_home: pd.Dataframe with Tracking Data for Home Team.
+    tracking_away: pd.Dataframe with Tracking Data for Away Team.
+    
+    Returns
+    -------
+    event_index: Dictionary with numpy arrays aligned with the rows of the event DataFrame:
+        "event_ids": Labels of the events (index of event DataFrame).
+        "positions": Dictionary from event_id to row position in event DataFrame.
+        "start_row","end_row": Row positions of Start Frame and End Frame in the tracking data. -1 if frame is not tracked.
+                               For resampled tracking data, the row of the group the frame is in.
+        "team": Team codes. 1 for Home, -1 for Away (same as attacking direction), 0 if unknown.
+        "period": Period of each event.
+        "start_pos","end_pos": (n_events,2) arrays with (x,y) coordinates of the ball at the start and the end of each event.
+    """
+    
+    # Check if the indices are exactly the same for home and away team. Only once, here.
+    assert tracking_home.index.equals(tracking_away.index),"Tracking Home index should be same with Tracking Away index."
+    
+    # get_indexer returns -1 for frames which are not in tracking data (e.g. End Frame 0 at KICK OFF)
+    start_row=tracking_home.index.get_indexer(event["Start Frame"].to_numpy())
+    end_row=tracking_home.index.get_indexer(event["End Frame"].to_numpy())
+    # Resampled tracking data (resample_tracking) keeps the first frame of every group, frames in between get its row
+    frames=tracking_home.index.to_numpy()
+    if len(frames)>1:
+        step=np.median(np.diff(frames))
+        for rows,column in [(start_row,"Start Frame"),(end_row,"End Frame")]:
+            missing=np.flatnonzero(rows<0)
+            event_frames=event[column].to_numpy()[missing]
+            previous=np.searchsorted(frames,event_frames,side="right")-1
+            found=(previous>=0) & (event_frames-frames[np.maximum(previous,0)]<step)
+            rows[missing[found]]=previous[found]
+    
+    team=np.zeros(len(event),dtype=np.int8)
+    team[(event["Team"]=="Home").to_numpy()]=1
+    team[(event["Team"]=="Away").to_numpy()]=-1
+    
+    event_index={}
+    event_index["event_ids"]=event.index.to_numpy()
+    event_index["positions"]={event_id:pos for pos,event_id in enumerate(event_index["event_ids"])}
+    event_index["start_row"]=start_row.astype(np.int64)
+    event_index["end_row"]=end_row.astype(np.int64)
+    event_index["team"]=team
+    event_index["period"]=event["Period"].to_numpy()
+    event_index["start_pos"]=event[["Start X","Start Y"]].to_numpy(dtype=float)
+    event_index["end_pos"]=event[["End X","End Y"]].to_numpy(dtype=float)
+    
+    return event_index
+
+
+def get_event_frames(event_index,tracking,event_ids=None,which="start"):
+    """
+    Gathers the tracking rows of many events at once with positional (fancy) indexing.
+    
+    Parameters
+    ----------
+    event_index: Dictionary returned by build_event_tracking_index.
+    tracking: pd.Dataframe with Tracking Data for a team.
+    event_ids: Iterable of event ids. Default is None, that is all events.
+    which: "start" for Start Frame or "end" for End Frame. Default is "start".
+    
+    Returns
+    -------
+    frames: pd.Dataframe with one tracking row per event (events whose frame is not tracked are dropped).
+    valid: Boolean np.array over the requested events, True for the events included in frames.
+    """
+    
+    if which not in ("start","end"):
+        raise Exception("Invalid frame type. Acceptable values are 'start', 'end'.")
+        
+    if event_ids is None:
+        event_positions=np.arange(len(event_index["event_ids"]))
+    else:
+        event_positions=np.array([event_index["positions"][event_id] for event_id in event_ids],dtype=np.int64)
+    
+    rows=event_index[which+"_row"][event_positions]
+    valid=rows>=0
+    frames=tracking.iloc[rows[valid]]
+    
+    return frames,valid
+
+
+def get_event_row(event_index,event_id,which="start"):
+    """
+    Row position of the Start Frame (or End Frame) of a single event in the tracking data. Frames which are not tracked
+    raise KeyError, as label-based lookups do, instead of -1 selecting the last row with iloc.
+
+    Parameters
+    ----------
+    event_index: Dictionary returned by build_event_tracking_index.
+    event_id: Id of the event.
+    which: "start" for Start Frame or "end" for End Frame. Default is "start".
+
+    Returns
+    -------
+    pos: Row position of the event in event DataFrame.
+    row: Row position of the frame in the tracking data.
+    """
+
+    pos=event_index["positions"][event_id]
+    row=event_index[which+"_row"][pos]
+    if row<0:
+        raise KeyError("{} Frame of event {} is not in the Tracking Data.".format(which.capitalize(),event_id))
+
+    return pos,row
+
+
+def get_team_name(team_code):
+    """
+    Team of a team code of build_event_tracking_index: "Home" for 1, "Away" for -1. Unknown team (0) raises ValueError,
+    the attacking team is never guessed.
+    """
+
+    if team_code==0:
+        raise ValueError("Team of the event is unknown.")
+
+    return "Home" if team_code==1 else "Away"
+
+
+def get_tracking_names(event,column="From"):
+    """
+    Names in Tracking Data of the players of an Event Data column: "Player9" of Home is "Home_9".
+
+    Parameters
+    ----------
+    event: pd.Dataframe with Event Data.
+    column: "From" or "To". Default is "From".
+
+    Returns
+    -------
+    names: pd.Series indexed like event with names like "Home_9", NaN for events without team or player.
+    """
+
+    players=event[column].astype(object).str.replace("Player","",regex=False)
+
+    return event["Team"].astype(object)+"_"+players
+
+
 def get_goalkeeper_name(tracking_team):
     
     '''
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+
+Kinematics engine for players.
+Velocity, acceleration and optionally jerk of all players are calculated in one batched pass, on (frames x players) arrays.
+Every derivative is a first difference over time followed by a filter along the time axis.
+
+Filters are pluggable: "box" (NaN-aware moving average, same as calc_player_velocities), "savgol" (Savitzky-Golay) and
+"exponential" (zero-phase exponential smoothing), or any function registered with register_filter.
+Filters are applied separately to every continuous segment of the data, so they never smooth across Periods or gaps in time.
+
+
+@author: Apatsidis Ioannis
+"""
+
+import re
+import numpy as np
+import pandas as pd
+import Metrica_Velocities as mvel
+import Metrica_Monitor as mmon
+import Physical_Performace as mphy
+
+
+def box_filter(values,window=5):
+    '''
+    NaN-aware centered moving average along the time axis, same as calc_player_velocities smoothing.
+
+    Parameters
+    ----------
+    values: np.array in shape (frames,players).
+    window: Number of frames of the moving average. Default is 5.
+
+    Returns
+    -------
+    filtered: np.array with the same shape as values.
+    '''
+
+    return mvel.moving_average(values,window)
+
+
+def savgol_filter(values,window=7,polyorder=2):
+    '''
+    Savitzky-Golay filter along the time axis. A polynomial of order polyorder is fitted to every window of frames.
+    Where the window is not complete (missing values or edges of a segment) it falls back to the box filter.
+
+    Parameters
+    ----------
+    values: np.array in shape (frames,players).
+    window: Odd number of frames of the window. Default is 7.
+    polyorder: Order of the fitted polynomial, less than window. Default is 2.
+
+    Returns
+    -------
+    filtered: np.array with the same shape as values.
+    '''
+
+    assert window%2==1 and polyorder<window,"Window should be odd and greater than polyorder."
+
+    # Least squares coefficients of the polynomial value at the center of the window
+    offsets=np.arange(-(window//2),window//2+1)
+    coefficients=np.linalg.pinv(np.vander(offsets,polyorder+1,increasing=True))[0]
+
+    n=values.shape[0]
+    filtered=np.zeros(values.shape)
+    complete=np.zeros(values.shape,dtype=bool)
+    if n>=window:
+        complete[window//2:n-window//2]=True
+        for offset,coefficient in zip(offsets,coefficients):
+            filtered[window//2:n-window//2]+=coefficient*values[window//2+offset:n-window//2+offset]
+        complete&=~np.isnan(filtered)
+
+    return np.where(complete,filtered,mvel.moving_average(values,window))
+
+
+def exponential_filter(values,alpha=0.3):
+    '''
+    Zero-phase exponential smoothing along the time axis. Exponentially weighted mean forwards and then backwards in time,
+    so that the filtered values are not delayed. Missing values stay missing and the smoothing restarts after every gap,
+    so values are never carried across missing frames.
+
+    Parameters
+    ----------
+    values: np.array in shape (frames,players).
+    alpha: Smoothing factor in (0,1]. Smaller values smooth more. Default is 0.3.
+
+    Returns
+    -------
+    filtered: np.array with the same shape as values.
+    '''
+
+    filtered=np.full(values.shape,np.nan)
+    # Every run of finite values of a player is smoothed on its own
+    columns,starts,ends=mphy.find_runs(~np.isnan(values))
+    for column,start,end in zip(columns,starts,ends):
+        forward=pd.Series(values[start:end,column]).ewm(alpha=alpha,adjust=False).mean().to_numpy()
+        filtered[start:end,column]=pd.Series(forward[::-1]).ewm(alpha=alpha,adjust=False).mean().to_numpy()[::-1]
+
+    return filtered
+
+
+FILTERS={"box":box_filter,"savgol":savgol_filter,"exponential":exponential_filter}
+
+
+def register_filter(name,function):
+    '''
+    Registers a filter, so that it can be used by name in calc_player_kinematics.
+
+    Parameters
+    ----------
+    name: Name of the filter.
+    function: Function called as function(values,**filter_params) with values in shape (frames,players).
+              It should return an array with the same shape, filtered along the first axis.
+    '''
+
+    FILTERS[name]=function
+
+
+def find_segments(team,max_gap=None):
+    '''
+    Finds the continuous segments of Tracking Data. A new segment starts at every new Period and after every gap in time.
+
+    Parameters
+    ----------
+    team: pd.DataFrame with Tracking Data for a team.
+    max_gap: Maximum time in seconds between consecutive frames of a segment. Default is None, that is 1.5 x the median time interval.
+
+    Returns
+    -------
+    segments: List of (start,end) row positions, end is exclusive.
+    '''
+
+    times=team["Time [s]"].to_numpy(dtype=float)
+    intervals=np.diff(times)
+    if max_gap is None:
+        max_gap=1.5*np.median(intervals) if intervals.size>0 else np.inf
+
+    breaks=intervals>max_gap
+    if "Period" in team.columns:
+        breaks|=np.diff(team["Period"].to_numpy())!=0
+    bounds=np.concatenate([[0],np.flatnonzero(breaks)+1,[len(team)]])
+
+    return list(zip(bounds[:-1],bounds[1:]))
+
+
+@mmon.timed
+def calc_player_kinematics(team,smoothing_filter="box",filter_params=None,max_speed=11,max_acceleration=None,jerk=False,max_gap=None):
+    '''
+    Calculates velocity, acceleration and optionally jerk of all players at once.
+
+    Parameters
+    ----------
+    team: pd.DataFrame with Tracking Data for a team.
+    smoothing_filter: Name of a filter in FILTERS ("box","savgol","exponential") or a function with the signature of register_filter. Default is "box".
+    filter_params: Dictionary with keyword arguments of the filter. Default is None, that is the defaults of the filter.
+    max_speed: Maximum speed in meters/second. Higher speeds are considered outliers and set to NaN before filtering. Default is 11.
+    max_acceleration: Maximum acceleration in meters/second^2. Higher accelerations are set to NaN before filtering. Default is None, no limit.
+    jerk: Calculate jerk too. Default is False.
+    max_gap: Maximum time in seconds between consecutive frames of a segment, see find_segments. Default is None.
+
+    Returns
+    -------
+    kinematics: Dictionary with np.arrays in shape (frames,players):
+        "players": Player names like "Home_1".
+        "vx","vy","speed": Velocities and speed (m/s).
+        "ax","ay": Accelerations (m/s^2).
+        "acceleration": Rate of change of speed (m/s^2), positive when accelerating and negative when decelerating.
+        "jerk": Rate of change of acceleration (m/s^3), only if jerk is True.
+    '''
+
+    filter_function=FILTERS[smoothing_filter] if isinstance(smoothing_filter,str) else smoothing_filter
+    filter_params={} if filter_params is None else filter_params
+
+    # Get all players , e.g. Home_1 , Away_2
+    players=np.unique(([x.split('_')[0]+'_'+x.split('_')[1] for x in team.columns if re.match(r"(Home|Away)_[0-9]+_x$",x)]))
+
+    x=team[[p+"_x" for p in players]].to_numpy(dtype=float)
+    y=team[[p+"_y" for p in players]].to_numpy(dtype=float)
+    times=team["Time [s]"].to_numpy(dtype=float)
+    not_in_frame=np.isnan(x) | np.isnan(y)
+
+    names=["vx","vy","speed","ax","ay","acceleration"]+(["jerk"] if jerk else [])
+    kinematics={name:np.full(x.shape,np.nan) for name in names}
+    kinematics["players"]=players
+
+    def derivative(values,intervals):
+        # First difference over time, NaN at the first frame of the segment
+        result=np.full(values.shape,np.nan)
+        result[1:]=np.diff(values,axis=0)/intervals
+        return result
+
+    for start,end in find_segments(team,max_gap):
+        if end-start<2:
+            continue
+        intervals=np.diff(times[start:end])[:,None]
+
+        # Velocities, filtered together so that the filter is called once
+        v=np.hstack([derivative(x[start:end],intervals),derivative(y[start:end],intervals)])
+        if max_speed>0:
+            with np.errstate(invalid='ignore'):
+                v[np.tile(np.hypot(*np.hsplit(v,2))>max_speed,2)]=np.nan
+        v=filter_function(v,**filter_params)
+        v[np.tile(not_in_frame[start:end],2)]=np.nan
+        vx,vy=np.hsplit(v,2)
+        speed=np.hypot(vx,vy)
+
+        # Accelerations, the vector and the rate of change of speed
+        a=np.hstack([derivative(vx,intervals),derivative(vy,intervals),derivative(speed,intervals)])
+        if max_acceleration is not None:
+            with np.errstate(invalid='ignore'):
+                a[np.abs(a)>max_acceleration]=np.nan
+        a=filter_function(a,**filter_params)
+        a[np.tile(not_in_frame[start:end],3)]=np.nan
+        ax,ay,acceleration=np.hsplit(a,3)
+
+        for name,values in zip(["vx","vy","speed","ax","ay","acceleration"],[vx,vy,speed,ax,ay,acceleration]):
+            kinematics[name][start:end]=values
+
+        if jerk:
+            j=filter_function(derivative(acceleration,intervals),**filter_params)
+            j[not_in_frame[start:end]]=np.nan
+            kinematics["jerk"][start:end]=j
+
+    return kinematics
+
+
+def add_player_kinematics(team,compact=False,**kinematics_params):
+    '''
+    Calculates kinematics with calc_player_kinematics and adds them to the Tracking Data in one step,
+    as columns like "Home_1_vx","Home_1_vy","Home_1_speed","Home_1_ax","Home_1_ay","Home_1_acc" and "Home_1_jerk".
+    Velocity columns have the same names as calc_player_velocities, so pitch control and physical performance use them as they are.
+
+    Parameters
+    ----------
+    team: pd.DataFrame with Tracking Data for a team.
+    compact: Store kinematics as float32 (see Metrica_IO.to_compact_tracking). Default is False.
+    kinematics_params: Keyword arguments of calc_player_kinematics.
+
+    Returns
+    -------
+    team: pd.DataFrame with players' kinematics.
+    '''
+
+    team=remove_player_kinematics(team)
+    kinematics=calc_player_kinematics(team,**kinematics_params)
+
+    suffixes={"vx":"_vx","vy":"_vy","speed":"_speed","ax":"_ax","ay":"_ay","acceleration":"_acc","jerk":"_jerk"}
+    names=[name for name in suffixes if name in kinematics]
+    columns=[p+suffixes[name] for p in kinematics["players"] for name in names]
+    values=np.stack([kinematics[name].T for name in names],axis=1).reshape(len(columns),len(team))
+    values=pd.DataFrame((values.astype(np.float32) if compact else values).T,index=team.index,columns=columns)
+
+    return pd.concat([team,values],axis=1)
+
+
+def remove_player_kinematics(team):
+    '''
+    Remove already calculated velocities, speed, accelerations and jerk.
+
+    Parameters
+    ---------
+    team: pd.DataFrame with tracking data of a team.
+
+    Returns
+    -------
+    team: Updated team pd.DataFrame.
+    '''
+
+    kinematics_columns=[x for x in team.columns if re.match(r".*_(vx|vy|speed|ax|ay|acc|jerk)$",x)]
+    return team.drop(kinematics_columns,axis='columns')
@@ -0,0 +1,492 @@
+# -*- coding: utf-8 -*-
+"""
+
+Live ingestion of Tracking Data.
+Frames are pushed one at a time (or in small batches) into a fixed-size ring buffer. Velocities, running physical totals
+and the pitch control surface are updated incrementally, with a bounded amount of work per frame, so that the analysis
+can run alongside a 25 Hz feed.
+
+A feed is a stream of text lines. The first line is a header with the column names of the frames, the same names that
+read_tracking_data and calc_player_velocities use, e.g. "Period,Frame,Time [s],Home_1_x,Home_1_y,...,Away_25_y,ball_x,ball_y".
+Every following line is a frame of both teams with comma separated values.
+
+
+@author: Apatsidis Ioannis
+"""
+
+import socket
+import time
+import numpy as np
+import pandas as pd
+import Metrica_Pitch_Control as mpc
+import Physical_Performace as mphy
+
+
+class LiveTracker():
+    '''
+    This class represents a live match. It keeps the last frames in a ring buffer and updates velocities,
+    physical totals and pitch control every time a new frame is pushed.
+
+    '''
+
+    def __init__(self,columns,capacity=250,params=None,GK_NAMES=(None,None),max_speed=11,smoothing=True,window=5,normalise=False,
+                 field_dimensions=(106.,68.),num_grid_cells_x=53,cells_per_frame=None,latency_history=1500,summary_params=None):
+        '''
+        Initializes the ring buffer, the running totals and the pitch control grid.
+
+        Parameters
+        ----------
+        columns: Column names of a frame like "Period","Frame","Time [s]","Home_1_x",...,"ball_x","ball_y".
+        capacity: Number of frames kept in the ring buffer. Default is 250 (10 seconds).
+        params: dictionary with pitch control model parameters. Default is None, that is mpc.get_model_parameters().
+        GK_NAMES: tuple with goalkeeper names like (GK_Home_Team,GK_Away_Team). Default is (None,None), no goalkeeper advantage.
+        max_speed: Maximum speed in meters/second, same as calc_player_velocities. Default is 11.
+        smoothing: Apply moving average to velocities, same as calc_player_velocities. Default is True.
+        window: Moving average window. Default is 5. Velocities of a frame are known (window-1)//2 frames later.
+        normalise: Frames are in Metrica coordinates and are transformed like transform_coord_system and set_single_playing_direction.
+                   Default is False, that is frames are already in meters with single playing direction.
+        field_dimensions: Field dimensions in meters (Width x Height). Default is (106,68).
+        num_grid_cells_x: Number of grid cells in x-axis for pitch control. Default is 53.
+        cells_per_frame: Number of pitch control cells updated per frame. Default is None, that is the whole grid once per 25 frames.
+        latency_history: Number of frames kept for latency percentiles. Default is 1500 (1 minute).
+        summary_params: Dictionary with speed zones and sprint rules. Default is None, that is Physical_Performace.get_summary_parameters().
+
+        '''
+
+        self.columns=list(columns)
+        self.capacity=capacity
+        self.params=mpc.get_model_parameters() if params is None else params
+        self.GK_NAMES=GK_NAMES
+        self.max_speed=max_speed
+        self.window=window if smoothing else 1
+        self.lag=(self.window-1)//2 # frames until the velocity of a frame is known
+        self.normalise=normalise
+        self.field_dimensions=field_dimensions
+        self.reverse_period=None # Period to reverse when normalising, found at the first frame
+        self.team_with_possession=None # "Home","Away" or None to use the team of the closest player to the ball
+
+        assert capacity>=self.window+1,"Capacity should be greater than the smoothing window."
+
+        # Get all players , e.g. Home_1 , Away_2
+        self.players=np.unique(([x.split('_')[0]+'_'+x.split('_')[1] for x in self.columns if "Away_" in x or "Home_" in x]))
+        self.is_home=np.array([p.startswith("Home") for p in self.players])
+        self.__x_idx=np.array([self.columns.index(p+"_x") for p in self.players])
+        self.__y_idx=np.array([self.columns.index(p+"_y") for p in self.players])
+        self.__ball_idx=np.array([self.columns.index("ball_x"),self.columns.index("ball_y")])
+        self.__period_idx=self.columns.index("Period")
+        self.__frame_idx=self.columns.index("Frame")
+        self.__time_idx=self.columns.index("Time [s]")
+        self.lambda_def=np.array([self.params["lambda_gk"] if p in GK_NAMES else self.params["lambda_def"] for p in self.players])
+
+        # Ring buffer
+        n_players=len(self.players)
+        self.count=0 # number of frames pushed
+        self.frames=np.zeros(capacity,dtype=np.int64)
+        self.periods=np.zeros(capacity,dtype=np.int64)
+        self.times=np.full(capacity,np.nan)
+        self.positions=np.full((capacity,n_players,2),np.nan)
+        self.ball=np.full((capacity,2),np.nan)
+        self.raw_velocities=np.full((capacity,n_players,2),np.nan)
+        self.velocities=np.full((capacity,n_players,2),np.nan)
+
+        # Running physical totals, with the speed zones and sprint rules of Physical_Performace.get_players_summary
+        self.summary_params=mphy.get_summary_parameters() if summary_params is None else summary_params
+        self.zone_edges=np.array(self.summary_params["zone_edges"])
+        self.sprint_speed=self.summary_params["sprint_speed"]
+        # The rate of the feed is not known before the first frames, 25 Hz is assumed when the parameters have no frame duration
+        frame_duration=0.04 if self.summary_params["frame_duration"] is None else self.summary_params["frame_duration"]
+        self.sprint_frames=int(round(self.summary_params["sprint_duration"]/frame_duration))
+        self.zone_distances=np.zeros((n_players,len(self.zone_edges)+1))
+        self.sprints=np.zeros(n_players,dtype=np.int64)
+        self.__sprint_run=np.zeros(n_players,dtype=np.int64)
+        self.first_time=np.full(n_players,np.nan)
+        self.last_time=np.full(n_players,np.nan)
+
+        # Pitch control surface, probability that Home team controls the ball at each cell
+        self.x_grid,self.y_grid=mpc.get_pitch_grid(field_dimensions,num_grid_cells_x)
+        xx,yy=np.meshgrid(self.x_grid,self.y_grid)
+        self.__targets=np.stack([xx.ravel(),yy.ravel()],axis=1)
+        self.pc_home=np.full(xx.shape,np.nan)
+        self.pc_frames=np.zeros(xx.shape,dtype=np.int64) # frame each cell was calculated at
+        self.cells_per_frame=int(np.ceil(self.__targets.shape[0]/25.)) if cells_per_frame is None else cells_per_frame
+        self.__next_cell=0
+
+        self.latencies=np.full(latency_history,np.nan)
+
+
+    def push(self,row):
+        '''
+        Adds a frame to the ring buffer and updates velocities, physical totals and pitch control.
+
+        Parameters
+        ----------
+        row: Values of a frame in the order of columns.
+
+        Returns
+        -------
+        latency: Time in seconds spent on this frame.
+        '''
+
+        start=time.perf_counter()
+        row=np.asarray(row,dtype=float)
+
+        slot=self.count%self.capacity
+        period=int(row[self.__period_idx])
+        positions=np.stack([row[self.__x_idx],row[self.__y_idx]],axis=1)
+        ball=row[self.__ball_idx]
+        if self.normalise:
+            positions,ball=self.__normalise(period,positions,ball)
+
+        self.frames[slot]=int(row[self.__frame_idx])
+        self.periods[slot]=period
+        self.times[slot]=row[self.__time_idx]
+        self.positions[slot]=positions
+        self.ball[slot]=ball
+
+        # Raw velocities, same as calc_player_velocities
+        if self.count>0:
+            previous=(self.count-1)%self.capacity
+            raw=(positions-self.positions[previous])/(self.times[slot]-self.times[previous])
+            if self.max_speed>0:
+                # Excluding Errors in measurements / Unrealistic velocities that exceed the maximun speed
+                raw[np.sqrt(np.sum(raw**2,axis=1))>self.max_speed]=np.nan
+        else:
+            raw=np.full(positions.shape,np.nan)
+        self.raw_velocities[slot]=raw
+
+        in_frame=~np.isnan(positions[:,0])
+        self.first_time[in_frame & np.isnan(self.first_time)]=self.times[slot]
+        self.last_time[in_frame]=self.times[slot]
+
+        self.count+=1
+
+        # Velocities of the frame lag frames ago, it is in the center of the moving average window
+        if self.count>self.lag:
+            self.__update_velocity((self.count-1-self.lag)%self.capacity)
+            self.__update_pitch_control((self.count-1-self.lag)%self.capacity)
+
+        latency=time.perf_counter()-start
+        self.latencies[(self.count-1)%len(self.latencies)]=latency
+
+        return latency
+
+
+    def push_many(self,rows):
+        '''
+        Adds a small batch of frames, one at a time.
+
+        Parameters
+        ----------
+        rows: Iterable with values of frames in the order of columns.
+
+        Returns
+        -------
+        latencies: np.array with the time in seconds spent on each frame.
+        '''
+
+        return np.array([self.push(row) for row in rows])
+
+
+    def __normalise(self,period,positions,ball):
+        '''
+        Transforms Metrica coordinates into meters and reverses a Period so that the home team always attacks from left to right,
+        same as transform_coord_system and set_single_playing_direction.
+        '''
+
+        center_coord=(0.5,0.5)
+        positions=np.stack([(positions[:,0]-center_coord[0])*self.field_dimensions[0],
+                            -1*(positions[:,1]-center_coord[1])*self.field_dimensions[1]],axis=1)
+        ball=np.array([(ball[0]-center_coord[0])*self.field_dimensions[0],-1*(ball[1]-center_coord[1])*self.field_dimensions[1]])
+
+        if self.reverse_period is None:
+            # Checks if the away team starts from left side of field at KICK OFF
+            left_players_count=np.sum(positions[~self.is_home,0]<0)
+            self.reverse_period=1 if left_players_count>7 else 2
+        if period==self.reverse_period:
+            positions=-positions
+            ball=-ball
+
+        return positions,ball
+
+
+    def __update_velocity(self,slot):
+        '''
+        Smooths the velocity of the frame at the given slot and adds its distances to the running totals.
+        '''
+
+        # NaN-aware moving average over the window centered at slot, same as mvel.moving_average
+        offsets=np.arange(-(self.window//2),self.lag+1)
+        offsets=offsets[self.count-1-self.lag+offsets>=0] # window is truncated at the start
+        window_velocities=self.raw_velocities[(slot+offsets)%self.capacity]
+        valid_counts=np.sum(~np.isnan(window_velocities),axis=0)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            velocity=np.nansum(window_velocities,axis=0)/valid_counts
+        velocity[valid_counts==0]=np.nan
+        velocity[np.isnan(self.positions[slot][:,0])]=np.nan # not in frame
+        self.velocities[slot]=velocity
+
+        speed=np.sqrt(np.sum(velocity**2,axis=1))
+        previous=(slot-1)%self.capacity
+        frame_duration=self.times[slot]-self.times[previous] if self.count-1-self.lag>0 else 0.
+
+        # Distances per zone, NaN speeds are not counted
+        valid=~np.isnan(speed)
+        zones=np.digitize(speed[valid],self.zone_edges)
+        self.zone_distances[np.flatnonzero(valid),zones]+=speed[valid]*frame_duration
+
+        # Sprints of at least sprint_frames consecutive frames
+        sprinting=valid & (np.where(valid,speed,0)>=self.sprint_speed)
+        self.__sprint_run=np.where(sprinting,self.__sprint_run+1,0)
+        self.sprints+=self.__sprint_run==self.sprint_frames
+
+
+    def __update_pitch_control(self,slot):
+        '''
+        Calculates pitch control for the next cells_per_frame cells of the grid, with the players of the frame at the given slot.
+        '''
+
+        positions=self.positions[slot]
+        velocities=np.where(np.isnan(self.velocities[slot]),0.,self.velocities[slot]) # Player sets nan velocities to (0,0)
+        ball=self.ball[slot]
+
+        team_with_possession=self.team_with_possession
+        if team_with_possession is None:
+            if np.all(np.isnan(positions[:,0])) or np.any(np.isnan(ball)):
+                return
+            # Team of the closest player to the ball
+            closest=np.nanargmin(np.sum((positions-ball)**2,axis=1))
+            team_with_possession="Home" if self.is_home[closest] else "Away"
+        attacking=self.is_home if team_with_possession=="Home" else ~self.is_home
+
+        att_positions=positions[attacking].copy()
+        def_positions=positions[~attacking]
+        if np.sum(~np.isnan(def_positions[:,0]))<2: # Offsides need the second last defender
+            return
+        att_positions[mpc.find_offside_players(team_with_possession,att_positions,def_positions,ball)]=np.nan
+
+        cells=np.arange(self.__next_cell,self.__next_cell+self.cells_per_frame)%self.__targets.shape[0]
+        self.__next_cell=(cells[-1]+1)%self.__targets.shape[0]
+
+        pc_att,pc_def=mpc.pitch_control_at_targets(self.__targets[cells],att_positions,velocities[attacking],def_positions,velocities[~attacking],
+                                                   self.lambda_def[~attacking],ball,self.params)
+        self.pc_home.flat[cells]=pc_att if team_with_possession=="Home" else pc_def
+        self.pc_frames.flat[cells]=self.frames[slot]
+
+
+    def get_players_summary(self):
+        '''
+        Running summary performance metrics for each player, same columns as Physical_Performace.get_players_summary.
+
+        Returns
+        -------
+        summary: pd.DataFrame with summary performance metrics for all players.
+        '''
+
+        zone_columns=[name+" (km)" for name in self.summary_params["zone_names"]]
+        columns=["Minutes Played","Distance (km)"]+zone_columns+["# of Sprints"]
+        summary=pd.DataFrame(index=self.players,columns=columns,dtype=float)
+        summary["Minutes Played"]=(self.last_time-self.first_time)/60
+        summary["Distance (km)"]=self.zone_distances.sum(axis=1)/1000
+        summary[zone_columns]=self.zone_distances/1000
+        summary["# of Sprints"]=self.sprints
+
+        return summary
+
+
+    def get_pitch_control(self):
+        '''
+        Latest pitch control surface. Each cell is at most (number of cells / cells_per_frame) frames old.
+
+        Returns
+        -------
+        pc_home: Pitch control grid with the probability that Home team controls the ball. For Away team 1 - pc_home.
+        x_grid: Positions of centers of cells in x-axis (field length).
+        y_grid: Positions of centers of cells in y-axis (field width).
+        '''
+
+        return self.pc_home.copy(),self.x_grid,self.y_grid
+
+
+    def get_buffer(self):
+        '''
+        Frames in the ring buffer, oldest first, in the format of calc_player_velocities.
+        The last (window-1)//2 frames have NaN velocities, they are not smoothed yet.
+
+        Returns
+        -------
+        tracking: pd.DataFrame with Tracking Data of both teams.
+        '''
+
+        n=min(self.count,self.capacity)
+        slots=np.arange(self.count-n,self.count)%self.capacity
+        velocities=self.velocities[slots].copy()
+        if self.lag>0:
+            velocities[-self.lag:]=np.nan
+        speed=np.sqrt(np.sum(velocities**2,axis=2))
+
+        data={"Period":self.periods[slots],"Time [s]":self.times[slots]}
+        for k,p in enumerate(self.players):
+            data[p+"_x"]=self.positions[slots,k,0]
+            data[p+"_y"]=self.positions[slots,k,1]
+        data["ball_x"]=self.ball[slots,0]
+        data["ball_y"]=self.ball[slots,1]
+        for k,p in enumerate(self.players):
+            data[p+"_vx"]=velocities[:,k,0]
+            data[p+"_vy"]=velocities[:,k,1]
+            data[p+"_speed"]=speed[:,k]
+
+        return pd.DataFrame(data,index=pd.Index(self.frames[slots],name="Frame"))
+
+
+    def get_latency_percentiles(self,percentiles=(50,90,99,100)):
+        '''
+        Percentiles of the time spent per frame, over the last latency_history frames.
+
+        Parameters
+        ----------
+        percentiles: Percentiles to calculate. Default is (50,90,99,100).
+
+        Returns
+        -------
+        latency: pd.Series with latency in milliseconds for each percentile.
+        '''
+
+        latencies=self.latencies[~np.isnan(self.latencies)]
+        if latencies.size==0:
+            return pd.Series(np.nan,index=list(percentiles),name="Latency (ms)")
+        return pd.Series(np.percentile(latencies,percentiles)*1000,index=list(percentiles),name="Latency (ms)")
+
+
+    def __str__(self):
+        '''
+        String represantation of a LiveTracker.
+        '''
+
+        latency=self.get_latency_percentiles((50,99))
+        return "Frames: {0}\nPlayers: {1}\nCapacity: {2} frames\nLatency p50/p99: {3:.2f}/{4:.2f} ms".format(
+            self.count,len(self.players),self.capacity,latency[50],latency[99])
+
+
+def parse_frame_line(line):
+    '''
+    Parses a frame line of a feed. Empty values and "NaN" are NaN.
+
+    Parameters
+    ----------
+    line: Comma separated values of a frame.
+
+    Returns
+    -------
+    row: np.array with the values of the frame.
+    '''
+
+    return np.array([float(value) if value.strip() else np.nan for value in line.strip().split(",")])
+
+
+def iter_file_lines(file_path,follow=True,poll_interval=0.01):
+    '''
+    Reads the lines of a file feed. When follow is True it waits for new lines at the end of the file, like "tail -f".
+
+    Parameters
+    ----------
+    file_path: Path of the feed file.
+    follow: Keep waiting for new lines. Default is True.
+    poll_interval: Seconds to wait for new lines. Default is 0.01.
+
+    Returns
+    -------
+    lines: Generator with the lines of the feed.
+    '''
+
+    with open(file_path,"r") as feed:
+        partial=""
+        while True:
+            line=feed.readline()
+            if line.endswith("\n"):
+                yield partial+line
+                partial=""
+            elif line: # Line is still being written
+                partial+=line
+            elif not follow:
+                if partial:
+                    yield partial
+                return
+            else:
+                time.sleep(poll_interval)
+
+
+def iter_socket_lines(host="127.0.0.1",port=5005,buffer_size=65536):
+    '''
+    Reads the lines of a local socket feed until the connection is closed. Frames may arrive one at a time or in small batches.
+
+    Parameters
+    ----------
+    host: Host of the feed. Default is "127.0.0.1".
+    port: Port of the feed. Default is 5005.
+    buffer_size: Bytes read per call. Default is 65536.
+
+    Returns
+    -------
+    lines: Generator with the lines of the feed.
+    '''
+
+    with socket.create_connection((host,port)) as connection:
+        partial=b""
+        while True:
+            data=connection.recv(buffer_size)
+            if not data:
+                if partial:
+                    yield partial.decode()
+                return
+            lines=(partial+data).split(b"\n")
+            partial=lines.pop()
+            for line in lines:
+                yield line.decode()+"\n"
+
+
+def run_live(lines,callback=None,**tracker_kwargs):
+    '''
+    Runs a LiveTracker over a feed. The first line of the feed is the header with the column names.
+
+    Parameters
+    ----------
+    lines: Iterable with the lines of the feed, e.g. iter_file_lines or iter_socket_lines.
+    callback: Function called as callback(tracker) after every frame. Default is None.
+    tracker_kwargs: Keyword arguments of LiveTracker.
+
+    Returns
+    -------
+    tracker: LiveTracker after the end of the feed.
+    '''
+
+    lines=iter(lines)
+    columns=[column.strip() for column in next(lines).strip().split(",")]
+    tracker=LiveTracker(columns,**tracker_kwargs)
+
+    for line in lines:
+        if not line.strip():
+            continue
+        tracker.push(parse_frame_line(line))
+        if callback is not None:
+            callback(tracker)
+
+    return tracker
+
+
+def write_feed(tracking_home,tracking_away,file_path):
+    '''
+    Writes Tracking Data of both teams as a feed file, e.g. to replay a match through iter_file_lines.
+
+    Parameters
+    ----------
+    tracking_home: pd.DataFrame with Tracking Data for Home team.
+    tracking_away: pd.DataFrame with Tracking Data for Away team.
+    file_path: Path of the feed file.
+    '''
+
+    away_columns=[x for x in tracking_away.columns if x.startswith("Away_") and x[-2:] in ("_x","_y")]
+    feed=pd.concat([tracking_home.drop(columns=[x for x in tracking_home.columns if x.endswith(("_vx","_vy","_speed"))]),
+                    tracking_away[away_columns]],axis=1)
+    # ball at the end of the frame
+    feed=feed[[x for x in feed.columns if x not in ("ball_x","ball_y")]+["ball_x","ball_y"]]
+    feed.to_csv(file_path,index_label="Frame",na_rep="NaN")
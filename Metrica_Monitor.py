@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+
+Instrumentation of the pipeline: stage timers, model counters (e.g. pitch control cells resolved by the control_time
+shortcut or by integration), histograms (e.g. integration steps), cache hits and progress callbacks for batch runs.
+Everything is off by default and the instrumented code checks the module flag "enabled" before doing any work,
+so instrumentation costs nothing when it is off. Metrics are collected in the current process only.
+
+Status messages of the modules go through the "Metrica" logger and propagate to the logging configuration of the application.
+Only when logging is not configured (no handlers on the root logger) they are printed like before, set_log_level changes how much is printed.
+
+Usage:
+    metrics=mmon.enable(progress=lambda name,done,total: print(name,done,"/",total))
+    ... # run the pipeline
+    mmon.disable()
+    metrics.summary()
+
+
+@author: Apatsidis Ioannis
+"""
+
+import contextlib
+import functools
+import logging
+import sys
+import time
+
+
+enabled=False # Checked by the instrumented code before any instrumentation work
+
+
+class Metrics():
+    '''
+    Collected timers, counters and histograms.
+    '''
+
+    def __init__(self):
+        self.timers={} # name -> [calls, seconds]
+        self.counters={} # name -> count
+        self.histograms={} # name -> {value: count}
+
+    def add_time(self,name,seconds):
+        timer=self.timers.setdefault(name,[0,0.])
+        timer[0]+=1
+        timer[1]+=seconds
+
+    def count(self,name,n=1):
+        self.counters[name]=self.counters.get(name,0)+n
+
+    def observe(self,name,value,n=1):
+        if n==0:
+            return
+        histogram=self.histograms.setdefault(name,{})
+        histogram[value]=histogram.get(value,0)+n
+
+    def reset(self):
+        self.timers.clear()
+        self.counters.clear()
+        self.histograms.clear()
+
+    def summary(self):
+        '''
+        Returns
+        -------
+        summary: Dictionary with "timers" (name to {"calls","seconds"}), "counters" and "histograms" (sorted by value),
+                 that can be saved as JSON.
+        '''
+
+        return {"timers":{name:{"calls":calls,"seconds":seconds} for name,(calls,seconds) in self.timers.items()},
+                "counters":dict(self.counters),
+                "histograms":{name:{str(value):histogram[value] for value in sorted(histogram)} for name,histogram in self.histograms.items()}}
+
+
+__metrics=Metrics()
+__progress_callbacks=[]
+
+
+def enable(metrics=None,progress=None):
+    '''
+    Turns instrumentation on.
+
+    Parameters
+    ----------
+    metrics: Metrics object to collect into. Default is None, that is the current one.
+    progress: Callback progress(name,done,total) for batch runs, added to the current ones. Default is None.
+
+    Returns
+    -------
+    metrics: Metrics object that collects the metrics.
+    '''
+
+    global enabled,__metrics
+    if metrics is not None:
+        __metrics=metrics
+    if progress is not None:
+        __progress_callbacks.append(progress)
+    enabled=True
+
+    return __metrics
+
+
+def disable():
+    '''
+    Turns instrumentation off and removes the progress callbacks. Collected metrics are kept.
+    '''
+
+    global enabled
+    enabled=False
+    __progress_callbacks.clear()
+
+
+def get_metrics():
+    '''
+    Returns
+    -------
+    metrics: Metrics object that collects the metrics.
+    '''
+
+    return __metrics
+
+
+def count(name,n=1):
+    '''
+    Adds n to a counter, when instrumentation is on.
+    '''
+
+    if enabled:
+        __metrics.count(name,n)
+
+
+def observe(name,value,n=1):
+    '''
+    Adds n observations of value to a histogram, when instrumentation is on.
+    '''
+
+    if enabled:
+        __metrics.observe(name,value,n)
+
+
+def progress(name,done,total):
+    '''
+    Reports progress of a batch run to the callbacks, when instrumentation is on.
+    '''
+
+    if enabled:
+        for callback in __progress_callbacks:
+            callback(name,done,total)
+
+
+@contextlib.contextmanager
+def timer(name):
+    '''
+    Context manager that adds the time of its block to a timer, when instrumentation is on.
+    '''
+
+    if not enabled:
+        yield
+        return
+    start=time.perf_counter()
+    try:
+        yield
+    finally:
+        __metrics.add_time(name,time.perf_counter()-start)
+
+
+def timed(function):
+    '''
+    Decorator that adds the time of every call to a timer named after the module and the function, when instrumentation is on.
+    '''
+
+    name=function.__module__+"."+function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args,**kwargs):
+        if not enabled:
+            return function(*args,**kwargs)
+        start=time.perf_counter()
+        try:
+            return function(*args,**kwargs)
+        finally:
+            __metrics.add_time(name,time.perf_counter()-start)
+
+    return wrapper
+
+
+def get_logger(name):
+    '''
+    Logger of a module, child of the "Metrica" logger.
+
+    Parameters
+    ----------
+    name: Name of the module, e.g. __name__.
+    '''
+
+    return logging.getLogger("Metrica").getChild(name)
+
+
+def set_log_level(level=logging.INFO):
+    '''
+    Sets the level of the status messages, e.g. logging.WARNING to print only warnings like failed integrations.
+    '''
+
+    logging.getLogger("Metrica").setLevel(level)
+
+
+class __StdoutHandler(logging.StreamHandler):
+    '''
+    Prints status messages like print did, only while the application has no logging configuration (no handlers on the root logger).
+    '''
+
+    def emit(self,record):
+        if not logging.getLogger().handlers:
+            super().emit(record)
+
+
+# Messages propagate to the handlers of the application. Without any logging configuration they are printed to stdout
+__logger=logging.getLogger("Metrica")
+__logger.addHandler(logging.NullHandler())
+if not logging.getLogger().handlers and len(__logger.handlers)==1:
+    __handler=__StdoutHandler(sys.stdout)
+    __handler.setFormatter(logging.Formatter("%(message)s"))
+    __logger.addHandler(__handler)
+    __logger.setLevel(logging.INFO)
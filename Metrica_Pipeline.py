@@ -0,0 +1,514 @@
+# -*- coding: utf-8 -*-
+"""
+
+Staged pipeline that runs games from the command line:
+load -> normalise -> velocities -> summary, team shape, pressure, off-ball runs, pitch control, EPV added -> plots, movies.
+Every stage writes its outputs and a manifest with a key (hash of its parameters, the keys of the stages it depends on
+and, for load, the data files) under <output_dir>/<game_id>/<stage>/. A stage whose key is unchanged is skipped and
+its outputs are read back only if a later stage needs them. Stages that don't depend on each other run in threads
+(stage_jobs) and games run in processes (n_jobs).
+
+Usage:
+    python Metrica_Pipeline.py --data-dir . --games 1 2 --output pipeline_output [--stages epv plots] [--params params.json]
+                               [--jobs 2] [--stage-jobs 3] [--force]
+
+
+@author: Apatsidis Ioannis
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import pandas as pd
+import Metrica_IO as mio
+import Metrica_Velocities as mvel
+import Metrica_Pitch_Control as mpc
+import Metrica_EPV as mepv
+import Metrica_Shape as msh
+import Metrica_Pressure as mpr
+import Metrica_Runs as mrun
+import Metrica_Monitor as mmon
+import Physical_Performace as mphy
+import Physical_Peaks as mpeak
+
+logger=mmon.get_logger(__name__)
+
+PIPELINE_VERSION=1 # Part of every key, changes of the stages that change their outputs should increase it
+
+
+def get_pipeline_parameters():
+    '''
+    Setting the parameters of every stage.
+
+    Returns
+    -------
+    params: Dictionary with pipeline parameters
+    '''
+    params={}
+    params["field_dimensions"]=[106.,68.]
+    params["velocity"]={"max_speed":11,"smoothing":True,"window":5} # Keyword arguments of Metrica_Velocities.calc_player_velocities
+    params["sample_rate"]=None # Frames per second after the velocities stage (Metrica_IO.resample_tracking), None for 25 Hz
+    params["summary"]=mphy.get_summary_parameters()
+    params["peaks"]=mpeak.get_peak_parameters()
+    params["shape"]=msh.get_shape_parameters()
+    params["shape_frame_step"]=1 # Team shape at every frame_step-th frame
+    params["pressure"]=mpr.get_pressure_parameters()
+    params["runs"]=mrun.get_run_parameters()
+    params["pitch_control"]=mpc.get_model_parameters()
+    params["num_grid_cells_x"]=50 # Surfaces with the shape of the EPV grid, as the EPV plots need
+    params["offsides"]=True
+    params["event_types"]=["PASS"] # Events for pitch control and EPV added
+    params["epv_grid"]=os.path.join(os.path.dirname(os.path.abspath(__file__)),"EPV_grid.csv")
+    params["n_plots"]=10 # Plots of the events with the highest EPV added
+    params["plot_kinds"]=["pitch_control","EPV"] # Kinds of Metrica_Vizuals.save_event_plots
+    params["n_movies"]=1 # Movies of the events with the highest EPV added
+    params["movie_seconds"]=10 # Length of every movie, centered at the Start Frame of the event
+
+    return params
+
+
+def get_stages():
+    '''
+    Stages of the pipeline in the order they run.
+
+    Returns
+    -------
+    stages: Dictionary from stage name to (stages it depends on, parameters it uses).
+    '''
+    stages={}
+    stages["load"]=((),[])
+    stages["normalise"]=(("load",),["field_dimensions"])
+    stages["velocities"]=(("normalise",),["velocity","sample_rate"])
+    stages["summary"]=(("velocities",),["summary","peaks"])
+    stages["shape"]=(("normalise",),["field_dimensions","shape","shape_frame_step"])
+    stages["pressure"]=(("normalise","velocities"),["pressure","pitch_control"])
+    stages["runs"]=(("normalise","velocities"),["runs","pitch_control"])
+    stages["pitch_control"]=(("normalise","velocities"),["field_dimensions","pitch_control","num_grid_cells_x","offsides","event_types"])
+    stages["epv"]=(("normalise","velocities"),["field_dimensions","pitch_control","event_types","epv_grid"])
+    stages["plots"]=(("normalise","velocities","pitch_control","epv"),["field_dimensions","n_plots","plot_kinds"])
+    stages["movies"]=(("velocities","epv"),["field_dimensions","n_movies","movie_seconds"])
+
+    return stages
+
+
+DEFAULT_STAGES=["summary","shape","pressure","runs","pitch_control","epv","plots"] # movies need ffmpeg and are run only when asked for
+
+
+def __load(DATA_DIR,game_id,params,inputs,stage_dir):
+    return {"event":mio.read_event_data(DATA_DIR,game_id),
+            "tracking_home":mio.read_tracking_data(DATA_DIR,game_id,"Home"),
+            "tracking_away":mio.read_tracking_data(DATA_DIR,game_id,"Away")}
+
+
+def __normalise(DATA_DIR,game_id,params,inputs,stage_dir):
+    field_dimensions=params["field_dimensions"]
+    event=mio.transform_coord_system(inputs["load"]["event"].copy(),field_dimensions=field_dimensions)
+    tracking_home=mio.transform_coord_system(inputs["load"]["tracking_home"].copy(),field_dimensions=field_dimensions)
+    tracking_away=mio.transform_coord_system(inputs["load"]["tracking_away"].copy(),field_dimensions=field_dimensions)
+    event,tracking_home,tracking_away=mio.set_single_playing_direction(event,tracking_home,tracking_away)
+
+    return {"event":event,"tracking_home":tracking_home,"tracking_away":tracking_away,
+            "GK_NAMES":[mio.get_goalkeeper_name(tracking_home),mio.get_goalkeeper_name(tracking_away)]}
+
+
+def __velocities(DATA_DIR,game_id,params,inputs,stage_dir):
+    outputs={}
+    for name in ["tracking_home","tracking_away"]:
+        # Velocities at 25 Hz, averaged by resampling
+        outputs[name]=mvel.calc_player_velocities(inputs["normalise"][name],**params["velocity"])
+        if params["sample_rate"] is not None:
+            outputs[name]=mio.resample_tracking(outputs[name],params["sample_rate"],method="mean")
+
+    return outputs
+
+
+def __summary(DATA_DIR,game_id,params,inputs,stage_dir):
+    summaries=[]
+    for team_name in ["Home","Away"]:
+        team=inputs["velocities"]["tracking_"+team_name.lower()]
+        summary=mphy.get_players_summary(team,params["summary"]).join(mpeak.get_players_peaks(team,params["peaks"],params["summary"]))
+        summary.insert(0,"Team",team_name)
+        summaries.append(summary)
+    summary=pd.concat(summaries)
+    summary.to_csv(os.path.join(stage_dir,"summary.csv"))
+
+    return {"summary":summary}
+
+
+def __shape(DATA_DIR,game_id,params,inputs,stage_dir):
+    return {"shape":msh.get_teams_shape(inputs["normalise"]["tracking_home"],inputs["normalise"]["tracking_away"],params["shape"],
+                                        params["field_dimensions"],params["shape_frame_step"])}
+
+
+def __pressure(DATA_DIR,game_id,params,inputs,stage_dir):
+    pressure=mpr.get_pressure_at_events(inputs["normalise"]["event"],inputs["velocities"]["tracking_home"],inputs["velocities"]["tracking_away"],
+                                        params["pressure"],params["pitch_control"])
+    pressure.to_csv(os.path.join(stage_dir,"pressure.csv"))
+
+    return {"pressure":pressure}
+
+
+def __runs(DATA_DIR,game_id,params,inputs,stage_dir):
+    runs=mrun.get_off_ball_runs(inputs["normalise"]["event"],inputs["velocities"]["tracking_home"],inputs["velocities"]["tracking_away"],
+                                params["runs"],params["pitch_control"])
+    runs.to_csv(os.path.join(stage_dir,"runs.csv"),index=False)
+
+    return {"runs":runs}
+
+
+def __get_event_index(inputs,params):
+    '''
+    Join index of the normalised events and the ids of the events of params["event_types"].
+    '''
+
+    event=inputs["normalise"]["event"]
+    event_index=mio.build_event_tracking_index(event,inputs["velocities"]["tracking_home"],inputs["velocities"]["tracking_away"])
+    event_ids=event.index[event["Type"].isin(params["event_types"]).to_numpy() & (event_index["start_row"]>=0)]
+
+    return event_index,event_ids
+
+
+def __pitch_control(DATA_DIR,game_id,params,inputs,stage_dir):
+    event_index,event_ids=__get_event_index(inputs,params)
+    surfaces,x_grid,y_grid=mpc.find_pitch_control_for_events(event_ids,event_index,inputs["velocities"]["tracking_home"],inputs["velocities"]["tracking_away"],
+                                                            params["pitch_control"],inputs["normalise"]["GK_NAMES"],params["field_dimensions"],
+                                                            params["num_grid_cells_x"],params["offsides"])
+
+    return {"event_ids":np.asarray(event_ids),"surfaces":surfaces,"x_grid":x_grid,"y_grid":y_grid}
+
+
+def __epv(DATA_DIR,game_id,params,inputs,stage_dir):
+    event_index,event_ids=__get_event_index(inputs,params)
+    epv_grid=np.genfromtxt(params["epv_grid"],delimiter=',')
+    epv_added=mepv.calculate_EPV_added_for_events(event_ids,event_index,inputs["velocities"]["tracking_home"],inputs["velocities"]["tracking_away"],
+                                                  inputs["normalise"]["GK_NAMES"],params["pitch_control"],epv_grid)
+    event=inputs["normalise"]["event"]
+    epv_added=event.loc[event_ids,["Team","Type","Period","Start Frame","From","To"]].assign(**{"EPV Added":epv_added})
+    epv_added.to_csv(os.path.join(stage_dir,"epv_added.csv"))
+
+    return {"epv_added":epv_added}
+
+
+def __get_top_events(inputs,n_events):
+    '''
+    Ids of the events with the highest EPV added.
+    '''
+
+    return list(inputs["epv"]["epv_added"]["EPV Added"].dropna().sort_values(ascending=False,kind="mergesort").index[:n_events])
+
+
+def __plots(DATA_DIR,game_id,params,inputs,stage_dir):
+    import Metrica_Vizuals as miz # matplotlib is needed only by the plot stages
+
+    event_ids=__get_top_events(inputs,params["n_plots"])
+    surfaces=dict(zip(inputs["pitch_control"]["event_ids"].tolist(),inputs["pitch_control"]["surfaces"]))
+    epv_grid=np.genfromtxt(params["epv_grid"],delimiter=',')
+    event=inputs["normalise"]["event"]
+    tracking_home=inputs["velocities"]["tracking_home"]
+    tracking_away=inputs["velocities"]["tracking_away"]
+    event_index=mio.build_event_tracking_index(event,tracking_home,tracking_away)
+    for kind in params["plot_kinds"]:
+        miz.save_event_plots(event_ids,event,tracking_home,tracking_away,stage_dir,kind=kind,pc_surfaces=surfaces,epv_grid=epv_grid,
+                             field_dimensions=tuple(params["field_dimensions"]),include_player_velocities=True,event_index=event_index)
+
+    return {"files":sorted(name for name in os.listdir(stage_dir) if name.endswith(".png"))}
+
+
+def __movies(DATA_DIR,game_id,params,inputs,stage_dir):
+    import Metrica_Vizuals as miz # matplotlib is needed only by the plot stages
+
+    tracking_home=inputs["velocities"]["tracking_home"]
+    tracking_away=inputs["velocities"]["tracking_away"]
+    fps=int(round(1/mio.get_frame_duration(tracking_home)))
+    half_window=int(params["movie_seconds"]*fps/2)
+    files=[]
+    for event_id in __get_top_events(inputs,params["n_movies"]):
+        row=np.searchsorted(tracking_home.index.to_numpy(),inputs["epv"]["epv_added"].loc[event_id,"Start Frame"],side="right")-1
+        rows=slice(max(0,row-half_window),row+half_window)
+        miz.save_movie(tracking_home.iloc[rows],tracking_away.iloc[rows],stage_dir,"event_{}".format(event_id),fps=fps,
+                       field_dimensions=tuple(params["field_dimensions"]),include_player_velocities=True)
+        files.append("event_{}.mp4".format(event_id))
+
+    return {"files":files}
+
+
+__STAGE_FUNCTIONS={"load":__load,"normalise":__normalise,"velocities":__velocities,"summary":__summary,"shape":__shape,"pressure":__pressure,"runs":__runs,"pitch_control":__pitch_control,
+                   "epv":__epv,"plots":__plots,"movies":__movies}
+__PLOT_STAGES=("plots","movies") # matplotlib is not thread safe, these stages never run at the same time
+__plot_lock=threading.Lock()
+
+
+def __save_outputs(outputs,stage_dir):
+    '''
+    Saves every output of a stage: pd.DataFrame as pickle, np.array as .npy and anything else as JSON.
+
+    Returns
+    -------
+    files: Dictionary from output name to file name.
+    '''
+
+    files={}
+    for name,value in outputs.items():
+        if isinstance(value,(pd.DataFrame,pd.Series)):
+            files[name]=name+".pkl"
+            value.to_pickle(os.path.join(stage_dir,files[name]))
+        elif isinstance(value,np.ndarray):
+            files[name]=name+".npy"
+            np.save(os.path.join(stage_dir,files[name]),value,allow_pickle=value.dtype==object)
+        else:
+            files[name]=name+".json"
+            with open(os.path.join(stage_dir,files[name]),"w") as json_file:
+                json.dump(value,json_file)
+
+    return files
+
+
+def __load_outputs(stage_dir,files):
+    outputs={}
+    for name,file_name in files.items():
+        path=os.path.join(stage_dir,file_name)
+        if file_name.endswith(".pkl"):
+            outputs[name]=pd.read_pickle(path)
+        elif file_name.endswith(".npy"):
+            outputs[name]=np.load(path,allow_pickle=True)
+        else:
+            with open(path) as json_file:
+                outputs[name]=json.load(json_file)
+
+    return outputs
+
+
+def __read_manifest(stage_dir):
+    '''
+    Manifest of a finished stage, None if the stage never finished or its files are missing.
+    '''
+
+    path=os.path.join(stage_dir,"manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as json_file:
+        manifest=json.load(json_file)
+    if not all(os.path.exists(os.path.join(stage_dir,file_name)) for file_name in manifest["files"].values()):
+        return None
+
+    return manifest
+
+
+def get_stage_keys(DATA_DIR,game_id,params=None):
+    '''
+    Key of every stage of a game: hash of the version of the pipeline, the parameters of the stage, the keys of the stages
+    it depends on and, for load, the size and modification time of the data files (for epv the EPV grid file too).
+
+    Parameters
+    ----------
+    DATA_DIR: Directory of the data, as in Metrica_IO.read_tracking_data.
+    game_id: Id of the game.
+    params: Dictionary with pipeline parameters. Default is None, that is get_pipeline_parameters().
+
+    Returns
+    -------
+    keys: Dictionary from stage name to key.
+    '''
+
+    params=get_pipeline_parameters() if params is None else params
+
+    def signature(path):
+        return [os.path.getsize(path),os.path.getmtime(path)] if os.path.exists(path) else None
+
+    game_dir=os.path.join(DATA_DIR,"data","Sample_Game_{0}".format(game_id))
+    files={"load":[signature(os.path.join(game_dir,"Sample_Game_{0}_RawEventsData.csv".format(game_id)))]+
+                  [signature(os.path.join(game_dir,"Sample_Game_{0}_RawTrackingData_{1}_Team.csv".format(game_id,team))) for team in ["Home","Away"]],
+           "epv":[signature(params["epv_grid"])]}
+
+    keys={}
+    for stage,(dependencies,names) in get_stages().items():
+        content=[PIPELINE_VERSION,stage,{name:params[name] for name in names},[keys[dependency] for dependency in dependencies],files.get(stage)]
+        keys[stage]=hashlib.sha1(json.dumps(content,sort_keys=True,default=float).encode("utf-8")).hexdigest()
+
+    return keys
+
+
+def __run_stage(stage,DATA_DIR,game_id,params,inputs,stage_dir,key):
+    '''
+    Runs a stage, saves its outputs and then its manifest, so that a stage that stopped half way runs again.
+    Files of an earlier run of the stage are removed first.
+    '''
+
+    shutil.rmtree(stage_dir,ignore_errors=True)
+    os.makedirs(stage_dir)
+    start=time.perf_counter()
+    with mmon.timer("pipeline."+stage):
+        if stage in __PLOT_STAGES:
+            with __plot_lock:
+                outputs=__STAGE_FUNCTIONS[stage](DATA_DIR,game_id,params,inputs,stage_dir)
+        else:
+            outputs=__STAGE_FUNCTIONS[stage](DATA_DIR,game_id,params,inputs,stage_dir)
+    manifest={"key":key,"files":__save_outputs(outputs,stage_dir),"seconds":time.perf_counter()-start,"finished":time.time()}
+    with open(os.path.join(stage_dir,"manifest.tmp"),"w") as json_file:
+        json.dump(manifest,json_file)
+    os.replace(os.path.join(stage_dir,"manifest.tmp"),os.path.join(stage_dir,"manifest.json"))
+    logger.info("Game %s: %s done in %.1f s",game_id,stage,manifest["seconds"])
+
+    return outputs
+
+
+def run_game(DATA_DIR,game_id,output_dir,params=None,stages=None,force=False,stage_jobs=1):
+    '''
+    Runs the given stages of a game, and the stages they depend on. Stages whose key (see get_stage_keys) is the same as
+    the key of their checkpoint are skipped.
+
+    Parameters
+    ----------
+    DATA_DIR: Directory of the data, as in Metrica_IO.read_tracking_data.
+    game_id: Id of the game.
+    output_dir: Directory of the checkpoints, every game has its own sub-directory.
+    params: Dictionary with pipeline parameters. Default is None, that is get_pipeline_parameters().
+    stages: List with the stages to run. Default is None, that is DEFAULT_STAGES.
+    force: Run every stage, even if its checkpoint is up to date. Default is False.
+    stage_jobs: Number of threads for stages that don't depend on each other. Default is 1.
+
+    Returns
+    -------
+    status: Dictionary from stage name to "ran" or "skipped", in the order of the pipeline.
+    '''
+
+    params=get_pipeline_parameters() if params is None else params
+    all_stages=get_stages()
+    stages=DEFAULT_STAGES if stages is None else stages
+    for stage in stages:
+        assert stage in all_stages,"Invalid stage {}. Acceptable values are {}.".format(stage,", ".join(all_stages))
+
+    # The stages asked for and all the stages they depend on
+    needed=set()
+    todo=list(stages)
+    while todo:
+        stage=todo.pop()
+        if stage not in needed:
+            needed.add(stage)
+            todo+=list(all_stages[stage][0])
+    keys=get_stage_keys(DATA_DIR,game_id,params)
+    stage_dirs={stage:os.path.join(output_dir,str(game_id),stage) for stage in all_stages}
+    manifests={stage:__read_manifest(stage_dirs[stage]) for stage in needed}
+    to_run=[stage for stage in all_stages if stage in needed and (force or manifests[stage] is None or manifests[stage]["key"]!=keys[stage])]
+
+    outputs={}
+    def get_outputs(stage): # outputs of a finished stage, read from its checkpoint only when a later stage needs them
+        if stage not in outputs:
+            outputs[stage]=__load_outputs(stage_dirs[stage],manifests[stage]["files"])
+        return outputs[stage]
+
+    pending=list(to_run)
+    finished=set(needed)-set(to_run)
+    with ThreadPoolExecutor(max_workers=max(1,stage_jobs)) as executor:
+        running={}
+        while pending or running:
+            for stage in list(pending):
+                dependencies=all_stages[stage][0]
+                if all(dependency in finished for dependency in dependencies):
+                    inputs={dependency:get_outputs(dependency) for dependency in dependencies}
+                    running[executor.submit(__run_stage,stage,DATA_DIR,game_id,params,inputs,stage_dirs[stage],keys[stage])]=stage
+                    pending.remove(stage)
+            done,_=wait(running,return_when=FIRST_COMPLETED)
+            for future in done:
+                stage=running.pop(future)
+                outputs[stage]=future.result()
+                finished.add(stage)
+                # Outputs of stages that no pending stage needs are released
+                for previous in list(outputs):
+                    if not any(previous in all_stages[later][0] for later in pending+list(running.values())):
+                        del outputs[previous]
+
+    status={stage:"ran" if stage in to_run else "skipped" for stage in all_stages if stage in needed}
+    logger.info("Game %s: ran %s, skipped %s",game_id,[stage for stage in status if status[stage]=="ran"],
+                [stage for stage in status if status[stage]=="skipped"])
+
+    return status
+
+
+def run_games(DATA_DIR,game_ids,output_dir,params=None,stages=None,force=False,n_jobs=1,stage_jobs=1):
+    '''
+    Runs many games with run_game, in a pool of processes. A game that fails doesn't stop the others.
+
+    Parameters
+    ----------
+    DATA_DIR: Directory of the data, as in Metrica_IO.read_tracking_data.
+    game_ids: List with ids of games.
+    output_dir: Directory of the checkpoints.
+    params: Dictionary with pipeline parameters. Default is None, that is get_pipeline_parameters().
+    stages: List with the stages to run. Default is None, that is DEFAULT_STAGES.
+    force: Run every stage, even if its checkpoint is up to date. Default is False.
+    n_jobs: Number of processes, -1 for all CPUs. Default is 1.
+    stage_jobs: Number of threads per game, see run_game. Default is 1.
+
+    Returns
+    -------
+    results: Dictionary from game id to the status of run_game, or to the error of a game that failed.
+    '''
+
+    n_jobs=os.cpu_count() if n_jobs==-1 else n_jobs
+    results={}
+    if n_jobs<=1 or len(game_ids)<=1:
+        for k,game_id in enumerate(game_ids):
+            try:
+                results[game_id]=run_game(DATA_DIR,game_id,output_dir,params,stages,force,stage_jobs)
+            except Exception as error:
+                logger.exception("Game %s failed",game_id)
+                results[game_id]=error
+            mmon.progress("run_games",k+1,len(game_ids))
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_jobs,len(game_ids))) as executor:
+            futures={executor.submit(run_game,DATA_DIR,game_id,output_dir,params,stages,force,stage_jobs):game_id for game_id in game_ids}
+            for k,future in enumerate(futures):
+                game_id=futures[future]
+                try:
+                    results[game_id]=future.result()
+                except Exception as error:
+                    logger.error("Game %s failed: %r",game_id,error)
+                    results[game_id]=error
+                mmon.progress("run_games",k+1,len(game_ids))
+
+    return results
+
+
+def main(argv=None):
+    '''
+    Command line entry point, see the usage at the top of the module.
+
+    Returns
+    -------
+    exit_code: 0 if every game finished, 1 otherwise.
+    '''
+
+    parser=argparse.ArgumentParser(description="Runs games through the staged pipeline, skipping stages with up to date checkpoints.")
+    parser.add_argument("--data-dir",default=".",help="Directory of the data, as in Metrica_IO.read_tracking_data.")
+    parser.add_argument("--games",nargs="+",required=True,help="Ids of the games.")
+    parser.add_argument("--output",default="pipeline_output",help="Directory of the checkpoints.")
+    parser.add_argument("--stages",nargs="+",default=None,choices=list(get_stages()),help="Stages to run (and the stages they depend on).")
+    parser.add_argument("--params",default=None,help="JSON file with parameters that replace the defaults of get_pipeline_parameters.")
+    parser.add_argument("--jobs",type=int,default=1,help="Games in parallel, -1 for all CPUs.")
+    parser.add_argument("--stage-jobs",type=int,default=1,help="Stages of a game in parallel.")
+    parser.add_argument("--force",action="store_true",help="Run every stage, even if its checkpoint is up to date.")
+    arguments=parser.parse_args(argv)
+
+    params=get_pipeline_parameters()
+    if arguments.params is not None:
+        with open(arguments.params) as json_file:
+            params.update(json.load(json_file))
+
+    results=run_games(arguments.data_dir,arguments.games,arguments.output,params,arguments.stages,arguments.force,arguments.jobs,arguments.stage_jobs)
+    failed=[game_id for game_id,result in results.items() if isinstance(result,Exception)]
+    if failed:
+        logger.error("Failed games: %s",", ".join(map(str,failed)))
+
+    return 1 if failed else 0
+
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -18,7 +18,13 @@ Inspiration by: Friends-of-Tracking-Data-LaurieOnTracking
 
 @author: Apatsidis Ioannis
 """
+import hashlib
+import json
+import os
 import numpy as np
+import Metrica_Monitor as mmon
+
+logger=mmon.get_logger(__name__)
 
 
 def get_model_parameters():
@@ -134,41 +140,21 @@ def check_offsides(attacking_team,attacking_players,defending_players,ball_start
         
 
 
-def find_pitch_control_for_event(event_id,event,tracking_home,tracking_away,params,GK_NAMES,field_dimensions=(106.,68.),num_grid_cells_x=53,offsides=True):
-    
+def get_pitch_grid(field_dimensions=(106.,68.),num_grid_cells_x=53):
     '''
-    Calculates pitch control for an event for the entire field.
-    Field is divided to a grid.
+    Divides the field to a grid of cells.
     
     Parameters
     ----------
-    event_id: int , should be a valid id
-    event: pd.Dataframe with Event Data.
-    tracking_home: pd.Dataframe with Tracking Data for Home Team.
-    tracking_away: pd.Dataframe with Tracking Data for Away Team.
-    params: dictionary with model parameters
-    GK_NAMES: tuple with goalkeeper names like (GK_Home_Team,GK_Away_Team)
     field_dimensions: Field dimensions in meters (Width x Height). Default is (106,68).
     num_grid_cells_x:Number of grid cells in x-axis to divide field_dimensions[0] to. Default is 53.
-    offsides: Take into consideration players who are offside , that is do not calculate their pitch control. Default value is True.
     
     Returns
     -------
-    pc_grid_att: Pitch control grid containing pitch control probability for the attacking team.
-                 For defending team pc_grid_def= 1 - pc_grid_att
     x_grid: Positions of centers of cells in x-axis (field length).
     y_grid: Positions of centers of cells in y-axis (field width).
-    
     '''
     
-    # Check if the indices are exactly the same for home and away team.
-    assert np.all(list(tracking_home.index)==list(tracking_away.index)),"Tracking Home index should be same with Tracking Away index."
-    
-    pass_frame=event.loc[event_id,"Start Frame"]
-    team_with_possession=event.loc[event_id,"Team"]
-    ball_start_pos=event.loc[event_id,["Start X","Start Y"]]
-    ball_start_pos=np.array(ball_start_pos,dtype='float')
-    
     num_grid_cells_y= int(field_dimensions[1]/(field_dimensions[0]/num_grid_cells_x))
     grid_dimensions=(field_dimensions[0]/num_grid_cells_x,field_dimensions[1]/num_grid_cells_y) # Default 2x2 meters    
     x_grid,y_grid=[],[]
@@ -186,6 +172,59 @@ def find_pitch_control_for_event(event_id,event,tracking_home,tracking_away,para
         y_grid.append(field_dimensions[1]/2 - (i*2+1)*(grid_dimensions[1]/2))
     x_grid=np.array(x_grid)
     y_grid=np.array(y_grid)*np.array([-1])
+    
+    return x_grid,y_grid
+
+
+@mmon.timed
+def find_pitch_control_for_event(event_id,event,tracking_home,tracking_away,params,GK_NAMES,field_dimensions=(106.,68.),num_grid_cells_x=53,offsides=True,event_index=None):
+    
+    '''
+    Calculates pitch control for an event for the entire field.
+    Field is divided to a grid.
+    
+    Parameters
+    ----------
+    event_id: int , should be a valid id
+    event: pd.Dataframe with Event Data.
+    tracking_home: pd.Dataframe with Tracking Data for Home Team.
+    tracking_away: pd.Dataframe with Tracking Data for Away Team.
+    params: dictionary with model parameters
+    GK_NAMES: tuple with goalkeeper names like (GK_Home_Team,GK_Away_Team)
+    field_dimensions: Field dimensions in meters (Width x Height). Default is (106,68).
+    num_grid_cells_x:Number of grid cells in x-axis to divide field_dimensions[0] to. Default is 53.
+    offsides: Take into consideration players who are offside , that is do not calculate their pitch control. Default value is True.
+    event_index: Join index from Metrica_IO.build_event_tracking_index. If given, tracking rows are found by position. Default is None.
+    
+    Returns
+    -------
+    pc_grid_att: Pitch control grid containing pitch control probability for the attacking team.
+                 For defending team pc_grid_def= 1 - pc_grid_att
+    x_grid: Positions of centers of cells in x-axis (field length).
+    y_grid: Positions of centers of cells in y-axis (field width).
+    
+    '''
+    
+    if event_index is None:
+        # Check if the indices are exactly the same for home and away team.
+        assert np.all(list(tracking_home.index)==list(tracking_away.index)),"Tracking Home index should be same with Tracking Away index."
+        
+        pass_frame=event.loc[event_id,"Start Frame"]
+        team_with_possession=event.loc[event_id,"Team"]
+        ball_start_pos=event.loc[event_id,["Start X","Start Y"]]
+        ball_start_pos=np.array(ball_start_pos,dtype='float')
+        home_frame=tracking_home.loc[pass_frame]
+        away_frame=tracking_away.loc[pass_frame]
+    else: # Positional lookups, indices were checked when the index was built
+        import Metrica_IO as mio # pandas is imported only when tracking data is joined with events
+        pos,row=mio.get_event_row(event_index,event_id)
+        team_with_possession=mio.get_team_name(event_index["team"][pos])
+        ball_start_pos=event_index["start_pos"][pos]
+        home_frame=tracking_home.iloc[row]
+        away_frame=tracking_away.iloc[row]
+    
+    x_grid,y_grid=get_pitch_grid(field_dimensions,num_grid_cells_x)
+    num_grid_cells_y=len(y_grid)
     # Pitch Control Grids for Attacking and Defending team    
     # In shape (y,x) not (x,y)
     pc_grid_att=np.zeros((num_grid_cells_y,num_grid_cells_x))
@@ -193,11 +232,11 @@ def find_pitch_control_for_event(event_id,event,tracking_home,tracking_away,para
 
     # Initialise Players positions , velocities etc. for Home and Away Team
     if team_with_possession=="Home":
-        attacking_players=init_players(tracking_home.loc[pass_frame],"Home",params,GK_NAMES[0])
-        defending_players=init_players(tracking_away.loc[pass_frame],"Away",params,GK_NAMES[1])
+        attacking_players=init_players(home_frame,"Home",params,GK_NAMES[0])
+        defending_players=init_players(away_frame,"Away",params,GK_NAMES[1])
     else: # Away
-        defending_players=init_players(tracking_home.loc[pass_frame],"Home",params,GK_NAMES[0])
-        attacking_players=init_players(tracking_away.loc[pass_frame],"Away",params,GK_NAMES[1])        
+        defending_players=init_players(home_frame,"Home",params,GK_NAMES[0])
+        attacking_players=init_players(away_frame,"Away",params,GK_NAMES[1])        
         
     # Do not calculate attacking players pitch control if they are offside    
     if offsides:
@@ -250,9 +289,13 @@ def pitch_control_at_pos(target_pos,attacking_players,defending_players,ball_sta
     
     if (min_at_att-max(min_at_def,ball_flight_time)>=params["control_time"]):
         # Defender has enough time to control the ball, before attacker arrives so no need to calculate pitch control
+        if mmon.enabled:
+            mmon.count("pitch_control.cells_control_time")
         return 0,1
     elif (min_at_def-max(min_at_att,ball_flight_time)>=params["control_time"]):
         # Attacker has enough time to control the ball, before defender arrives so no need to calculate pitch control
+        if mmon.enabled:
+            mmon.count("pitch_control.cells_control_time")
         return 1,0
     else: # calculate pitch control
         # keep ONLY players who are not far from target location (need time to reach target < control_time of the one reached already)
@@ -291,13 +334,507 @@ def pitch_control_at_pos(target_pos,attacking_players,defending_players,ball_sta
             i+=1
         
         if i>=dt_array.size:
-            print("Integration couldn't converge. Total Pitch Control Probability: ",total_pc_prob)
+            logger.warning("Integration couldn't converge. Total Pitch Control Probability: %s",total_pc_prob)
+            if mmon.enabled:
+                mmon.count("pitch_control.convergence_failures")
+        if mmon.enabled:
+            mmon.count("pitch_control.cells_integrated")
+            mmon.observe("pitch_control.integration_steps",i-1)
         
 
         return pc_att[i-1],pc_def[i-1]
 
 
 
+def get_players_state(team_tracking,team_name,params,GK_NAME):
+    '''
+    Array counterpart of init_players. Gets positions, velocities and control rates of all the players of a team,
+    for a single Frame (pd.Series) or for many Frames (pd.DataFrame) at once.
+    Players who are not in the frame (e.g. bench players) keep NaN positions, NaN velocities are set to (0,0) like Player does.
+    
+    Parameters
+    ----------
+    team_tracking: pd.Series with Tracking Data for a single Frame or pd.DataFrame with Tracking Data for many Frames.
+    team_name: name of Team like "Home", "Away"
+    params: dictionary with model parameters
+    GK_NAME: name of Goalkeeper like "Home_11" or "Away_25"
+    
+    Returns
+    -------
+    players: np.array with Player names like "Home_1".
+    positions: np.array with (x,y) positions in shape (n_players,2), or (n_frames,n_players,2) for many Frames.
+    velocities: np.array with (vx,vy) velocities in the same shape as positions.
+    lambda_def: np.array with λ of each player when defending. Goalkeeper has params["lambda_gk"].
+    '''
+    
+    labels=team_tracking.index if team_tracking.ndim==1 else team_tracking.columns
+    # Get all players , e.g. Home_1 , Away_2
+    players=np.unique(([x.split('_')[0]+'_'+x.split('_')[1] for x in labels if team_name in x]))
+    
+    positions=np.stack([team_tracking[[p+"_x" for p in players]].to_numpy(dtype=float),
+                        team_tracking[[p+"_y" for p in players]].to_numpy(dtype=float)],axis=-1)
+    velocities=np.stack([team_tracking[[p+"_vx" for p in players]].to_numpy(dtype=float),
+                         team_tracking[[p+"_vy" for p in players]].to_numpy(dtype=float)],axis=-1)
+    # Player sets nan velocities to (0,0)
+    velocities[np.any(np.isnan(velocities),axis=-1)]=0.
+    lambda_def=np.where(players==GK_NAME,params["lambda_gk"],params["lambda_def"])
+    
+    return players,positions,velocities,lambda_def
+
+
+def find_offside_players(attacking_team,att_positions,def_positions,ball_start_pos,tol=0.2):
+    '''
+    Array counterpart of check_offsides. Finds the attacking players who are offside, for one or many Frames at once.
+    
+    Parameters
+    ----------
+    attacking_team: Attacking team like "Home" or "Away"
+    att_positions: np.array with (x,y) positions of attacking players in shape (...,n_att,2)
+    def_positions: np.array with (x,y) positions of defending players in shape (...,n_def,2)
+    ball_start_pos: np.array with (x,y) coordinates of the ball in shape (...,2)
+    tol: Tolerance for Offside in meters. Default value is 0.2 meters.
+    
+    Returns
+    -------
+    offside: Boolean np.array in shape (...,n_att), True for attacking players in frame who are offside.
+    '''
+    
+    att_x=att_positions[...,0]
+    def_x=def_positions[...,0]
+    ball_x=np.asarray(ball_start_pos,dtype=float)[...,0,None]
+    
+    if attacking_team=="Home": # direction of attack --->
+        # x position of second last defender + tol meters, players not in frame are ignored
+        second_last_def_x_pos=np.sort(np.where(np.isnan(def_x),-np.inf,def_x),axis=-1)[...,-2,None]+tol
+        onside=(att_x<=ball_x) | (att_x<=0) | (att_x<=second_last_def_x_pos)
+    else: # Away , direction of attack <----
+        second_last_def_x_pos=np.sort(np.where(np.isnan(def_x),np.inf,def_x),axis=-1)[...,1,None]-tol
+        onside=(att_x>=ball_x) | (att_x>=0) | (att_x>=second_last_def_x_pos)
+        
+    return ~onside & ~np.isnan(att_x)
+
+
+def get_times_to_intercept(target_pos,positions,velocities,params):
+    '''
+    Array counterpart of Player.get_time_to_intercept. Calculates the time to intercept of many players to many target positions.
+    Players who are not in frame (NaN positions) get an infinite time to intercept.
+    
+    Parameters
+    ----------
+    target_pos: np.array with (x,y) target positions in shape (...,2)
+    positions: np.array with (x,y) player positions in shape (n_players,2) or (...,n_players,2)
+    velocities: np.array with (vx,vy) player velocities in the same shape as positions
+    params: dictionary with model parameters
+    
+    Returns
+    -------
+    tti: np.array with times to intercept in shape (...,n_players)
+    '''
+    
+    reaction_pos=positions+velocities*params["reaction_time"]
+    dx=np.sqrt(np.sum((np.asarray(target_pos,dtype=float)[...,None,:]-reaction_pos)**2,axis=-1)) # Euclidean Distance
+    # After reaction time , player moves with steady velocity = player_speed.
+    tti=params["reaction_time"]+dx/params["player_speed"]
+    
+    return np.where(np.isnan(tti),np.inf,tti)
+
+
+def pitch_control_at_targets(target_pos,att_positions,att_velocities,def_positions,def_velocities,def_lambdas,ball_start_pos,params):
+    '''
+    Array counterpart of pitch_control_at_pos. Calculates Total Pitch Control of the attacking and defending team
+    for many target positions at once, integrating Spearman's Equation 6 for all of them in the same time steps.
+    Players can be shared by all the targets (n_players,2) or given per target (n_targets,n_players,2), e.g. one frame per target.
+    Players who are not in frame or offside should have NaN positions.
+    
+    Parameters
+    ----------
+    target_pos: np.array with (x,y) target positions in shape (n_targets,2)
+    att_positions: np.array with (x,y) positions of attacking players in shape (n_att,2) or (n_targets,n_att,2)
+    att_velocities: np.array with (vx,vy) velocities of attacking players in the same shape as att_positions
+    def_positions: np.array with (x,y) positions of defending players in shape (n_def,2) or (n_targets,n_def,2)
+    def_velocities: np.array with (vx,vy) velocities of defending players in the same shape as def_positions
+    def_lambdas: np.array with λ of defending players in shape (n_def,) or (n_targets,n_def)
+    ball_start_pos: np.array with (x,y) coordinates of the ball in shape (2,) or (n_targets,2)
+    params: dictionary with model parameters
+    
+    Returns
+    -------
+    pc_att: np.array with total attacking players pitch control probability at each target position.
+    pc_def: np.array with total defending players pitch control probability at each target position.
+    '''
+    
+    target_pos=np.atleast_2d(np.asarray(target_pos,dtype=float))
+    n_targets=len(target_pos)
+    ball_start_pos=np.broadcast_to(np.asarray(ball_start_pos,dtype=float),(n_targets,2))
+    
+    # Find ball_flight_time
+    ball_flight_time=np.sqrt(np.sum((target_pos-ball_start_pos)**2,axis=1))/params["ball_speed"]
+    ball_flight_time[np.any(np.isnan(ball_start_pos),axis=1)]=0.
+    
+    # Arrival times of attacking and defending players
+    tti_att=get_times_to_intercept(target_pos,att_positions,att_velocities,params)
+    tti_def=get_times_to_intercept(target_pos,def_positions,def_velocities,params)
+    lambda_def=np.broadcast_to(def_lambdas,tti_def.shape)
+    min_at_att=np.min(tti_att,axis=1)
+    min_at_def=np.min(tti_def,axis=1)
+    
+    pc_att=np.zeros(n_targets)
+    pc_def=np.zeros(n_targets)
+    
+    # Defender has enough time to control the ball, before attacker arrives so no need to calculate pitch control
+    defender_control=min_at_att-np.maximum(min_at_def,ball_flight_time)>=params["control_time"]
+    # Attacker has enough time to control the ball, before defender arrives so no need to calculate pitch control
+    attacker_control=~defender_control & (min_at_def-np.maximum(min_at_att,ball_flight_time)>=params["control_time"])
+    pc_def[defender_control]=1.
+    pc_att[attacker_control]=1.
+    
+    todo=np.flatnonzero(~defender_control & ~attacker_control)
+    if mmon.enabled:
+        mmon.count("pitch_control.cells_control_time",n_targets-todo.size)
+        mmon.count("pitch_control.cells_integrated",todo.size)
+    if todo.size==0:
+        return pc_att,pc_def
+    
+    # keep ONLY players who are not far from target location (need time to reach target < control_time of the one reached already)
+    tti_att=tti_att[todo]
+    tti_def=tti_def[todo]
+    tti_att=np.where(tti_att-min_at_att[todo,None]<params["control_time"],tti_att,np.inf)
+    tti_def=np.where(tti_def-min_at_def[todo,None]<params["control_time"],tti_def,np.inf)
+    lambda_def=lambda_def[todo]
+    
+    # integration (int_step elements) from ball_flight_time-int_step up to ball_flight_time+max_int_time, same as np.arange
+    start=ball_flight_time[todo]-params['int_step']
+    n_steps=np.ceil(((ball_flight_time[todo]+params['max_int_time'])-start)/params['int_step']).astype(int)
+    ppcf_att=np.zeros(tti_att.shape) # contribution of each player to pitch control
+    ppcf_def=np.zeros(tti_def.shape)
+    total_att=np.zeros(todo.size)
+    total_def=np.zeros(todo.size)
+    
+    # Integrate Spearman's Equation until Convergence or exceeds array size, time limit, for all targets at once
+    active=np.arange(todo.size)
+    i=1
+    while active.size>0:
+        T=start[active]+i*params['int_step'] # Time T within a player can reach target pos
+        remaining=1-total_att[active]-total_def[active]
+        prob_att=1/(1. + np.exp( -np.pi/np.sqrt(3.0)/params["sigma"] * (T[:,None]-tti_att[active]) ) )
+        prob_def=1/(1. + np.exp( -np.pi/np.sqrt(3.0)/params["sigma"] * (T[:,None]-tti_def[active]) ) )
+        ppcf_att[active]+=remaining[:,None]*prob_att*params["lambda_att"]*params["int_step"]
+        ppcf_def[active]+=remaining[:,None]*prob_def*lambda_def[active]*params["int_step"]
+        total_att[active]=np.sum(ppcf_att[active],axis=1)
+        total_def[active]=np.sum(ppcf_def[active],axis=1)
+        i+=1
+        
+        converged=1-(total_att[active]+total_def[active])<=params['model_converge_tol']
+        out_of_time=~converged & (i>=n_steps[active])
+        if np.any(out_of_time):
+            logger.warning("Integration couldn't converge. Total Pitch Control Probability: %s",total_att[active][out_of_time]+total_def[active][out_of_time])
+        if mmon.enabled:
+            mmon.count("pitch_control.convergence_failures",int(np.sum(out_of_time)))
+            mmon.observe("pitch_control.integration_steps",i-1,int(np.sum(converged | out_of_time)))
+        active=active[~converged & ~out_of_time]
+    
+    pc_att[todo]=total_att
+    pc_def[todo]=total_def
+    
+    return pc_att,pc_def
+
+
+@mmon.timed
+def find_pitch_control_for_events(event_ids,event_index,tracking_home,tracking_away,params,GK_NAMES,field_dimensions=(106.,68.),num_grid_cells_x=53,
+                                  offsides=True,batch_size=10):
+    '''
+    Array counterpart of find_pitch_control_for_event for many events at once. Start frames of all events are gathered with
+    a single positional indexing step and events are calculated in batches with pitch_control_at_targets.
+    
+    Parameters
+    ----------
+    event_ids: Iterable of valid event ids.
+    event_index: Join index from Metrica_IO.build_event_tracking_index.
+    tracking_home: pd.Dataframe with Tracking Data for Home Team.
+    tracking_away: pd.Dataframe with Tracking Data for Away Team.
+    params: dictionary with model parameters
+    GK_NAMES: tuple with goalkeeper names like (GK_Home_Team,GK_Away_Team)
+    field_dimensions: Field dimensions in meters (Width x Height). Default is (106,68).
+    num_grid_cells_x:Number of grid cells in x-axis to divide field_dimensions[0] to. Default is 53.
+    offsides: Take into consideration players who are offside , that is do not calculate their pitch control. Default value is True.
+    batch_size: Number of events calculated together. Default is 10.
+    
+    Returns
+    -------
+    surfaces: np.array in shape (n_events,num_grid_cells_y,num_grid_cells_x) with pitch control probability of the team of each event,
+              in the same layout as the grid of find_pitch_control_for_event. NaN for events whose Start Frame is not tracked or without team.
+    x_grid: Positions of centers of cells in x-axis (field length).
+    y_grid: Positions of centers of cells in y-axis (field width).
+    '''
+    
+    import Metrica_IO as mio # pandas is imported only when tracking data is joined with events
+    
+    event_ids=list(event_ids)
+    x_grid,y_grid=get_pitch_grid(field_dimensions,num_grid_cells_x)
+    targets=np.stack(np.meshgrid(x_grid,y_grid),axis=-1).reshape(-1,2) # row after row of the grid
+    n_targets=len(targets)
+    
+    home_frames,valid=mio.get_event_frames(event_index,tracking_home,event_ids)
+    away_frames,_=mio.get_event_frames(event_index,tracking_away,event_ids)
+    positions=np.array([event_index["positions"][event_id] for event_id in event_ids],dtype=np.int64)[valid]
+    rows=np.flatnonzero(valid) # rows of the surfaces
+    home=get_players_state(home_frames,"Home",params,GK_NAMES[0])
+    away=get_players_state(away_frames,"Away",params,GK_NAMES[1])
+    ball_start_pos=event_index["start_pos"][positions]
+    
+    surfaces=np.full((len(event_ids),n_targets),np.nan)
+    done=0
+    for attacking_team,code in [("Home",1),("Away",-1)]:
+        events=np.flatnonzero(event_index["team"][positions]==code)
+        _,att_positions,att_velocities,_=home if attacking_team=="Home" else away
+        _,def_positions,def_velocities,def_lambdas=away if attacking_team=="Home" else home
+        att_positions=att_positions[events]
+        if offsides: # Offside players have NaN positions, so they don't control the ball
+            offside=find_offside_players(attacking_team,att_positions,def_positions[events],ball_start_pos[events])
+            att_positions=np.where(offside[...,None],np.nan,att_positions)
+        
+        for start in range(0,len(events),batch_size):
+            batch=events[start:start+batch_size]
+            k=np.arange(start,start+len(batch)) # position of the batch within the events of the team
+            # Every target of the batch gets the players and ball of its event
+            pc_att,_=pitch_control_at_targets(np.tile(targets,(len(batch),1)),
+                                              np.repeat(att_positions[k],n_targets,axis=0),np.repeat(att_velocities[batch],n_targets,axis=0),
+                                              np.repeat(def_positions[batch],n_targets,axis=0),np.repeat(def_velocities[batch],n_targets,axis=0),
+                                              def_lambdas,np.repeat(ball_start_pos[batch],n_targets,axis=0),params)
+            surfaces[rows[batch]]=pc_att.reshape(len(batch),n_targets)
+            done+=len(batch)
+            mmon.progress("find_pitch_control_for_events",done,len(positions))
+    
+    return surfaces.reshape(-1,len(y_grid),len(x_grid)),x_grid,y_grid
+
+
+def pass_probability_along_path(start_pos,end_pos,att_positions,att_velocities,def_positions,def_velocities,def_lambdas,params):
+    '''
+    Probability that a pass keeps possession, with the ball moving along its path. The ball leaves start_pos at T=0 and moves
+    with params["ball_speed"] towards end_pos, where it stays after arrival. At every integration step players of both teams race
+    to the position of the ball at that time (points sampled along the path every ball_speed*int_step meters, times to intercept
+    from get_times_to_intercept) and Spearman's Equation 6 is integrated with those, for all passes at once.
+    A pass with start_pos equal to end_pos gives the pitch control of pitch_control_at_pos at that position (up to model_converge_tol).
+    Players who are not in frame or offside should have NaN positions.
+    
+    Parameters
+    ----------
+    start_pos: np.array with (x,y) coordinates of the ball at the start of each pass in shape (n_passes,2)
+    end_pos: np.array with (x,y) coordinates of the ball at the end of each pass in shape (n_passes,2)
+    att_positions: np.array with (x,y) positions of attacking players in shape (n_passes,n_att,2)
+    att_velocities: np.array with (vx,vy) velocities of attacking players in the same shape as att_positions
+    def_positions: np.array with (x,y) positions of defending players in shape (n_passes,n_def,2)
+    def_velocities: np.array with (vx,vy) velocities of defending players in the same shape as def_positions
+    def_lambdas: np.array with λ of defending players in shape (n_def,) or (n_passes,n_def)
+    params: dictionary with model parameters
+    
+    Returns
+    -------
+    success: np.array with the probability of the attacking team to control the ball, during the pass or at its end.
+    interception: np.array with the probability of the defending team to control the ball before it arrives at end_pos.
+    '''
+    
+    start_pos=np.atleast_2d(np.asarray(start_pos,dtype=float))
+    end_pos=np.atleast_2d(np.asarray(end_pos,dtype=float))
+    n_passes=len(start_pos)
+    dt=params["int_step"]
+    
+    # Steps until the ball arrives, the ball is at end_pos from then on
+    ball_flight_time=np.sqrt(np.sum((end_pos-start_pos)**2,axis=1))/params["ball_speed"]
+    invalid=np.isnan(ball_flight_time)
+    ball_flight_time[invalid]=0.
+    arrival_steps=np.ceil(ball_flight_time/dt-1e-9).astype(int)
+    n_points=arrival_steps.max()+1 if n_passes>0 else 1
+    # Position of the ball at every step up to the arrival of the slowest pass, in shape (n_passes,n_points,2)
+    fraction=np.minimum(np.arange(n_points)*dt/np.where(ball_flight_time>0,ball_flight_time,np.inf)[:,None],1.)
+    fraction[ball_flight_time==0]=1.
+    points=start_pos[:,None,:]+fraction[...,None]*(end_pos-start_pos)[:,None,:]
+    
+    # Arrival times of attacking and defending players at every point of the path, in shape (n_passes,n_points,n_players)
+    tti_att=get_times_to_intercept(points,att_positions[:,None],att_velocities[:,None],params)
+    tti_def=get_times_to_intercept(points,def_positions[:,None],def_velocities[:,None],params)
+    lambda_def=np.broadcast_to(def_lambdas,(n_passes,tti_def.shape[-1]))
+    
+    total_att=np.zeros(n_passes)
+    total_def=np.zeros(n_passes)
+    interception=np.full(n_passes,np.nan)
+    n_steps=np.ceil((ball_flight_time+params["max_int_time"])/dt).astype(int) # same number of steps as pitch_control_at_targets after arrival
+    
+    # Integrate Spearman's Equation until Convergence or exceeds time limit, for all passes at once
+    active=np.flatnonzero(~invalid)
+    i=0
+    while active.size>0:
+        T=i*dt # Time since the ball left start_pos
+        point=min(i,n_points-1)
+        remaining=1-total_att[active]-total_def[active]
+        prob_att=1/(1. + np.exp( -np.pi/np.sqrt(3.0)/params["sigma"] * (T-tti_att[active,point]) ) )
+        prob_def=1/(1. + np.exp( -np.pi/np.sqrt(3.0)/params["sigma"] * (T-tti_def[active,point]) ) )
+        total_att[active]+=remaining*np.sum(prob_att,axis=1)*params["lambda_att"]*dt
+        total_def[active]+=remaining*np.sum(prob_def*lambda_def[active],axis=1)*dt
+        arrived=arrival_steps[active]==i
+        interception[active[arrived]]=total_def[active[arrived]]
+        i+=1
+        
+        converged=1-(total_att[active]+total_def[active])<=params['model_converge_tol']
+        out_of_time=~converged & (i>=n_steps[active])
+        if np.any(out_of_time):
+            logger.warning("Integration couldn't converge. Total Pass Probability: %s",total_att[active][out_of_time]+total_def[active][out_of_time])
+        if mmon.enabled:
+            mmon.count("pass_probability.convergence_failures",int(np.sum(out_of_time)))
+            mmon.observe("pass_probability.integration_steps",i,int(np.sum(converged | out_of_time)))
+        active=active[~converged & ~out_of_time]
+    
+    # Passes decided before the ball arrived
+    interception=np.where(np.isnan(interception),total_def,interception)
+    total_att[invalid]=np.nan
+    interception[invalid]=np.nan
+    
+    return total_att,interception
+
+
+@mmon.timed
+def find_pass_probabilities(event,tracking_home,tracking_away,params,GK_NAMES,event_ids=None,event_index=None,offsides=True,batch_size=200):
+    '''
+    Calculates with pass_probability_along_path the probability of success of many passes at once, e.g. all passes of a game.
+    Start frames of all passes are gathered with a single positional indexing step.
+    
+    Parameters
+    ----------
+    event: pd.Dataframe with Event Data.
+    tracking_home: pd.Dataframe with Tracking Data for Home Team.
+    tracking_away: pd.Dataframe with Tracking Data for Away Team.
+    params: dictionary with model parameters
+    GK_NAMES: tuple with goalkeeper names like (GK_Home_Team,GK_Away_Team)
+    event_ids: Iterable of valid event ids. Default is None, that is all the events of Type "PASS".
+    event_index: Join index from Metrica_IO.build_event_tracking_index. Default is None, that is built from event.
+    offsides: Take into consideration players who are offside, that is they can't receive the pass. Default value is True.
+    batch_size: Number of passes calculated together. Default is 200.
+    
+    Returns
+    -------
+    probabilities: pd.DataFrame indexed by event id with "Pass Success" (probability that the team of the pass keeps the ball)
+                   and "Interception" (probability that the other team controls the ball before it arrives at End X/Y).
+                   NaN for passes whose Start Frame is not tracked, without team or without coordinates.
+    '''
+    
+    import pandas as pd # pandas is imported only when tracking data is joined with events
+    import Metrica_IO as mio
+    
+    event_ids=list(event.index[event["Type"]=="PASS"] if event_ids is None else event_ids)
+    event_index=mio.build_event_tracking_index(event,tracking_home,tracking_away) if event_index is None else event_index
+    home_frames,valid=mio.get_event_frames(event_index,tracking_home,event_ids)
+    away_frames,_=mio.get_event_frames(event_index,tracking_away,event_ids)
+    positions=np.array([event_index["positions"][event_id] for event_id in event_ids],dtype=np.int64)[valid]
+    rows=np.flatnonzero(valid)
+    home=get_players_state(home_frames,"Home",params,GK_NAMES[0])
+    away=get_players_state(away_frames,"Away",params,GK_NAMES[1])
+    start_pos=event_index["start_pos"][positions]
+    end_pos=event_index["end_pos"][positions]
+    
+    success=np.full(len(event_ids),np.nan)
+    interception=np.full(len(event_ids),np.nan)
+    done=0
+    for attacking_team,code in [("Home",1),("Away",-1)]:
+        passes=np.flatnonzero(event_index["team"][positions]==code)
+        _,att_positions,att_velocities,_=home if attacking_team=="Home" else away
+        _,def_positions,def_velocities,def_lambdas=away if attacking_team=="Home" else home
+        att_positions=att_positions[passes]
+        if offsides: # Offside players have NaN positions, so they don't control the ball
+            offside=find_offside_players(attacking_team,att_positions,def_positions[passes],start_pos[passes])
+            att_positions=np.where(offside[...,None],np.nan,att_positions)
+        
+        for start in range(0,len(passes),batch_size):
+            batch=passes[start:start+batch_size]
+            k=np.arange(start,start+len(batch)) # position of the batch within the passes of the team
+            success[rows[batch]],interception[rows[batch]]=pass_probability_along_path(start_pos[batch],end_pos[batch],att_positions[k],att_velocities[batch],
+                                                                                       def_positions[batch],def_velocities[batch],def_lambdas,params)
+            done+=len(batch)
+            mmon.progress("find_pass_probabilities",done,len(positions))
+    
+    return pd.DataFrame({"Pass Success":success,"Interception":interception},index=pd.Index(event_ids,name=event.index.name))
+
+
+@mmon.timed
+def get_pitch_control_surfaces(tracking_home,tracking_away,params,GK_NAMES,attacking_team="Home",field_dimensions=(106.,68.),num_grid_cells_x=53,
+                               offsides=True,frame_step=1,batch_size=25,cache_dir=None):
+    '''
+    Calculates pitch control of a team for the entire field, at every frame of the Tracking Data, with the ball at its position in the frame.
+    Frames are calculated in batches with pitch_control_at_targets (every target of a batch has the players of its frame).
+    With cache_dir, surfaces are saved in a .npy file named after a hash of the Tracking Data and the settings,
+    so that the same frames with the same settings are calculated only once (e.g. for rendering a movie many times).
+    
+    Parameters
+    ----------
+    tracking_home: pd.Dataframe with Tracking Data for Home Team.
+    tracking_away: pd.Dataframe with Tracking Data for Away Team.
+    params: dictionary with model parameters
+    GK_NAMES: tuple with goalkeeper names like (GK_Home_Team,GK_Away_Team)
+    attacking_team: Team whose pitch control is calculated, "Home" or "Away". Default is "Home".
+    field_dimensions: Field dimensions in meters (Width x Height). Default is (106,68).
+    num_grid_cells_x:Number of grid cells in x-axis to divide field_dimensions[0] to. Default is 53.
+    offsides: Take into consideration players who are offside , that is do not calculate their pitch control. Default value is True.
+    frame_step: Calculate every frame_step frames, the frames in between get the surface of the last calculated frame. Default is 1.
+    batch_size: Number of frames calculated together. Default is 25.
+    cache_dir: Directory of cached surfaces. Default is None, no cache.
+    
+    Returns
+    -------
+    surfaces: np.array in shape (n_frames,num_grid_cells_y,num_grid_cells_x) with pitch control probability of attacking_team,
+              in the same layout as the grid of find_pitch_control_for_event.
+    x_grid: Positions of centers of cells in x-axis (field length).
+    y_grid: Positions of centers of cells in y-axis (field width).
+    '''
+    
+    # Check if the indices are exactly the same for home and away team.
+    assert tracking_home.index.equals(tracking_away.index),"Tracking Home index should be same with Tracking Away index."
+    
+    x_grid,y_grid=get_pitch_grid(field_dimensions,num_grid_cells_x)
+    targets=np.stack(np.meshgrid(x_grid,y_grid),axis=-1).reshape(-1,2) # row after row of the grid
+    
+    home=get_players_state(tracking_home,"Home",params,GK_NAMES[0])
+    away=get_players_state(tracking_away,"Away",params,GK_NAMES[1])
+    _,att_positions,att_velocities,_=home if attacking_team=="Home" else away
+    _,def_positions,def_velocities,def_lambdas=away if attacking_team=="Home" else home
+    ball_start_pos=tracking_home[["ball_x","ball_y"]].to_numpy(dtype=float)
+    
+    if cache_dir is not None:
+        settings=json.dumps([params,GK_NAMES,attacking_team,field_dimensions,num_grid_cells_x,offsides,frame_step],sort_keys=True,default=str)
+        key=hashlib.sha1(settings.encode("utf-8"))
+        for values in [att_positions,att_velocities,def_positions,def_velocities,ball_start_pos]:
+            key.update(np.ascontiguousarray(values).tobytes())
+        cache_file=os.path.join(cache_dir,"pitch_control_{}.npy".format(key.hexdigest()))
+        if os.path.exists(cache_file):
+            mmon.count("pitch_control.surface_cache_hits")
+            return np.load(cache_file),x_grid,y_grid
+        mmon.count("pitch_control.surface_cache_misses")
+    
+    if offsides: # Offside players have NaN positions, so they don't control the ball
+        offside=find_offside_players(attacking_team,att_positions,def_positions,ball_start_pos)
+        att_positions=np.where(offside[...,None],np.nan,att_positions)
+    
+    calculated=np.arange(0,len(ball_start_pos),frame_step)
+    surfaces=np.zeros((len(calculated),len(targets)))
+    n_targets=len(targets)
+    for start in range(0,len(calculated),batch_size):
+        frames=calculated[start:start+batch_size]
+        # Every target of the batch gets the players and ball of its frame
+        pc_att,_=pitch_control_at_targets(np.tile(targets,(len(frames),1)),
+                                          np.repeat(att_positions[frames],n_targets,axis=0),np.repeat(att_velocities[frames],n_targets,axis=0),
+                                          np.repeat(def_positions[frames],n_targets,axis=0),np.repeat(def_velocities[frames],n_targets,axis=0),
+                                          def_lambdas,np.repeat(ball_start_pos[frames],n_targets,axis=0),params)
+        surfaces[start:start+len(frames)]=pc_att.reshape(len(frames),n_targets)
+        mmon.progress("get_pitch_control_surfaces",start+len(frames),len(calculated))
+    
+    # Frames in between get the surface of the last calculated frame
+    surfaces=surfaces[np.arange(len(ball_start_pos))//frame_step].reshape(-1,len(y_grid),len(x_grid))
+    
+    if cache_dir is not None:
+        os.makedirs(cache_dir,exist_ok=True)
+        np.save(cache_file,surfaces)
+    
+    return surfaces,x_grid,y_grid
+
+
 class Player():
     '''
     This class represents a Player. It is used mainly for pitch control.
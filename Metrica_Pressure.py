@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+
+Defensive pressure on the player on the ball at every on-ball event of a match: number of defenders within some radii,
+distance, time to intercept (arrival time model of Metrica_Pitch_Control) and closing speed of the nearest defender.
+Start frames of all events are gathered with a single positional indexing step and the distances of every defender
+to every ball carrier are calculated at once, in shape (n_events,n_defenders).
+Tracking Data should have velocities (Metrica_Velocities.calc_player_velocities) and should be in meters, like the Event Data.
+
+
+@author: Apatsidis Ioannis
+"""
+
+import numpy as np
+import pandas as pd
+import Metrica_IO as mio
+import Metrica_Pitch_Control as mpc
+import Metrica_Monitor as mmon
+
+
+def get_pressure_parameters():
+    '''
+    Setting the events and the radii of defensive pressure.
+
+    Returns
+    -------
+    params: Dictionary with pressure parameters
+    '''
+    params={}
+    params["event_types"]=list(mio.POSSESSION_TYPES) # On-ball events
+    params["radii"]=[2.,5.,10.] # Defenders within every radius (meters) of the player on the ball
+
+    return params
+
+
+def __get_carrier_positions(event,positions,team_states):
+    '''
+    Position and velocity of the player on the ball (From) at the Start Frame of every event.
+    Events without From or with From not in frame get the Start X/Y of the event and zero velocity.
+    '''
+
+    n_events=len(positions)
+    carrier_pos=np.full((n_events,2),np.nan)
+    carrier_vel=np.zeros((n_events,2))
+    teams=event["Team"].to_numpy(dtype=object)[positions]
+    names=mio.get_tracking_names(event,"From").to_numpy(dtype=object)[positions]
+    for team_name,(players,team_positions,team_velocities,_) in team_states.items():
+        column={player:k for k,player in enumerate(players)}
+        events=np.flatnonzero(teams==team_name)
+        found=np.array([names[e] in column for e in events],dtype=bool)
+        events=events[found]
+        columns=np.array([column[names[e]] for e in events],dtype=np.int64)
+        carrier_pos[events]=team_positions[events,columns]
+        carrier_vel[events]=team_velocities[events,columns]
+
+    start_pos=event[["Start X","Start Y"]].to_numpy(dtype=float)[positions]
+    missing=np.any(np.isnan(carrier_pos),axis=1)
+    carrier_pos[missing]=start_pos[missing]
+    carrier_vel[missing]=0.
+
+    return carrier_pos,carrier_vel
+
+
+@mmon.timed
+def get_pressure_at_events(event,tracking_home,tracking_away,params=None,model_params=None,event_ids=None,event_index=None):
+    '''
+    Defensive pressure on the player on the ball at the Start Frame of every event. Defenders are the players of the other team,
+    the player on the ball is From of the event (the Start X/Y of the event if From is not in frame).
+
+    Parameters
+    ----------
+    event: pd.Dataframe with Event Data.
+    tracking_home: pd.Dataframe with Tracking Data for Home Team, with velocities.
+    tracking_away: pd.Dataframe with Tracking Data for Away Team, with velocities.
+    params: Dictionary with pressure parameters. Default is None, that is get_pressure_parameters().
+    model_params: Dictionary with model parameters of the time to intercept. Default is None, that is Metrica_Pitch_Control.get_model_parameters().
+    event_ids: List with ids of events. Default is None, that is the events of params["event_types"].
+    event_index: Join index from Metrica_IO.build_event_tracking_index. Default is None, that is built here.
+
+    Returns
+    -------
+    pressure: pd.DataFrame indexed by event id with
+              "Defenders within <radius> m": Number of defenders within every radius of the player on the ball.
+              "Nearest Defender": Name of the nearest defender like "Away_18".
+              "Nearest Defender Distance (m)": Distance of the nearest defender.
+              "Nearest Defender Time to Intercept (s)": Time of the nearest defender to reach the player on the ball.
+              "Min Time to Intercept (s)": Lowest time to intercept of all defenders, the defender who arrives first.
+              "Closing Speed (m/s)": Speed at which the distance between the nearest defender and the player on the ball decreases,
+                                     negative when it increases. NaN velocities count as (0,0), as in the model.
+              NaN for events whose Start Frame is not tracked or without team.
+    '''
+
+    params=get_pressure_parameters() if params is None else params
+    model_params=mpc.get_model_parameters() if model_params is None else model_params
+    event_ids=list(event.index[event["Type"].isin(params["event_types"])] if event_ids is None else event_ids)
+    event_index=mio.build_event_tracking_index(event,tracking_home,tracking_away) if event_index is None else event_index
+
+    home_frames,valid=mio.get_event_frames(event_index,tracking_home,event_ids)
+    away_frames,_=mio.get_event_frames(event_index,tracking_away,event_ids)
+    positions=np.array([event_index["positions"][event_id] for event_id in event_ids],dtype=np.int64)[valid]
+    rows=np.flatnonzero(valid)
+    # Goalkeepers are not needed, λ is not used
+    team_states={"Home":mpc.get_players_state(home_frames,"Home",model_params,None),
+                 "Away":mpc.get_players_state(away_frames,"Away",model_params,None)}
+    carrier_pos,carrier_vel=__get_carrier_positions(event,positions,team_states)
+
+    radii=list(params["radii"])
+    counts=np.full((len(event_ids),len(radii)),np.nan)
+    nearest=np.full(len(event_ids),None,dtype=object)
+    distance=np.full(len(event_ids),np.nan)
+    nearest_tti=np.full(len(event_ids),np.nan)
+    min_tti=np.full(len(event_ids),np.nan)
+    closing_speed=np.full(len(event_ids),np.nan)
+    for attacking_team,code,defending_team in [("Home",1,"Away"),("Away",-1,"Home")]:
+        events=np.flatnonzero(event_index["team"][positions]==code)
+        players,def_positions,def_velocities,_=team_states[defending_team]
+        def_positions,def_velocities=def_positions[events],def_velocities[events]
+        # Distances of every defender to the player on the ball in shape (n_events,n_defenders), players not in frame are infinitely far
+        offsets=def_positions-carrier_pos[events,None,:]
+        distances=np.sqrt(np.sum(offsets**2,axis=-1))
+        distances=np.where(np.isnan(distances),np.inf,distances)
+        tti=mpc.get_times_to_intercept(carrier_pos[events],def_positions,def_velocities,model_params)
+
+        found=np.isfinite(distances).any(axis=1)
+        closest=np.argmin(distances,axis=1)
+        k=np.arange(len(events))
+        counts[rows[events]]=np.sum(distances[...,None]<=np.array(radii),axis=1)
+        nearest[rows[events[found]]]=players[closest[found]]
+        distance[rows[events[found]]]=distances[k,closest][found]
+        nearest_tti[rows[events[found]]]=tti[k,closest][found]
+        min_tti[rows[events[found]]]=np.min(tti,axis=1)[found]
+        # Rate of decrease of the distance: relative velocity towards the player on the ball
+        relative_velocity=def_velocities[k,closest]-carrier_vel[events]
+        with np.errstate(invalid="ignore",divide="ignore"):
+            closing=-np.sum(offsets[k,closest]*relative_velocity,axis=-1)/distances[k,closest]
+        closing_speed[rows[events[found]]]=np.where(distances[k,closest]>0,closing,0.)[found]
+
+    pressure=pd.DataFrame(counts,index=pd.Index(event_ids,name=event.index.name),columns=["Defenders within {:g} m".format(radius) for radius in radii])
+    pressure["Nearest Defender"]=nearest
+    pressure["Nearest Defender Distance (m)"]=distance
+    pressure["Nearest Defender Time to Intercept (s)"]=nearest_tti
+    pressure["Min Time to Intercept (s)"]=min_tti
+    pressure["Closing Speed (m/s)"]=closing_speed
+
+    return pressure
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+
+Off-ball runs: high speed runs of players of the team in possession who are not on the ball.
+Runs of all players are found at once with the segmentation of Physical_Segments, restricted to frames in possession
+and away from the ball, and every run is classified by its start and end positions relative to the ball and the defenders:
+    "In Behind": forward run that ends beyond the second last defender.
+    "Overlap": forward run from behind the ball to ahead of it, on the outside of the ball.
+    "Checking": run back towards the ball, coming short to receive.
+    "Diagonal": forward run at an angle to the direction of attack.
+    "Other": any other run.
+Runs are linked to the possession event they started in and to the pass they received, and the pitch control of the team
+at the position of the runner at the start and at the end of every run is calculated for all runs at once.
+Tracking Data should have velocities and a single playing direction (Metrica_IO.set_single_playing_direction), in meters like the Event Data.
+
+
+@author: Apatsidis Ioannis
+"""
+
+import numpy as np
+import pandas as pd
+import Metrica_IO as mio
+import Metrica_Pitch_Control as mpc
+import Metrica_Heatmaps as mhm
+import Metrica_Monitor as mmon
+import Physical_Segments as mseg
+
+logger=mmon.get_logger(__name__)
+
+
+def get_run_parameters():
+    '''
+    Setting the detection and the classification of off-ball runs.
+
+    Returns
+    -------
+    params: Dictionary with off-ball run parameters
+    '''
+    params={}
+    params["speed"]=5.5 # 5.5 m/s <= speed for at least "duration" seconds, same as a High Intensity Run of Physical_Segments
+    params["duration"]=1.
+    params["ball_distance"]=2. # Players within 2 meters of the ball are on the ball
+    params["possession_types"]=mhm.get_heatmap_parameters()["possession_types"] # Events that give possession to their team
+    params["behind_margin"]=1. # "In Behind" runs end at most 1 meter short of the second last defender
+    params["check_distance"]=3. # "Checking" runs get at least 3 meters closer to the ball
+    params["diagonal_angles"]=(25.,65.) # "Diagonal" runs have an angle to the direction of attack within (25,65) degrees
+    params["pass_window"]=1. # Passes to the runner up to 1 second after the end of the run are received by the run
+    params["offsides"]=True # Offside players don't control the ball in pitch control
+
+    return params
+
+
+def __detect_runs(team,team_name,event,params,summary_params):
+    '''
+    Off-ball runs of the players of a team, segments of Physical_Segments.get_players_segments in frames in possession and away from the ball.
+    '''
+
+    players=[column[:-2] for column in team.columns if column.startswith(team_name+"_") and column.endswith("_x")]
+    x=team[[player+"_x" for player in players]].to_numpy(dtype=float)
+    y=team[[player+"_y" for player in players]].to_numpy(dtype=float)
+    ball_x=team["ball_x"].to_numpy(dtype=float)[:,None]
+    ball_y=team["ball_y"].to_numpy(dtype=float)[:,None]
+    in_possession=mhm.get_possession_mask(event,team,team_name,params)
+    with np.errstate(invalid="ignore"):
+        on_ball=np.sqrt((x-ball_x)**2+(y-ball_y)**2)<=params["ball_distance"] # Not on the ball when the ball is not tracked
+    frame_mask=pd.DataFrame(~on_ball & in_possession[:,None],index=team.index,columns=players)
+
+    runs=mseg.get_players_segments(team,{"Off-Ball Run":("speed",params["speed"],params["duration"])},summary_params,frame_mask)
+    runs=runs.drop(columns=["Type","Peak Acceleration (m/s^2)"])
+    runs.insert(1,"Team",team_name)
+
+    return runs
+
+
+def __classify_runs(runs,tracking_home,tracking_away,params):
+    '''
+    Type of every run, from the positions of the runner, the ball and the defenders at its start and end frames.
+    '''
+
+    direction=np.where(runs["Team"].to_numpy(dtype=object)=="Home",1.,-1.)
+    start_rows=tracking_home.index.get_indexer(runs["Start Frame"].to_numpy())
+    end_rows=tracking_home.index.get_indexer(runs["End Frame"].to_numpy())
+    ball=tracking_home[["ball_x","ball_y"]].to_numpy(dtype=float)
+
+    # Depth along the direction of attack
+    start_depth=direction*runs["Start X"].to_numpy(dtype=float)
+    end_depth=direction*runs["End X"].to_numpy(dtype=float)
+    end_y=runs["End Y"].to_numpy(dtype=float)
+    ball_start_depth=direction*ball[start_rows,0]
+    ball_end_depth=direction*ball[end_rows,0]
+    dx=end_depth-start_depth
+    dy=end_y-runs["Start Y"].to_numpy(dtype=float)
+
+    # Second last defender at the end of every run, players not in frame are ignored
+    defender_depth=np.full(len(runs),np.nan)
+    for team_name,defending in [("Home",tracking_away),("Away",tracking_home)]:
+        team_runs=np.flatnonzero(runs["Team"].to_numpy(dtype=object)==team_name)
+        columns=[column for column in defending.columns if column.endswith("_x") and not column.startswith("ball")]
+        depth=(1. if team_name=="Home" else -1.)*defending[columns].to_numpy(dtype=float)[end_rows[team_runs]]
+        depth=np.sort(np.where(np.isnan(depth),-np.inf,depth),axis=1)
+        defender_depth[team_runs]=depth[:,-2] if depth.shape[1]>=2 else np.nan
+
+    with np.errstate(invalid="ignore"):
+        forward=dx>0
+        in_behind=forward & (end_depth>=defender_depth-params["behind_margin"])
+        overlap=forward & (start_depth<ball_start_depth) & (end_depth>ball_end_depth) & (np.abs(end_y)>np.abs(ball[end_rows,1]))
+        start_distance=np.hypot(runs["Start X"].to_numpy(dtype=float)-ball[start_rows,0],runs["Start Y"].to_numpy(dtype=float)-ball[start_rows,1])
+        end_distance=np.hypot(runs["End X"].to_numpy(dtype=float)-ball[end_rows,0],end_y-ball[end_rows,1])
+        checking=~forward & (end_distance<=start_distance-params["check_distance"])
+        angle=np.degrees(np.arctan2(np.abs(dy),dx))
+        diagonal=forward & (angle>=params["diagonal_angles"][0]) & (angle<=params["diagonal_angles"][1])
+
+    return np.select([in_behind,overlap,checking,diagonal],["In Behind","Overlap","Checking","Diagonal"],"Other")
+
+
+def __find_received_passes(runs,event,pass_window):
+    '''
+    Id of the first pass to the runner that started during the run or up to pass_window seconds after it, NaN if none.
+    '''
+
+    passes=event[(event["Type"]=="PASS") & event["To"].notna() & event["Team"].notna()]
+    passes=pd.DataFrame({"Player":mio.get_tracking_names(passes,"To"),"Pass":passes.index,
+                         "Pass Time":passes["Start Time [s]"].to_numpy(dtype=float)})
+    candidates=runs[["Player","Start Time [s]","End Time [s]"]].reset_index().merge(passes,on="Player")
+    received=candidates[(candidates["Pass Time"]>=candidates["Start Time [s]"]) & (candidates["Pass Time"]<=candidates["End Time [s]"]+pass_window)]
+    received=received.sort_values("Pass Time",kind="mergesort").groupby("index")["Pass"].first()
+
+    return received.reindex(runs.index).to_numpy(dtype=float)
+
+
+def __pitch_control_of_runners(runs,frame,tracking_home,tracking_away,model_params,GK_NAMES,offsides,batch_size):
+    '''
+    Pitch control of the team of every run at the position of the runner, at its Start Frame or End Frame (frame "Start" or "End").
+    '''
+
+    rows=tracking_home.index.get_indexer(runs[frame+" Frame"].to_numpy())
+    targets=runs[[frame+" X",frame+" Y"]].to_numpy(dtype=float)
+    home=mpc.get_players_state(tracking_home.iloc[rows],"Home",model_params,GK_NAMES[0])
+    away=mpc.get_players_state(tracking_away.iloc[rows],"Away",model_params,GK_NAMES[1])
+    ball=tracking_home[["ball_x","ball_y"]].to_numpy(dtype=float)[rows]
+
+    pitch_control=np.full(len(runs),np.nan)
+    for attacking_team in ["Home","Away"]:
+        team_runs=np.flatnonzero(runs["Team"].to_numpy(dtype=object)==attacking_team)
+        _,att_positions,att_velocities,_=home if attacking_team=="Home" else away
+        _,def_positions,def_velocities,def_lambdas=away if attacking_team=="Home" else home
+        att_positions=att_positions[team_runs]
+        if offsides: # Offside players have NaN positions, the ball is where it is at the frame
+            offside=mpc.find_offside_players(attacking_team,att_positions,def_positions[team_runs],ball[team_runs])
+            att_positions=np.where(offside[...,None],np.nan,att_positions)
+        for start in range(0,len(team_runs),batch_size):
+            batch=team_runs[start:start+batch_size]
+            k=np.arange(start,start+len(batch))
+            pitch_control[batch],_=mpc.pitch_control_at_targets(targets[batch],att_positions[k],att_velocities[batch],def_positions[batch],
+                                                                 def_velocities[batch],def_lambdas,ball[batch],model_params)
+
+    return pitch_control
+
+
+@mmon.timed
+def get_off_ball_runs(event,tracking_home,tracking_away,params=None,model_params=None,summary_params=None,pitch_control=True,batch_size=500):
+    '''
+    Finds and classifies the off-ball runs of the players of both teams.
+
+    Parameters
+    ----------
+    event: pd.Dataframe with Event Data.
+    tracking_home: pd.Dataframe with Tracking Data for Home Team, with velocities and a single playing direction.
+    tracking_away: pd.Dataframe with Tracking Data for Away Team, with velocities and a single playing direction.
+    params: Dictionary with off-ball run parameters. Default is None, that is get_run_parameters().
+    model_params: Dictionary with pitch control model parameters. Default is None, that is Metrica_Pitch_Control.get_model_parameters().
+    summary_params: Dictionary with frame duration. Default is None, that is Physical_Performace.get_summary_parameters().
+    pitch_control: Calculate the pitch control at the start and the end of every run. Default is True.
+    batch_size: Number of runs in every pitch control calculation. Default is 500.
+
+    Returns
+    -------
+    runs: pd.DataFrame with a row per run and the columns of Physical_Segments.get_players_segments (without "Type" and
+          "Peak Acceleration (m/s^2)") and
+          "Team": "Home" or "Away".
+          "Type": "In Behind", "Overlap", "Checking", "Diagonal" or "Other".
+          "Event ID","Event Team","Event Type": Last possession event at or before the Start Frame, see Physical_Segments.link_segments_to_events.
+          "Pass Received": Id of the pass the runner received during the run (or up to params["pass_window"] seconds after), NaN if none.
+          "Pitch Control Start","Pitch Control End": Pitch control of the team at the position of the runner at the Start and End Frame.
+          "Pitch Control Gained": Pitch Control End - Pitch Control Start.
+    '''
+
+    params=get_run_parameters() if params is None else params
+    model_params=mpc.get_model_parameters() if model_params is None else model_params
+    assert tracking_home.index.equals(tracking_away.index),"Tracking Home index should be same with Tracking Away index."
+
+    runs=pd.concat([__detect_runs(tracking_home,"Home",event,params,summary_params),
+                    __detect_runs(tracking_away,"Away",event,params,summary_params)],ignore_index=True)
+    runs=runs.sort_values(["Start Frame","Player"],kind="mergesort").reset_index(drop=True)
+    runs.insert(2,"Type",__classify_runs(runs,tracking_home,tracking_away,params) if len(runs)>0 else [])
+
+    runs=mseg.link_segments_to_events(runs,event[event["Type"].isin(params["possession_types"])])
+    runs["Pass Received"]=__find_received_passes(runs,event,params["pass_window"])
+
+    if pitch_control:
+        GK_NAMES=[mio.get_goalkeeper_name(tracking_home),mio.get_goalkeeper_name(tracking_away)]
+        runs["Pitch Control Start"]=__pitch_control_of_runners(runs,"Start",tracking_home,tracking_away,model_params,GK_NAMES,params["offsides"],batch_size)
+        runs["Pitch Control End"]=__pitch_control_of_runners(runs,"End",tracking_home,tracking_away,model_params,GK_NAMES,params["offsides"],batch_size)
+        runs["Pitch Control Gained"]=runs["Pitch Control End"]-runs["Pitch Control Start"]
+    logger.info("Found %d off-ball runs",len(runs))
+
+    return runs
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+
+Team shape at every frame of a match: centroid, width, length, surface area (convex hull), compactness, height of the
+defensive, midfield and attacking lines and the distance between the defensive and attacking lines.
+Everything is calculated for all frames at once from the (frames,players) arrays of the Tracking Data.
+Tracking Data should have a single playing direction (Metrica_IO.set_single_playing_direction),
+that is Home attacks left to right and Away right to left. Shapes are indexed by Frame, get_shape_at_events joins them with events.
+
+
+@author: Apatsidis Ioannis
+"""
+
+import re
+import numpy as np
+import pandas as pd
+import Metrica_IO as mio
+import Metrica_Monitor as mmon
+
+
+def get_shape_parameters():
+    '''
+    Setting the players and lines of team shape.
+
+    Returns
+    -------
+    params: Dictionary with team shape parameters
+    '''
+    params={}
+    params["exclude_goalkeeper"]=True # Shape of the outfield players only
+    # Outfield players are split in lines by how advanced they are in every frame: the n_defenders deepest ones,
+    # the n_attackers most advanced ones and the rest in midfield
+    params["n_defenders"]=4
+    params["n_attackers"]=2
+
+    return params
+
+
+def get_convex_hull_areas(positions):
+    '''
+    Area of the convex hull of the players in every frame, with gift wrapping for all frames at once: starting from the
+    leftmost player, the next point of the hull is the player with no other player to the right of the line to it.
+    A hull has at most n_players points, so there are at most n_players steps of n_players comparisons each.
+
+    Parameters
+    ----------
+    positions: np.array with (x,y) positions in shape (n_frames,n_players,2). Players who are not in frame have NaN positions.
+
+    Returns
+    -------
+    areas: np.array with the area of every frame in square meters. 0 for less than 3 players, NaN for no players.
+    '''
+
+    positions=np.asarray(positions,dtype=float)
+    n_frames,n_players,_=positions.shape
+    valid=~np.any(np.isnan(positions),axis=-1)
+    x=np.where(valid,positions[...,0],0.)
+    y=np.where(valid,positions[...,1],0.)
+    frames=np.arange(n_frames)
+    players=np.arange(n_players)
+
+    # Leftmost player (lowest y for ties) is on the hull
+    filled_x=np.where(valid,x,np.inf)
+    first=np.argmin(np.where(valid & (filled_x==np.min(filled_x,axis=1)[:,None]),y,np.inf),axis=1)
+    areas=np.where(valid.any(axis=1),0.,np.nan)
+    active=valid.sum(axis=1)>=3
+    current=first
+    for _ in range(n_players):
+        px,py=x[frames,current],y[frames,current]
+        # Any other player to start with, then every player to the right of the line from current to candidate takes its place.
+        # Collinear players are skipped for the farthest one, players at the same position are never taken.
+        candidate=np.argmax(valid & (players[None,:]!=current[:,None]),axis=1)
+        for k in range(n_players):
+            rx,ry=x[frames,candidate]-px,y[frames,candidate]-py
+            kx,ky=x[:,k]-px,y[:,k]-py
+            cross=rx*ky-ry*kx
+            better=valid[:,k] & (current!=k) & ((cross<0) | ((cross==0) & (kx**2+ky**2>rx**2+ry**2)))
+            candidate=np.where(better,k,candidate)
+        # Shoelace term of the edge from current to candidate
+        areas+=np.where(active,0.5*(px*y[frames,candidate]-x[frames,candidate]*py),0.)
+        current=candidate
+        active&=current!=first
+        if not active.any():
+            break
+
+    return areas
+
+
+@mmon.timed
+def get_team_shape(team,params=None,field_dimensions=(106.,68.),frame_step=1):
+    '''
+    Team shape at every frame_step-th frame of the Tracking Data of a team.
+
+    Parameters
+    ----------
+    team: pd.DataFrame with Tracking Data of a team, with a single playing direction.
+    params: Dictionary with team shape parameters. Default is None, that is get_shape_parameters().
+    field_dimensions: Field dimensions in meters (Width x Height). Default is (106,68).
+    frame_step: Keep every frame_step-th frame, to downsample. Default is 1.
+
+    Returns
+    -------
+    shape: pd.DataFrame indexed by Frame with
+           "Centroid X", "Centroid Y": Mean position of the players.
+           "Width (m)", "Length (m)": Extent of the players across and along the field.
+           "Area (m2)": Area of the convex hull of the players.
+           "Compactness (m)": Mean distance of the players from the centroid, lower is more compact.
+           "Defensive Line (m)", "Midfield Line (m)", "Attacking Line (m)": Mean distance of the players of each line from the own goal line.
+           "Lines Distance (m)": Distance between the defensive and the attacking line.
+    '''
+
+    params=get_shape_parameters() if params is None else params
+
+    players=[column[:-2] for column in team.columns if re.match(r"^(Home|Away)_\d+_x$",column)]
+    assert len(players)>0,"No players found in the Tracking Data."
+    team_name=players[0].split("_")[0]
+    if params["exclude_goalkeeper"]:
+        GK_NAME=mio.get_goalkeeper_name(team)
+        players=[player for player in players if player!=GK_NAME]
+
+    team=team.iloc[::frame_step]
+    x=team[[player+"_x" for player in players]].to_numpy(dtype=float)
+    y=team[[player+"_y" for player in players]].to_numpy(dtype=float)
+    valid=~np.isnan(x) & ~np.isnan(y)
+    x=np.where(valid,x,np.nan)
+    y=np.where(valid,y,np.nan)
+    n_players=valid.sum(axis=1)
+    in_frame=n_players>0
+
+    shape=pd.DataFrame(index=team.index)
+    with np.errstate(invalid="ignore"):
+        centroid_x=np.nansum(x,axis=1)/np.where(in_frame,n_players,np.nan)
+        centroid_y=np.nansum(y,axis=1)/np.where(in_frame,n_players,np.nan)
+    # Depth of the players along the direction of attack, from the own goal line
+    direction=1. if team_name=="Home" else -1.
+    depth=direction*x+field_dimensions[0]/2.
+    filled_depth=np.where(valid,depth,np.inf)
+    filled_y=np.where(valid,y,np.inf)
+
+    shape["Centroid X"]=centroid_x
+    shape["Centroid Y"]=centroid_y
+    shape["Width (m)"]=np.where(in_frame,np.max(np.where(valid,y,-np.inf),axis=1)-np.min(filled_y,axis=1),np.nan)
+    shape["Length (m)"]=np.where(in_frame,np.max(np.where(valid,depth,-np.inf),axis=1)-np.min(filled_depth,axis=1),np.nan)
+    shape["Area (m2)"]=get_convex_hull_areas(np.stack([x,y],axis=-1))
+    distances=np.sqrt((x-centroid_x[:,None])**2+(y-centroid_y[:,None])**2)
+    with np.errstate(invalid="ignore"):
+        shape["Compactness (m)"]=np.nansum(distances,axis=1)/np.where(in_frame,n_players,np.nan)
+
+    # Lines by rank of depth in every frame, players not in frame are sorted last
+    sorted_depth=np.sort(filled_depth,axis=1)
+    rank=np.arange(sorted_depth.shape[1])[None,:]
+    n_def=np.minimum(params["n_defenders"],n_players)[:,None]
+    n_att=np.minimum(params["n_attackers"],n_players-n_def[:,0])[:,None]
+    lines={"Defensive Line (m)":rank<n_def,
+           "Midfield Line (m)":(rank>=n_def) & (rank<n_players[:,None]-n_att),
+           "Attacking Line (m)":(rank>=n_players[:,None]-n_att) & (rank<n_players[:,None])}
+    for name,members in lines.items():
+        count=members.sum(axis=1)
+        shape[name]=np.where(count>0,np.sum(np.where(members,sorted_depth,0.),axis=1)/np.maximum(count,1),np.nan)
+    shape["Lines Distance (m)"]=shape["Attacking Line (m)"]-shape["Defensive Line (m)"]
+
+    return shape
+
+
+def get_teams_shape(tracking_home,tracking_away,params=None,field_dimensions=(106.,68.),frame_step=1):
+    '''
+    Team shape of both teams at every frame_step-th frame, see get_team_shape.
+
+    Parameters
+    ----------
+    tracking_home: pd.Dataframe with Tracking Data for Home Team, with a single playing direction.
+    tracking_away: pd.Dataframe with Tracking Data for Away Team, with a single playing direction.
+    params: Dictionary with team shape parameters. Default is None, that is get_shape_parameters().
+    field_dimensions: Field dimensions in meters (Width x Height). Default is (106,68).
+    frame_step: Keep every frame_step-th frame, to downsample. Default is 1.
+
+    Returns
+    -------
+    shape: pd.DataFrame indexed by Frame with "Period", "Time [s]" and the columns of get_team_shape for each team,
+           starting with "Home " or "Away ", e.g. "Home Width (m)".
+    '''
+
+    home=get_team_shape(tracking_home,params,field_dimensions,frame_step).add_prefix("Home ")
+    away=get_team_shape(tracking_away,params,field_dimensions,frame_step).add_prefix("Away ")
+    shape=tracking_home[["Period","Time [s]"]].iloc[::frame_step]
+
+    return pd.concat([shape,home,away],axis=1)
+
+
+def get_shape_at_events(event,shape,frame="Start Frame"):
+    '''
+    Team shape at the frame of every event. Events whose frame is not in shape (e.g. after downsampling) get the shape of the
+    last frame before it.
+
+    Parameters
+    ----------
+    event: pd.Dataframe with Event Data.
+    shape: pd.DataFrame from get_team_shape or get_teams_shape.
+    frame: Frame of the events, "Start Frame" or "End Frame". Default is "Start Frame".
+
+    Returns
+    -------
+    event_shape: pd.DataFrame with the columns of shape, indexed by event id.
+    '''
+
+    frames=shape.index.to_numpy()
+    positions=np.searchsorted(frames,event[frame].to_numpy(),side="right")-1
+    event_shape=shape.iloc[np.maximum(positions,0)].set_axis(event.index,axis=0)
+    event_shape.loc[positions<0]=np.nan
+
+    return event_shape
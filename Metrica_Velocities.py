@@ -8,17 +8,29 @@ Calculation of player velocities.
 """
 import re
 import numpy as np
+import pandas as pd
+import Metrica_Monitor as mmon
 
+logger=mmon.get_logger(__name__)
 
-def calc_player_velocities(team,max_speed=11,smoothing=True):
+
+@mmon.timed
+def calc_player_velocities(team,max_speed=11,smoothing=True,compact=False,window=5):
     """
     Calculate player velocities and speed.
+    All players are calculated at once on 2-D (frames x players) arrays and the new columns are attached in one step.
+    
+    Smoothing is a NaN-aware moving average: every velocity is the mean of the valid velocities within the window, so
+    a single missing or unrealistic measurement no longer spreads NaN over the whole window, and at the start and the end
+    of the data the window is truncated instead of padded with zeros. Velocities are NaN when the player is not in the frame.
     
     Parameters
     ----------
     team: pd.DataFrame with Tracking Data for a team.
     max_speed: Maximum speed that a human is reallistically able to run in meters/second. Speeds higher than this value are considered outliers and set to NaN.
     smoothing: Boolean variable determining if "moving average" is going to be applied to the calculation of velocities
+    compact: Store velocities and speed as float32 (see Metrica_IO.to_compact_tracking). Default is False.
+    window: Number of frames of the moving average. Default is 5.
     Returns
     -------
     team: pd.DataFrame with players' xy velocities and speed.
@@ -27,44 +39,88 @@ def calc_player_velocities(team,max_speed=11,smoothing=True):
     
     team=remove_player_velocities(team)
     
-    # Time intervals per measurement in Metrica Data are always 40ms.
-    time_intervals=team["Time [s]"].diff()
+    # Time intervals per measurement, 40ms in Metrica Data and longer for resampled data (Metrica_IO.resample_tracking).
+    time_intervals=team["Time [s]"].diff().to_numpy(dtype=float)[:,None]
     
     # Get all players , e.g. Home_1 , Away_2
     players=np.unique(([x.split('_')[0]+'_'+x.split('_')[1] for x in team.columns if "Away_" in x or "Home_" in x]))
     
     team_name=team.columns[3].split("_")[0]
-    print("Calculating velocities for: ",team_name )
+    logger.info("Calculating velocities for: %s",team_name)
     
-    for player in players:
-        
-        
-        # Add velocities to DataFrame
-        team[player+"_vx"]=team[player+"_x"].diff()/time_intervals
-        team[player+"_vy"]=team[player+"_y"].diff()/time_intervals
+    # Positions in shape (frames,players)
+    x=team[[p+"_x" for p in players]].to_numpy(dtype=float)
+    y=team[[p+"_y" for p in players]].to_numpy(dtype=float)
+    
+    vx=np.full(x.shape,np.nan)
+    vy=np.full(y.shape,np.nan)
+    vx[1:]=np.diff(x,axis=0)/time_intervals[1:]
+    vy[1:]=np.diff(y,axis=0)/time_intervals[1:]
+    
+    # Excluding Errors in measurements / Unrealistic velocities that exceed the maximun speed
+    if (max_speed>0):
+        with np.errstate(invalid='ignore'):
+            outliers=np.sqrt(vx**2 + vy**2)>max_speed
+        vx[outliers]=np.nan
+        vy[outliers]=np.nan
         
-        # Excluding Errors in measurements / Unrealistic velocities that exceed the maximun speed
-        if (max_speed>0):
-            speed_estimate=np.sqrt(team[player+"_vx"]**2 + team[player+"_vy"]**2)
-            team.loc[speed_estimate>max_speed,player+"_vx"]=np.nan
-            team.loc[speed_estimate>max_speed,player+"_vy"]=np.nan
-            
-        # Apply Moving Average for smoothing
-        # mode='same' means same as before smoothing when there are no 5(window) points, same length.
-        if (smoothing):
-            window=5
-            box=np.ones(window)/window # Adding 5 and divide by 5.
-            team[player+"_vx"]=np.convolve(team[player+"_vx"],box,mode="same")
-            team[player+"_vy"]=np.convolve(team[player+"_vy"],box,mode="same")
-            
-        # Add speed to DataFrame (m/s)
-        team[player+"_speed"]=np.sqrt(team[player+"_vx"]**2 +team[player+"_vy"]**2)
-
+    # Apply Moving Average for smoothing
+    if (smoothing):
+        not_in_frame=np.isnan(x) | np.isnan(y)
+        vx,vy=np.hsplit(moving_average(np.hstack([vx,vy]),window),2)
+        vx[not_in_frame]=np.nan
+        vy[not_in_frame]=np.nan
+    
+    # Add speed (m/s)
+    speed=np.sqrt(vx**2 + vy**2)
+    
+    # Columns in the order Home_1_vx, Home_1_vy, Home_1_speed, Home_10_vx ...
+    # Built column by column (players*3,frames), so that the transposed array is passed to pandas without a copy
+    velocities=np.stack([vx.T,vy.T,speed.T],axis=1).reshape(3*len(players),len(team))
+    columns=[p+suffix for p in players for suffix in ["_vx","_vy","_speed"]]
+    velocities=pd.DataFrame((velocities.astype(np.float32) if compact else velocities).T,index=team.index,columns=columns)
     
+    team=pd.concat([team,velocities],axis=1)
     
     return team
 
 
+def moving_average(values,window=5):
+    """
+    NaN-aware centered moving average along the first axis (time) of a 2-D array, e.g. frames x players.
+    Uses the same window alignment as np.convolve(mode="same"), but averages only the valid values within the window
+    and truncates the window at the edges. It's NaN only when there is no valid value within the window.
+    
+    Parameters
+    ----------
+    values: np.array in shape (frames,...).
+    window: Number of frames of the moving average. Default is 5.
+    
+    Returns
+    -------
+    smoothed: np.array with the same shape as values.
+    """
+    
+    valid=~np.isnan(values)
+    filled=np.where(valid,values,0.)
+    value_sums=np.zeros(values.shape)
+    valid_counts=np.zeros(values.shape,dtype=np.int32)
+    
+    # Adding the shifted arrays, window offsets from -window//2 to (window-1)//2
+    n=values.shape[0]
+    for offset in range(-(window//2),(window-1)//2+1):
+        target=slice(max(0,-offset),min(n,n-offset)) # frames which have frame+offset within the data
+        source=slice(max(0,offset),min(n,n+offset))
+        value_sums[target]+=filled[source]
+        valid_counts[target]+=valid[source]
+    
+    with np.errstate(invalid='ignore',divide='ignore'):
+        smoothed=value_sums/valid_counts
+    smoothed[valid_counts==0]=np.nan
+    
+    return smoothed
+
+
 
 def remove_player_velocities(team):
     """
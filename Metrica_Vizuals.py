@@ -9,11 +9,19 @@ import matplotlib.pyplot as plt
 import numpy as np
 import matplotlib as mat
 import re
-import matplotlib.animation as animation
 import os
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 from matplotlib.offsetbox import OffsetImage, AnnotationBbox
 import matplotlib.colors 
+import matplotlib.image
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import Metrica_IO as mio
+import Metrica_Monitor as mmon
+
+logger=mmon.get_logger(__name__)
 
 
 def plot_pitch(field_dimensions=(106.,68.),field_color="#32CD32",alpha=0.8) :
@@ -214,11 +222,20 @@ def plot_frame(home_series,away_series,include_player_velocities=False,field_dim
 
 
 
-def save_movie(tracking_home,tracking_away,file_path,file_name,fps=25,figax=None, field_dimensions = (106.0,68.0),include_player_velocities=False,home_team_color='black',away_team_color='red',marker='o',player_alpha=0.7):
+@mmon.timed
+def save_movie(tracking_home,tracking_away,file_path,file_name,fps=25,figax=None, field_dimensions = (106.0,68.0),include_player_velocities=False,home_team_color='black',away_team_color='red',marker='o',player_alpha=0.7,dpi=100,n_jobs=1,lossless=False):
     """
     Saves a movie based on the given indices of Tracking Data. It saves the file in file_path with name as the filename.mp4.
     Indices must be the same for tracking_home and tracking_away.
     
+    Players, velocities, ball and timer are created once and only their data are updated for every frame, from arrays that are
+    taken from the Tracking Data before rendering (see get_movie_arrays). The pitch is drawn once and restored for every frame (blitting),
+    and the pixels of every frame are piped to ffmpeg.
+    
+    With n_jobs>1 the frames are split into n_jobs consecutive segments, every segment is rendered to its own file by a separate process
+    with its own figure, and the segments are joined with the concat demuxer of ffmpeg without re-encoding.
+    Rendered frames are the same with any n_jobs. Use lossless to compare movies pixel by pixel (large files, for checking).
+    
     Parameters
     ----------
     tracking_home: pd.DataFrame with Tracking Data for Home team.
@@ -233,81 +250,315 @@ def save_movie(tracking_home,tracking_away,file_path,file_name,fps=25,figax=None
     marker: marker for the Players. Default is 'o'.
     include_plaer_velocities: Shows velocities of players. Default is False.
     player_alpha: Alpha. Default is 0.7
+    dpi: Dots per inch of the movie. Default is 100.
+    n_jobs: Number of processes rendering segments of the movie, -1 for all CPUs. Default is 1.
+    lossless: Encode frames losslessly in RGB (libx264rgb), instead of h264 in yuv420p. Default is False.
     
     
     """
 
     # Check if the indices are exactly the same for home and away team.
-    assert np.all(list(tracking_home.index)==list(tracking_away.index)),"Tracking Home index should be same with Tracking Away index."
+    assert tracking_home.index.equals(tracking_away.index),"Tracking Home index should be same with Tracking Away index."
 
-    if figax==None: #create new pitch
-        fig,ax=plot_pitch(field_dimensions=field_dimensions)
+    n_jobs=os.cpu_count() if n_jobs==-1 else n_jobs
+    movie=get_movie_arrays(tracking_home,tracking_away,include_player_velocities)
+    style=dict(field_dimensions=field_dimensions,field_color="#32CD32",home_team_color=home_team_color,away_team_color=away_team_color,
+               marker=marker,player_alpha=player_alpha,ball_color='white',ball_size=3)
+    
+    # Set Movie Settings
+    metadata=dict(title="Tracking Data",comment="Metrica tracking data movie")
+    file_path=os.path.join(file_path,file_name+".mp4")
+    
+    # Generating movie process
+    logger.info("Generating movie..\nWait...")
+    
+    __render_movie(movie,file_path,fps,dpi,metadata,lossless,style,n_jobs,figax)
+    
+    logger.info("Ready")
+
+
+@mmon.timed
+def save_pitch_control_movie(tracking_home,tracking_away,surfaces,file_path,file_name,attacking_team="Home",epv_grid=None,fps=25,
+                             field_dimensions=(106.0,68.0),include_player_velocities=False,alpha=0.6,interpolation="bilinear",dpi=100,n_jobs=1,lossless=False):
+    """
+    Saves a movie with the pitch control of a team under the players, or Expected EPV (EPV * pitch control) if epv_grid is given.
+    Surfaces are calculated beforehand (see Metrica_Pitch_Control.get_pitch_control_surfaces, which can cache them),
+    so rendering only updates the data of a single image, and only when the surface changes (e.g. every frame_step frames of
+    get_pitch_control_surfaces). Frames are rendered as in save_movie.
+    By default gray indicates area in which Home Team Players have control, whereas for red Away Team Players.
+    
+    Parameters
+    ----------
+    tracking_home: pd.DataFrame with Tracking Data for Home team.
+    tracking_away: pd.DataFrame with Tracking Data for Away team.
+    surfaces: np.array in shape (n_frames,num_grid_cells_y,num_grid_cells_x) with pitch control probability of attacking_team at every frame.
+    file_path: Path for the movie to be saved at.
+    file_name: Name of the movie file.
+    attacking_team: Team of the surfaces, "Home" or "Away". Default is "Home".
+    epv_grid: Grid with Expected possession values (Metrica_EPV.load_EPV_grid), in the shape of the surfaces. Default is None, plots pitch control.
+    fps: Frames Per Seconds
+    field_dimensions:  Field dimensions in meters (Width x Height). Default is (106,68).
+    include_player_velocities: Shows velocities of players. Default is False.
+    alpha: Alpha of colors for pitch control. Default is 0.6
+    interpolation: Interpolation of the surfaces. Default is "bilinear", "lanczos" (as in plot_pitch_control_for_event) is about 5 times slower to draw.
+    dpi: Dots per inch of the movie. Default is 100.
+    n_jobs: Number of processes rendering segments of the movie, -1 for all CPUs. Default is 1.
+    lossless: Encode frames losslessly in RGB (libx264rgb), instead of h264 in yuv420p. Default is False.
+    """
+    
+    # Check if the indices are exactly the same for home and away team.
+    assert tracking_home.index.equals(tracking_away.index),"Tracking Home index should be same with Tracking Away index."
+    assert len(surfaces)==len(tracking_home),"There should be a surface for every frame."
+    
+    n_jobs=os.cpu_count() if n_jobs==-1 else n_jobs
+    movie=get_movie_arrays(tracking_home,tracking_away,include_player_velocities)
+    
+    if epv_grid is None:
+        if attacking_team=="Away":
+            colors=["black","white","red"] #0-->1
+        else: # Home
+            colors=["red","white","black"] #0-->1
+        cmap=matplotlib.colors.LinearSegmentedColormap.from_list('pc_colors',colors) # Needs Default number of bins(256)!!
+        vmax=1
+    else:
+        assert surfaces.shape[1:]==epv_grid.shape,"EPV grid should have the shape of the surfaces, e.g. num_grid_cells_x=50 for the default EPV grid."
+        if mio.find_attacking_direction(attacking_team)==1: # Home team
+            cmap='Greys'
+        else: # Away team
+            cmap='Reds'
+            epv_grid=np.fliplr(epv_grid) # reverse direction
+        surfaces=surfaces*epv_grid # EPV * PPCF
+        vmax=np.max(surfaces)*1.5 # not too dark, same scale for all frames
+        alpha=0.9
+    movie["surface"]=surfaces[:,::-1] # need to flip to get start upper left
+    
+    style=dict(field_dimensions=field_dimensions,field_color="white",home_team_color='black',away_team_color='red',marker='o',player_alpha=0.9,
+               ball_color='green',ball_size=8.2,surface_cmap=cmap,surface_vmax=vmax,surface_alpha=alpha,surface_interpolation=interpolation)
+    
+    metadata=dict(title="Pitch Control" if epv_grid is None else "Expected EPV",comment="Metrica tracking data movie")
+    file_path=os.path.join(file_path,file_name+".mp4")
+    
+    logger.info("Generating movie..\nWait...")
+    
+    __render_movie(movie,file_path,fps,dpi,metadata,lossless,style,n_jobs)
+    
+    logger.info("Ready")
+
+
+def __render_movie(movie,file_path,fps,dpi,metadata,lossless,style,n_jobs,figax=None):
+    """
+    Renders the movie arrays to file_path, in a single process or in n_jobs segments that are joined without re-encoding.
+    """
+    
+    assert n_jobs==1 or figax is None,"figax can't be used with n_jobs>1, every process creates its own pitch."
+    
+    segments=[positions for positions in np.array_split(np.arange(len(movie["time"])),n_jobs) if len(positions)>0]
+    if len(segments)<=1:
+        __save_movie_segment(movie,file_path,fps,dpi,metadata,lossless,style,figax)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            segment_paths=[os.path.join(directory,"segment_{}.mp4".format(i)) for i in range(len(segments))]
+            with ProcessPoolExecutor(max_workers=len(segments)) as executor:
+                # Every process gets only the frames of its segment
+                futures=[executor.submit(__save_movie_segment,{key:values[positions] for key,values in movie.items()},
+                                         segment_path,fps,dpi,metadata,lossless,style)
+                         for positions,segment_path in zip(segments,segment_paths)]
+                for future in futures:
+                    future.result()
+            __concat_movies(segment_paths,file_path,metadata)
+
+
+def __save_movie_segment(movie,file_path,fps,dpi,metadata,lossless,style,figax=None):
+    """
+    Renders all frames of the movie arrays to file_path. Runs in the worker processes of save_movie too.
+    """
+    
+    if figax is None: #create new pitch
+        fig,ax=plot_pitch(field_dimensions=style["field_dimensions"],field_color=style["field_color"])
     else: # overlay on existing pitch
         fig,ax=figax
     fig.set_tight_layout(True)
     
-    # Either away or home team index
-    index=tracking_away.index
+    artists=__create_movie_artists(ax,movie,style)
+    __write_movie(fig,artists,movie,file_path,fps,dpi,metadata,lossless)
     
-    # Set Movie Settings
-    metadata=dict(title="Tracking Data",comment="Metrica tracking data movie")
-    ffmpeg=animation.FFMpegWriter(fps=fps,metadata=metadata)
+    plt.close(fig)
+
+
+def __concat_movies(segment_paths,file_path,metadata):
+    """
+    Joins movies with the same encoding into file_path, with the concat demuxer of ffmpeg and without re-encoding.
+    """
     
+    list_path=os.path.splitext(segment_paths[0])[0]+"_list.txt"
+    with open(list_path,"w") as f:
+        f.writelines("file '{}'\n".format(os.path.abspath(path).replace("'","'\\''")) for path in segment_paths)
     
-    file_path=os.path.join(file_path,file_name+".mp4")
+    args=[mat.rcParams["animation.ffmpeg_path"],"-loglevel","error","-f","concat","-safe","0","-i",list_path,"-c","copy"]
+    for key,value in metadata.items():
+        args+=["-metadata","{}={}".format(key,value)]
+    args+=["-y",file_path]
     
-    # Generating movie process
-    print("Generating movie..\nWait...")
+    result=subprocess.run(args,stdout=subprocess.DEVNULL,stderr=subprocess.PIPE)
+    if result.returncode!=0:
+        raise RuntimeError("ffmpeg failed with exit code {}: {}".format(result.returncode,result.stderr.decode(errors="replace")))
+
+
+def get_movie_arrays(tracking_home,tracking_away,include_player_velocities=False):
+    """
+    Takes the positions (and velocities) of players, the ball and the time of every frame from the Tracking Data as contiguous arrays,
+    so that frames are read by position while rendering.
     
-    with ffmpeg.saving(fig=fig,outfile=file_path,dpi=100):
-        
-        # Get objects to be plotted per row
-        # Plot one row, then delete axis objects and get objects from next row.
-        for idx in index:
-            objects=[]
-            for team, color in zip([tracking_home.loc[idx],tracking_away.loc[idx]], [home_team_color,away_team_color]):
-                    
-                player_x_columns=[x for x in team.index if (re.match(r"Home_[0-9]+_x|Away_[0-9]+_x",x))]
-                player_y_columns=[y for y in team.index if (re.match(r"Home_[0-9]+_y|Away_[0-9]+_y",y))]
-                # Players' positions
-                obj,=ax.plot(team[player_x_columns],team[player_y_columns],marker,color=color,markersize=10,alpha=player_alpha)
-                objects.append(obj)
-                if include_player_velocities:
-                    vx_columns=[x.replace("_x","_vx") for x in player_x_columns]
-                    vy_columns=[y.replace("_y","_vy") for y in player_y_columns]
-                    obj=ax.quiver(team[player_x_columns],team[player_y_columns],team[vx_columns],team[vy_columns],color=color,alpha=1,
-                                  scale_units='inches', scale=10.,width=0.0015,headlength=5,headwidth=3,zorder=4)
-                    objects.append(obj)
-            # Plot ball position
-            obj,=ax.plot(team["ball_x"],team["ball_y"],marker,markersize=3,color='white')
-            objects.append(obj)
-            # Timer on top of the field
-            frame_minute=int(team["Time [s]"]/60.0)
-            frame_second=(team["Time [s]"]/60.0 - frame_minute)*60
-            timer_text="{}:{:.1f}".format(frame_minute,frame_second) # Timer like '2:40'
-            obj=ax.text(-8,field_dimensions[1]/2 +8,timer_text,bbox=dict(facecolor='#3C83F6', alpha=0.5,edgecolor='blue'))
-            objects.append(obj)
-            ffmpeg.grab_frame() #Grab the image information from the figure and save as a movie frame.
-            # Delete all axis objects to create the next frame
-            for object in objects:
-                object.remove()
-            
-        print("Ready")
-        plt.clf()
-        plt.close(fig)
+    Parameters
+    ----------
+    tracking_home: pd.DataFrame with Tracking Data for Home team.
+    tracking_away: pd.DataFrame with Tracking Data for Away team.
+    include_player_velocities: Takes velocities of players too. Default is False.
+    
+    Returns
+    -------
+    movie: Dictionary with np.arrays "Home_x","Home_y","Away_x","Away_y" (and "Home_vx","Home_vy","Away_vx","Away_vy") in shape (frames,players),
+           "ball_x","ball_y","time" in shape (frames,) and "index" with the frames.
+    """
+    
+    movie={}
+    for team_name,team in [("Home",tracking_home),("Away",tracking_away)]:
+        x_columns=[x for x in team.columns if re.match(r"(Home|Away)_[0-9]+_x$",x)]
+        y_columns=[x[:-2]+"_y" for x in x_columns]
+        movie[team_name+"_x"]=team[x_columns].to_numpy(dtype=float)
+        movie[team_name+"_y"]=team[y_columns].to_numpy(dtype=float)
+        if include_player_velocities:
+            movie[team_name+"_vx"]=team[[x[:-2]+"_vx" for x in x_columns]].to_numpy(dtype=float)
+            movie[team_name+"_vy"]=team[[x[:-2]+"_vy" for x in x_columns]].to_numpy(dtype=float)
+    movie["ball_x"]=tracking_home["ball_x"].to_numpy(dtype=float)
+    movie["ball_y"]=tracking_home["ball_y"].to_numpy(dtype=float)
+    movie["time"]=tracking_home["Time [s]"].to_numpy(dtype=float)
+    movie["index"]=tracking_home.index.to_numpy()
+    
+    return movie
+
+
+def __create_movie_artists(ax,movie,style):
+    """
+    Creates the artists of the movie once, at the first frame. They are animated, so the pitch can be drawn without them,
+    and they are left out of the layout, so the layout is the same whichever frame the movie (or segment) starts from.
+    Returns a dictionary with the artists, in drawing order.
+    """
+    
+    field_dimensions=style["field_dimensions"]
+    artists={}
+    if "surface" in movie:
+        # vmin=0 because pitch control and EPV are not negative
+        artists["surface"]=ax.imshow(movie["surface"][0],extent=(-field_dimensions[0]/2,field_dimensions[0]/2,-field_dimensions[1]/2,field_dimensions[1]/2),
+                                     origin="upper",interpolation=style["surface_interpolation"],cmap=style["surface_cmap"],vmin=0,vmax=style["surface_vmax"],
+                                     alpha=style["surface_alpha"],animated=True)
+    for team_name,color in zip(["Home","Away"],[style["home_team_color"],style["away_team_color"]]):
+        # Players' positions
+        artists[team_name],=ax.plot(movie[team_name+"_x"][0],movie[team_name+"_y"][0],style["marker"],color=color,markersize=10,alpha=style["player_alpha"],animated=True)
+        if team_name+"_vx" in movie:
+            artists[team_name+"_velocities"]=ax.quiver(movie[team_name+"_x"][0],movie[team_name+"_y"][0],movie[team_name+"_vx"][0],movie[team_name+"_vy"][0],
+                                                       color=color,alpha=1,scale_units='inches', scale=10.,width=0.0015,headlength=5,headwidth=3,zorder=4,animated=True)
+    # Ball position
+    artists["ball"],=ax.plot(movie["ball_x"][:1],movie["ball_y"][:1],style["marker"],markersize=style["ball_size"],color=style["ball_color"],animated=True)
+    # Timer on top of the field
+    artists["timer"]=ax.text(-8,field_dimensions[1]/2 +8,__get_timer_text(movie["time"][0]),bbox=dict(facecolor='#3C83F6', alpha=0.5,edgecolor='blue'),animated=True)
+    for artist in artists.values():
+        artist.set_in_layout(False)
+    
+    return artists
+
+
+def __update_movie_artists(artists,movie,i):
+    """
+    Updates the data of the movie artists to frame i (position in movie arrays).
+    """
+    
+    for team_name in ["Home","Away"]:
+        x,y=movie[team_name+"_x"][i],movie[team_name+"_y"][i]
+        artists[team_name].set_data(x,y)
+        if team_name+"_velocities" in artists:
+            artists[team_name+"_velocities"].set_offsets(np.column_stack([x,y]))
+            artists[team_name+"_velocities"].set_UVC(movie[team_name+"_vx"][i],movie[team_name+"_vy"][i])
+    artists["ball"].set_data(movie["ball_x"][i:i+1],movie["ball_y"][i:i+1])
+    artists["timer"].set_text(__get_timer_text(movie["time"][i]))
+
+
+def __get_timer_text(time):
+    """
+    Timer like '2:40.0' from time in seconds.
+    """
+    
+    frame_minute=int(time/60.0)
+    frame_second=(time/60.0 - frame_minute)*60
+    
+    return "{}:{:.1f}".format(frame_minute,frame_second)
+
+
+def __write_movie(fig,artists,movie,file_path,fps,dpi,metadata,lossless=False):
+    """
+    Renders all frames of the movie arrays with blitting and pipes them to ffmpeg.
+    The figure is drawn once without the animated artists, then for every frame the background is restored and only the artists are drawn.
+    """
+    
+    # Agg canvas, for drawing in memory
+    canvas=FigureCanvasAgg(fig)
+    fig.set_dpi(dpi)
+    canvas.draw()
+    fig.set_tight_layout(False) # Layout stays the same for all frames
+    background=canvas.copy_from_bbox(fig.bbox)
+    pitch=background
+    height,width=np.asarray(canvas.buffer_rgba()).shape[:2]
+    
+    # Same arguments with matplotlib.animation.FFMpegWriter
+    args=[mat.rcParams["animation.ffmpeg_path"],"-f","rawvideo","-vcodec","rawvideo","-s","{}x{}".format(width,height),"-pix_fmt","rgba",
+          "-framerate",str(fps),"-loglevel","error","-i","pipe:"]
+    if lossless:
+        args+=["-vcodec","libx264rgb","-qp","0","-pix_fmt","rgb24"]
+    else:
+        args+=["-vcodec","h264","-pix_fmt","yuv420p"]
+        if width%2 or height%2: # yuv420p needs even dimensions
+            args+=["-vf","scale=trunc(iw/2)*2:trunc(ih/2)*2"]
+    for key,value in metadata.items():
+        args+=["-metadata","{}={}".format(key,value)]
+    args+=["-y",file_path]
+    
+    process=subprocess.Popen(args,stdin=subprocess.PIPE,stdout=subprocess.DEVNULL,stderr=subprocess.PIPE)
+    try:
+        for i in range(len(movie["time"])):
+            if "surface" in artists and (i==0 or not np.array_equal(movie["surface"][i],movie["surface"][i-1])):
+                # Surface is drawn into the background, only when it changes (images are slow to draw)
+                canvas.restore_region(pitch)
+                artists["surface"].set_data(movie["surface"][i])
+                fig.draw_artist(artists["surface"])
+                background=canvas.copy_from_bbox(fig.bbox)
+            canvas.restore_region(background)
+            __update_movie_artists(artists,movie,i)
+            for name,artist in artists.items():
+                if name!="surface":
+                    fig.draw_artist(artist)
+            process.stdin.write(canvas.buffer_rgba())
+            mmon.progress("save_movie",i+1,len(movie["time"]))
+    finally:
+        process.stdin.close()
+        error=process.stderr.read()
+        process.wait()
+    if process.returncode!=0:
+        raise RuntimeError("ffmpeg failed with exit code {}: {}".format(process.returncode,error.decode(errors="replace")))
         
         
 
-def plot_ball_position_at_goals(event,tracking_home,tracking_away):
+def plot_ball_position_at_goals(event,tracking_home,tracking_away,event_index=None):
     '''
     Plots ball position at goals of Home and Away Team.
-    Note, that ball position is measured as the bosition at the END FRAME of the event.
+    Note, that ball position is measured as the bosition at the END FRAME of the event. Goals whose END FRAME is not tracked
+    are not plotted, and when the ball is lost at the END FRAME an earlier frame of the same Period is used.
     
     Parameters
     ----------
     event: pd.DataFrame containing events.
     tracking_home: pd.DataFrame with Tracking Data for Home team.
     tracking_away: pd.DataFrame with Tracking Data for Away team.
+    event_index: Join index from Metrica_IO.build_event_tracking_index. Default is None, that is built here.
     Returns
     -------
     fig,ax1,ax2 : Figure , Axis objects of the  plot.
@@ -315,25 +566,27 @@ def plot_ball_position_at_goals(event,tracking_home,tracking_away):
     '''
     
     # Goals
-    goals=event.loc[~(event["Subtype"].isna()) & (event["Subtype"].str.contains("-GOAL"))]
-    home_goal_indices=goals.loc[goals["Team"]=="Home","End Frame"]
-    away_goal_indices=goals.loc[goals["Team"]=="Away","End Frame"]
-    
-    home_ball_xy,away_ball_xy=[],[]
-    
-    for ind in home_goal_indices:
-        # Checking for Nan in case ball position was lost
-        if np.isnan(tracking_home.loc[ind,"ball_x"]):
-            home_ball_xy.append(tracking_home.loc[ind-3,["ball_x","ball_y"]].values)
-        else:
-            home_ball_xy.append(tracking_home.loc[ind,["ball_x","ball_y"]].values)
-        
-    for ind in away_goal_indices:
+    is_goal=(~(event["Subtype"].isna()) & (event["Subtype"].str.contains("-GOAL"))).to_numpy(dtype=bool)
+    event_index=mio.build_event_tracking_index(event,tracking_home,tracking_away) if event_index is None else event_index
+    
+    # Gather End Frames of all goals with positional indexing
+    ball_xy=[]
+    for tracking,team_code,lag in [(tracking_home,1,3),(tracking_away,-1,2)]:
+        rows=event_index["end_row"][is_goal & (event_index["team"]==team_code)]
+        if np.any(rows<0):
+            logger.warning("%d goals without a tracked End Frame are not plotted",int(np.sum(rows<0)))
+            rows=rows[rows>=0]
+        ball=tracking[["ball_x","ball_y"]].to_numpy()
+        # First row of the Period of every row, the lagged rows don't go back to the previous Period
+        periods=tracking["Period"].to_numpy()
+        period_starts=np.flatnonzero(np.concatenate([[True],periods[1:]!=periods[:-1]]))
+        first_rows=period_starts[np.searchsorted(period_starts,rows,side="right")-1]
+        xy=ball[rows]
         # Checking for Nan in case ball position was lost
-        if np.isnan(tracking_away.loc[ind,"ball_x"]): 
-            away_ball_xy.append(tracking_away.loc[ind-2,["ball_x","ball_y"]].values)
-        else:
-            away_ball_xy.append(tracking_away.loc[ind,["ball_x","ball_y"]].values)
+        lost=np.isnan(xy[:,0])
+        xy[lost]=ball[np.maximum(rows[lost]-lag,first_rows[lost])]
+        ball_xy.append(xy)
+    home_ball_xy,away_ball_xy=ball_xy
             
     # Lists and in Same direction
     away_ball_x=np.array([abs(53-abs(i[0])) for i in away_ball_xy])
@@ -394,7 +647,34 @@ def plot_ball_position_at_goals(event,tracking_home,tracking_away):
     return fig,ax1,ax2
 
 
-def plot_pitch_control_for_event(event_id,event,tracking_home,tracking_away,pc_att,x_grid,y_grid,annotate_player=False,field_dimensions = (106.0,68.0),include_player_velocities=False,alpha=0.6):
+def __get_event_start_frames(event_id,event,tracking_home,tracking_away,event_index=None):
+    '''
+    Finds the tracking rows at the Start Frame of an event and the team in possession.
+    
+    Parameters
+    ----------
+    event_id: int , should be a valid id
+    event: pd.Dataframe with Event Data.
+    tracking_home: pd.Dataframe with Tracking Data for Home Team.
+    tracking_away: pd.Dataframe with Tracking Data for Away Team.
+    event_index: Join index from Metrica_IO.build_event_tracking_index. Default is None, that is label-based lookups.
+    
+    Returns
+    -------
+    home_frame,away_frame: pd.Series with Tracking Data of Home and Away Team at the Start Frame.
+    team_in_possession: "Home" or "Away".
+    '''
+    
+    if event_index is None:
+        frame=event.loc[event_id,"Start Frame"]
+        return tracking_home.loc[frame],tracking_away.loc[frame],event.loc[event_id,"Team"]
+    
+    pos,row=mio.get_event_row(event_index,event_id)
+    team_in_possession=mio.get_team_name(event_index["team"][pos])
+    return tracking_home.iloc[row],tracking_away.iloc[row],team_in_possession
+
+
+def plot_pitch_control_for_event(event_id,event,tracking_home,tracking_away,pc_att,x_grid,y_grid,annotate_player=False,field_dimensions = (106.0,68.0),include_player_velocities=False,alpha=0.6,event_index=None,figax=None):
     '''
     Plot Pitch control for a single event.
     By default gray indicates area in which Home Team Players have control, whereas for red Away Team Players.
@@ -412,22 +692,26 @@ def plot_pitch_control_for_event(event_id,event,tracking_home,tracking_away,pc_a
     field_dimensions:  Field dimensions in meters (Width x Height). Default is (106,68).
     include_player_velocities: Shows velocities of players. Default is False.
     alpha: Alpha of colors for pitch control. Default is 0.6
+    event_index: Join index from Metrica_IO.build_event_tracking_index. If given, tracking rows are found by position. Default is None.
+    figax: Figure, Axis object of an existing pitch. Default is None, that is a new white pitch.
     
     Returns
     -------
     fig,ax: Figure and axis Objects of Pitch with pitch control for an event.
     '''
     
-    frame=event.loc[event_id,"Start Frame"]
-    team_in_possession=event.loc[event_id,"Team"]
+    home_frame,away_frame,team_in_possession=__get_event_start_frames(event_id,event,tracking_home,tracking_away,event_index)
     
     if team_in_possession=="Away":
         colors=["black","white","red"] #0-->1
     else: # Home in possession
         colors=["red","white","black"] #0-->1
     
-    fig,ax=plot_pitch(field_dimensions,field_color="white")
-    plot_frame(tracking_home.loc[frame],tracking_away.loc[frame],include_player_velocities,field_dimensions,player_alpha=0.9,figax=(fig,ax),
+    if figax==None: #create new pitch
+        fig,ax=plot_pitch(field_dimensions,field_color="white")
+    else: # overlay on existing pitch
+        fig,ax=figax
+    plot_frame(home_frame,away_frame,include_player_velocities,field_dimensions,player_alpha=0.9,figax=(fig,ax),
                annotate_player=annotate_player,ball_color='green',markersize=8.2)
     plot_events(event.loc[event_id:event_id],figax=(fig,ax),color=colors[2])
     
@@ -473,7 +757,7 @@ def plot_EPV_grid(epv_grid,attacking_direction,field_dimensions=(106.0,68.0)):
               cmap=cmap,norm=matplotlib.colors.Normalize(vmin=0,vmax=0.6))
 
 
-def plot_EPV_grid_for_event(event_id,event,tracking_home,tracking_away,epv_grid,pc_att,annotate_player=False,field_dimensions = (106.0,68.0),include_player_velocities=False,alpha=0.6,contour=False):
+def plot_EPV_grid_for_event(event_id,event,tracking_home,tracking_away,epv_grid,pc_att,annotate_player=False,field_dimensions = (106.0,68.0),include_player_velocities=False,alpha=0.6,contour=False,event_index=None,figax=None):
     
     '''
     Plots Expected value of EPV at given event_id. (EPV*PPCF)
@@ -491,14 +775,15 @@ def plot_EPV_grid_for_event(event_id,event,tracking_home,tracking_away,epv_grid,
     include_player_velocities: Shows velocities of players. Default is False.
     alpha: Alpha of colors for pitch control. Default is 0.6
     contour: Add contours to areas with Expected EPV > 75% of max(expected EPV). Default is False
+    event_index: Join index from Metrica_IO.build_event_tracking_index. If given, tracking rows are found by position. Default is None.
+    figax: Figure, Axis object of an existing pitch. Default is None, that is a new white pitch.
     Returns
     -------
     fig,ax:Figure and axis Objects of Expected EPV for an event.
     
     '''
     
-    pass_frame=event.loc[event_id,"Start Frame"]
-    team_in_possession=event.loc[event_id,"Team"]
+    home_frame,away_frame,team_in_possession=__get_event_start_frames(event_id,event,tracking_home,tracking_away,event_index)
     
     attacking_direction=mio.find_attacking_direction(team_in_possession)
     if attacking_direction==1: # Home team
@@ -508,8 +793,11 @@ def plot_EPV_grid_for_event(event_id,event,tracking_home,tracking_away,epv_grid,
         epv_grid=np.fliplr(epv_grid) # reverse direction
     
     #plot pitch, event and frame
-    fig,ax=plot_pitch(field_color="white",field_dimensions=field_dimensions)
-    plot_frame(tracking_home.loc[pass_frame],tracking_away.loc[pass_frame],field_dimensions=field_dimensions,figax=(fig,ax),include_player_velocities=include_player_velocities,
+    if figax==None: #create new pitch
+        fig,ax=plot_pitch(field_color="white",field_dimensions=field_dimensions)
+    else: # overlay on existing pitch
+        fig,ax=figax
+    plot_frame(home_frame,away_frame,field_dimensions=field_dimensions,figax=(fig,ax),include_player_velocities=include_player_velocities,
                player_alpha=alpha,annotate_player=annotate_player,ball_color='green',markersize=8.2)
     plot_events(event.loc[event_id:event_id],figax=(fig,ax),color='green',alpha=1)
     
@@ -528,10 +816,261 @@ def plot_EPV_grid_for_event(event_id,event,tracking_home,tracking_away,epv_grid,
         # can add multiple contours if there are multiple such areas
         ax.contour(epvXppcf,extent=(-field_dimensions[0]/2., field_dimensions[0]/2., -field_dimensions[1]/2., field_dimensions[1]/2.),levels=np.array([0.75])*np.max(epvXppcf),
                vmin=0.0,vmax=vmax,colors='blue')
-    
+
+    return fig,ax
+
+
+def plot_heatmap(heatmap,x_edges,y_edges,figax=None,field_dimensions=(106.0,68.0),cmap="Reds",alpha=0.8,vmax=None,interpolation="bilinear"):
+    '''
+    Plots a heatmap (e.g. of a player or a team from Metrica_Heatmaps.get_players_heatmaps) on the pitch.
+
+    Parameters
+    ----------
+    heatmap: np.array in shape (n_bins_y,n_bins_x), row 0 is the bottom of the field.
+    x_edges,y_edges: Edges of the cells in meters.
+    figax: Figure, Axis object of an existing pitch. Default is None, that is a new white pitch.
+    field_dimensions:  Field dimensions in meters (Width x Height). Default is (106,68).
+    cmap: Colormap. Default is 'Reds'.
+    alpha: Alpha of the heatmap. Default is 0.8
+    vmax: Value of the darkest color. Default is None, that is the maximum of the heatmap.
+    interpolation: Interpolation of imshow. Default is 'bilinear'.
+
+    Returns
+    -------
+    fig,ax : Figure , Axis objects of the plot.
+    '''
+
+    if figax==None: #create new pitch
+        fig,ax=plot_pitch(field_dimensions,field_color="white")
+    else: # overlay on existing pitch
+        fig,ax=figax
+
+    # Zero cells are transparent, so the pitch is seen
+    ax.imshow(np.ma.masked_equal(heatmap,0),extent=(x_edges[0],x_edges[-1],y_edges[0],y_edges[-1]),origin="lower",
+              cmap=cmap,alpha=alpha,vmin=0,vmax=vmax,interpolation=interpolation)
+
+    return fig,ax
+
+
+def plot_average_positions(positions,figax=None,field_dimensions=(106.0,68.0),color='black',marker='o',markersize=12,annotate_player=True,alpha=0.8):
+    '''
+    Plots the average positions of players (e.g. from Metrica_Heatmaps.get_average_positions).
+
+    Parameters
+    ----------
+    positions: pd.DataFrame with a row per player like "Home_1" and columns "x","y".
+    figax: Figure, Axis object of an existing pitch. Default is None.
+    field_dimensions:  Field dimensions in meters (Width x Height). Default is (106,68).
+    color: Color of the players. Default is 'black'.
+    marker: Marker of the players. Default is 'o'.
+    markersize: Size of the markers. Default is 12.
+    annotate_player: Annotate the number of each player. Default is True.
+    alpha: Alpha of the markers. Default is 0.8
+
+    Returns
+    -------
+    fig,ax : Figure , Axis objects of the plot.
+    '''
+
+    if figax==None: #create new pitch
+        fig,ax=plot_pitch(field_dimensions=field_dimensions)
+    else: # overlay on existing pitch
+        fig,ax=figax
+
+    positions=positions.dropna(subset=["x","y"])
+    ax.plot(positions["x"],positions["y"],marker,color=color,markersize=markersize,alpha=alpha,linestyle='None')
+    if annotate_player:
+        [ ax.text(x,y,player.split('_')[1],fontsize=8,color='white',ha='center',va='center',weight='bold') for player,x,y in positions[["x","y"]].itertuples() ]
+
     return fig,ax
 
+
+@mmon.timed
+def save_event_plots(event_ids,event,tracking_home,tracking_away,file_path,kind="events",pc_surfaces=None,epv_grid=None,field_dimensions=(106.0,68.0),
+                     include_player_velocities=False,annotate_player=False,alpha=0.6,contour=False,dpi=100,n_jobs=1,event_index=None):
+    '''
+    Saves a plot for each event as "<kind>_<event_id>.png" in file_path, the same plots as:
+        "events": plot_frame and plot_events at the Start Frame of the event.
+        "pitch_control": plot_pitch_control_for_event.
+        "EPV": plot_EPV_grid_for_event.
+    The pitch is built and drawn only once per process (see get_pitch_template), every plot only draws its own artists on the pitch
+    (and the lines of the pitch again, when the plot has an image under them).
+    With n_jobs>1 events are split across a pool of processes. Throughput is printed and returned.
+    
+    Parameters
+    ----------
+    event_ids: List with ids of events.
+    event: pd.Dataframe with Event Data.
+    tracking_home: pd.Dataframe with Tracking Data for Home Team.
+    tracking_away: pd.Dataframe with Tracking Data for Away Team.
+    file_path: Directory for the plots to be saved at.
+    kind: "events", "pitch_control" or "EPV". Default is "events".
+    pc_surfaces: Dictionary from event id to Pitch Control of Attacking Team (e.g. from Metrica_Pitch_Control.find_pitch_control_for_event),
+                 needed for "pitch_control" and "EPV". Default is None.
+    epv_grid: Preloaded epv_grid, needed for "EPV". Default is None.
+    field_dimensions:  Field dimensions in meters (Width x Height). Default is (106,68).
+    include_player_velocities: Shows velocities of players. Default is False.
+    annotate_player: Annotate Player. Default is False.
+    alpha: Alpha of colors for pitch control. Default is 0.6
+    contour: Add contours to "EPV" plots, see plot_EPV_grid_for_event. Default is False.
+    dpi: Dots per inch of the plots. Default is 100.
+    n_jobs: Number of processes, -1 for all CPUs. Default is 1.
+    event_index: Join index from Metrica_IO.build_event_tracking_index. If given, tracking rows are found by position,
+                 needed when the tracking is resampled. Default is None.
+    
+    Returns
+    -------
+    plots_per_second: Throughput of the batch.
+    '''
+    
+    assert kind in ("events","pitch_control","EPV"),"Invalid kind of plot."
+    start=time.perf_counter()
+    n_jobs=os.cpu_count() if n_jobs==-1 else n_jobs
+    event_ids=list(event_ids)
+    
+    # Only the events and the tracking rows of their Start Frames are sent to the processes
+    if event_index is None:
+        frames=event.loc[event_ids,"Start Frame"]
+        home_frames=tracking_home.loc[frames.unique()]
+        away_frames=tracking_away.loc[frames.unique()]
+    else: # Positional lookups
+        rows=event_index["start_row"][[event_index["positions"][event_id] for event_id in event_ids]]
+        if np.any(rows<0): # Same as the label-based lookups
+            raise KeyError("Start Frame of events {} is not in the Tracking Data.".format(np.asarray(event_ids)[rows<0].tolist()))
+        home_frames=tracking_home.iloc[np.unique(rows)]
+        away_frames=tracking_away.iloc[np.unique(rows)]
+    events=event.loc[event_ids]
+    if event_index is not None: # Start Frames of the tracking rows, they differ when the tracking is resampled
+        events=events.assign(**{"Start Frame":tracking_home.index.to_numpy()[rows]})
+    settings=dict(kind=kind,epv_grid=epv_grid,field_dimensions=field_dimensions,include_player_velocities=include_player_velocities,
+                  annotate_player=annotate_player,alpha=alpha,contour=contour,dpi=dpi)
+    
+    chunks=[list(chunk) for chunk in np.array_split(np.arange(len(event_ids)),max(1,n_jobs)) if len(chunk)>0]
+    if len(chunks)<=1:
+        __save_event_plots_chunk(event_ids,events,home_frames,away_frames,file_path,pc_surfaces,settings)
+    else:
+        with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+            futures=[]
+            for chunk in chunks:
+                chunk_ids=[event_ids[i] for i in chunk]
+                chunk_surfaces=None if pc_surfaces is None else {event_id:pc_surfaces[event_id] for event_id in chunk_ids}
+                futures.append(executor.submit(__save_event_plots_chunk,chunk_ids,events,home_frames,away_frames,file_path,chunk_surfaces,settings))
+            for future in futures:
+                future.result()
+    
+    seconds=time.perf_counter()-start
+    plots_per_second=len(event_ids)/seconds
+    logger.info("Saved %d plots in %.1f s (%.1f plots/s)",len(event_ids),seconds,plots_per_second)
+    
+    return plots_per_second
+
+
+def get_pitch_template(field_dimensions=(106.,68.),field_color="#32CD32",image=False,contour=False,dpi=100):
+    '''
+    Pitch drawn once and kept for the whole process, per field dimensions, color, kind of plot and dpi.
+    Limits of the axis are fixed to the limits of a plot on the pitch (lines add margins, images make the aspect equal),
+    so plots on the template look like plots on a new pitch.
+    
+    Parameters
+    ----------
+    field_dimensions:  Field dimensions in meters (Width x Height). Default is (106,68).
+    field_color: Field color. Default is '#32CD32'(light green).
+    image: Template for plots with an image of the field, e.g. pitch control. Default is False.
+    contour: Template for plots with contours over the image (they add margins again). Default is False.
+    dpi: Dots per inch. Default is 100.
+    
+    Returns
+    -------
+    template: Dictionary with "fig","ax","canvas","pitch" (artists of the pitch) and "backgrounds" (drawn pitch per zorder, see __get_template_background).
+    '''
+    
+    key=(tuple(field_dimensions),field_color,image,contour,dpi)
+    if key in __PITCH_TEMPLATES:
+        mmon.count("pitch_template.cache_hits")
+    else:
+        mmon.count("pitch_template.cache_misses")
+        fig,ax=plot_pitch(field_dimensions,field_color=field_color)
+        pitch=list(ax.patches)+list(ax.lines)
+        
+        # Limits as if something was plotted, then fixed
+        existing=set(ax.get_children())
+        extent=(-field_dimensions[0]/2,field_dimensions[0]/2,-field_dimensions[1]/2,field_dimensions[1]/2)
+        ax.plot(0,0)
+        if image:
+            ax.imshow(np.zeros((1,1)),extent=extent)
+        if contour:
+            ax.contour(np.eye(2),extent=extent,levels=[0.5])
+        ax.set_xlim(ax.get_xlim())
+        ax.set_ylim(ax.get_ylim())
+        ax.set_autoscale_on(False)
+        for placeholder in [artist for artist in ax.get_children() if artist not in existing]:
+            placeholder.remove()
+        
+        canvas=FigureCanvasAgg(fig)
+        fig.set_dpi(dpi)
+        __PITCH_TEMPLATES[key]=dict(fig=fig,ax=ax,canvas=canvas,pitch=pitch,backgrounds={})
+        
+    return __PITCH_TEMPLATES[key]
+
+
+__PITCH_TEMPLATES={}
+
+
+def __get_template_background(template,zorder,new_artists):
+    """
+    Drawn pitch with only the pitch artists up to zorder, the rest are drawn after the artists of a plot (e.g. lines over an image).
+    New artists of the plot are hidden while the background is drawn.
+    """
     
+    if zorder not in template["backgrounds"]:
+        above=[artist for artist in template["pitch"] if artist.get_zorder()>zorder]+new_artists
+        for artist in above:
+            artist.set_visible(False)
+        template["canvas"].draw()
+        template["backgrounds"][zorder]=template["canvas"].copy_from_bbox(template["fig"].bbox)
+        for artist in above:
+            artist.set_visible(True)
     
+    return template["backgrounds"][zorder]
+
+
+def __save_event_plots_chunk(event_ids,event,tracking_home,tracking_away,file_path,pc_surfaces,settings):
+    """
+    Saves the plots of the given events in a single process, on a pitch template.
+    Artists added by the plot are drawn on the restored pitch, saved and removed again.
+    """
     
-    
\ No newline at end of file
+    kind=settings["kind"]
+    field_dimensions=settings["field_dimensions"]
+    if kind=="events":
+        template=get_pitch_template(field_dimensions,dpi=settings["dpi"])
+    else: # White pitch with an image
+        template=get_pitch_template(field_dimensions,field_color="white",image=True,contour=kind=="EPV" and settings["contour"],dpi=settings["dpi"])
+    fig,ax,canvas=template["fig"],template["ax"],template["canvas"]
+    
+    for k,event_id in enumerate(event_ids):
+        existing=set(ax.get_children())
+        if kind=="events":
+            home_frame,away_frame,_=__get_event_start_frames(event_id,event,tracking_home,tracking_away)
+            plot_frame(home_frame,away_frame,settings["include_player_velocities"],field_dimensions,figax=(fig,ax),annotate_player=settings["annotate_player"])
+            plot_events(event.loc[event_id:event_id],figax=(fig,ax),field_dimensions=field_dimensions)
+        elif kind=="pitch_control":
+            plot_pitch_control_for_event(event_id,event,tracking_home,tracking_away,pc_surfaces[event_id],None,None,settings["annotate_player"],field_dimensions,
+                                         settings["include_player_velocities"],settings["alpha"],figax=(fig,ax))
+        else: # EPV
+            plot_EPV_grid_for_event(event_id,event,tracking_home,tracking_away,settings["epv_grid"],pc_surfaces[event_id],settings["annotate_player"],field_dimensions,
+                                    settings["include_player_velocities"],settings["alpha"],settings["contour"],figax=(fig,ax))
+        
+        # Draw the new artists and the pitch artists over them, in the order of Axes.draw (zorder, then order of addition)
+        children=ax.get_children()
+        new_artists=[artist for artist in children if artist not in existing]
+        zorder=min(artist.get_zorder() for artist in new_artists)
+        order={artist:i for i,artist in enumerate(children)}
+        canvas.restore_region(__get_template_background(template,zorder,new_artists))
+        for artist in sorted([artist for artist in template["pitch"] if artist.get_zorder()>zorder]+new_artists,key=lambda artist:(artist.get_zorder(),order[artist])):
+            fig.draw_artist(artist)
+        mat.image.imsave(os.path.join(file_path,"{}_{}.png".format(kind,event_id)),np.asarray(canvas.buffer_rgba()))
+        
+        for artist in new_artists:
+            artist.remove()
+        mmon.progress("save_event_plots",k+1,len(event_ids))
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+
+Windows of Tracking Data around events, as (events,window,slots,features) arrays for model training.
+The tracking of a game is turned once into a (frames,columns,features) array, windows are strided views over it
+(numpy as_strided, no copies) and only the windows of the events are gathered, batch by batch, into the output.
+The output can be a np.memmap, so save_event_windows writes the windows of a season to a .npy file on disk
+with only one game and one batch of events in memory.
+
+Slots are the players of the team of the event (attacking), then the players of the other team (defending), then the ball.
+Players are ordered in the same way in every event, by role or by distance to the ball (see get_window_parameters).
+Tracking Data should have a single playing direction (Metrica_IO.set_single_playing_direction).
+
+Usage:
+    windows,players=extract_event_windows(event,tracking_home,tracking_away)
+    windows=save_event_windows("windows",DATA_DIR,[1,2]) # memory-mapped, windows[k] is the window of the k-th row of events.csv
+
+
+@author: Apatsidis Ioannis
+"""
+
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+import Metrica_IO as mio
+import Metrica_Velocities as mvel
+import Metrica_Monitor as mmon
+
+logger=mmon.get_logger(__name__)
+
+
+def get_window_parameters():
+    '''
+    Setting the windows, slots and features of event windows.
+
+    Returns
+    -------
+    params: Dictionary with event window parameters
+    '''
+    params={}
+    params["event_types"]=["PASS","SHOT"] # Events with a window
+    params["anchor"]="start" # Window around the "start" or the "end" frame of the event
+    params["seconds_before"]=3. # Length of the window before and after the anchor frame
+    params["seconds_after"]=2.
+    params["n_slots"]=11 # Player slots per team, empty slots (e.g. after a red card) are NaN
+    # "role": goalkeeper first, then outfield players from the deepest to the most advanced by mean position in the game.
+    # "ball": players by distance to the ball at the anchor frame, nearest first.
+    params["slot_order"]="role"
+    params["features"]=["x","y","vx","vy"] # Columns of the players, e.g. Home_1_x. Ball velocities are differences of its positions
+    params["dtype"]="float32"
+
+    return params
+
+
+def __get_players(team):
+    '''
+    Players of a team, ordered by role: goalkeeper first, then outfield players from the deepest to the most advanced.
+    '''
+
+    players=[column[:-2] for column in team.columns if re.match(r"^(Home|Away)_\d+_x$",column)]
+    direction=1. if players[0].startswith("Home") else -1.
+    GK_NAME=mio.get_goalkeeper_name(team)
+    with np.errstate(invalid="ignore"):
+        depth=direction*np.nanmean(team[[player+"_x" for player in players]].to_numpy(dtype=float),axis=0)
+    depth=np.where(np.isnan(depth),np.inf,depth) # Players who never played last
+    order=sorted(range(len(players)),key=lambda k:(players[k]!=GK_NAME,depth[k]))
+
+    return [players[k] for k in order]
+
+
+def __build_frames(tracking_home,tracking_away,features,dtype,before,after):
+    '''
+    Tracking of both teams as a (frames,columns,features) array, padded with before and after NaN frames. Columns are the
+    players of Home and Away by role, an empty column (NaN, for empty slots) and the ball.
+
+    Returns
+    -------
+    padded: np.array in shape (before+n_frames+after,n_home+n_away+2,n_features).
+    players: Dictionary with "Home","Away" column indices and "names" of all columns.
+    '''
+
+    home_players=__get_players(tracking_home)
+    away_players=__get_players(tracking_away)
+    padded=np.full((before+len(tracking_home)+after,len(home_players)+len(away_players)+2,len(features)),np.nan,dtype=dtype)
+    frames=padded[before:before+len(tracking_home)] # View
+    for k,player in enumerate(home_players+away_players):
+        team=tracking_home if player.startswith("Home") else tracking_away
+        for f,feature in enumerate(features):
+            if player+"_"+feature in team.columns:
+                frames[:,k,f]=team[player+"_"+feature].to_numpy(dtype=float)
+
+    ball=tracking_home[["ball_x","ball_y"]].to_numpy(dtype=float)
+    time_intervals=tracking_home["Time [s]"].diff().to_numpy(dtype=float)
+    ball_velocity=np.full(ball.shape,np.nan)
+    ball_velocity[1:]=np.diff(ball,axis=0)/time_intervals[1:,None]
+    ball_velocity[tracking_home["Period"].diff().to_numpy()!=0]=np.nan # First frame of every Period
+    ball_features={"x":ball[:,0],"y":ball[:,1],"vx":ball_velocity[:,0],"vy":ball_velocity[:,1],"speed":np.hypot(ball_velocity[:,0],ball_velocity[:,1])}
+    for f,feature in enumerate(features):
+        if feature in ball_features:
+            frames[:,-1,f]=ball_features[feature]
+
+    players={"Home":np.arange(len(home_players)),"Away":len(home_players)+np.arange(len(away_players)),
+             "names":np.array(home_players+away_players+["","ball"])}
+
+    return padded,players
+
+
+def __get_slots(frames,players,anchor_rows,teams,n_slots,slot_order):
+    '''
+    Column of every slot for every event: n_slots of the team of the event, n_slots of the other team and the ball.
+    Players who are not in the anchor frame are left out, empty slots get the empty column.
+
+    Returns
+    -------
+    slots: np.array in shape (n_events,2*n_slots+1) with column indices of frames.
+    '''
+
+    empty,ball=frames.shape[1]-2,frames.shape[1]-1
+    slots=np.full((len(anchor_rows),2*n_slots+1),empty,dtype=np.int64)
+    slots[:,-1]=ball
+    # Columns of Home (0) and Away (1), the shorter one padded with the empty column
+    n_players=max(len(players["Home"]),len(players["Away"]))
+    team_columns=np.full((2,n_players),empty,dtype=np.int64)
+    team_columns[0,:len(players["Home"])]=players["Home"]
+    team_columns[1,:len(players["Away"])]=players["Away"]
+
+    anchor=frames[anchor_rows]
+    events=np.arange(len(anchor_rows))[:,None]
+    for first_slot,team in [(0,np.where(teams>=0,0,1)),(n_slots,np.where(teams>=0,1,0))]: # Home attacks in events without a team
+        columns=team_columns[team]
+        x,y=anchor[events,columns,0],anchor[events,columns,1]
+        in_frame=~np.isnan(x) & ~np.isnan(y)
+        if slot_order=="ball":
+            key=np.hypot(x-anchor[:,ball,0][:,None],y-anchor[:,ball,1][:,None]).astype(float)
+            key=np.where(in_frame & ~np.isnan(key),key,np.inf) # Ball not in frame: order by role
+        else: # Columns are ordered by role
+            key=np.where(in_frame,0.,1.)
+        order=np.argsort(key,axis=1,kind="stable")[:,:n_slots]
+        chosen=np.where(np.take_along_axis(in_frame,order,axis=1),np.take_along_axis(columns,order,axis=1),empty)
+        slots[:,first_slot:first_slot+chosen.shape[1]]=chosen
+
+    return slots
+
+
+def get_window_rows(tracking,params):
+    '''
+    Number of tracking rows before and after the anchor frame, for the sampling interval of the data.
+
+    Parameters
+    ----------
+    tracking: pd.DataFrame with Tracking Data.
+    params: Dictionary with event window parameters.
+
+    Returns
+    -------
+    window_rows: (before,after) number of rows.
+    '''
+
+    frame_duration=mio.get_frame_duration(tracking)
+
+    return int(round(params["seconds_before"]/frame_duration)),int(round(params["seconds_after"]/frame_duration))
+
+
+@mmon.timed
+def extract_event_windows(event,tracking_home,tracking_away,params=None,event_ids=None,event_index=None,out=None,batch_size=500,window_rows=None):
+    '''
+    Window of Tracking Data around every event. Frames of the window outside of the Period of the anchor frame
+    (or outside of the data) are NaN, and so is the whole window of an event whose anchor frame is not tracked.
+
+    Parameters
+    ----------
+    event: pd.Dataframe with Event Data.
+    tracking_home: pd.Dataframe with Tracking Data for Home Team, with a single playing direction and velocities for "vx","vy" features.
+    tracking_away: pd.Dataframe with Tracking Data for Away Team, with a single playing direction and velocities for "vx","vy" features.
+    params: Dictionary with event window parameters. Default is None, that is get_window_parameters().
+    event_ids: List with ids of events. Default is None, that is the events of params["event_types"] with a tracked anchor frame.
+    event_index: Join index from Metrica_IO.build_event_tracking_index. Default is None, that is built here.
+    out: Array in shape (n_events,window,2*n_slots+1,n_features) to write the windows in, e.g. a slice of a np.memmap. Default is None, that is a new array.
+    batch_size: Number of events gathered at once. Default is 500.
+    window_rows: (before,after) number of tracking rows before and after the anchor frame. Default is None, that is
+                 params["seconds_before"] and params["seconds_after"] over the sampling interval of the data (see get_window_rows).
+
+    Returns
+    -------
+    windows: np.array (or out) in shape (n_events,window,2*n_slots+1,n_features), window=frames before + anchor frame + frames after.
+    players: np.array in shape (n_events,2*n_slots+1) with the player of every slot, "" for empty slots and "ball" for the ball.
+    '''
+
+    params=get_window_parameters() if params is None else params
+    assert params["anchor"] in ("start","end"),"Invalid anchor. Acceptable values are 'start', 'end'."
+    assert params["slot_order"] in ("role","ball"),"Invalid slot order. Acceptable values are 'role', 'ball'."
+    event_index=mio.build_event_tracking_index(event,tracking_home,tracking_away) if event_index is None else event_index
+    anchor_rows=event_index[params["anchor"]+"_row"]
+    if event_ids is None:
+        positions=np.flatnonzero(event["Type"].isin(params["event_types"]).to_numpy() & (anchor_rows>=0))
+    else:
+        positions=np.array([event_index["positions"][event_id] for event_id in event_ids],dtype=np.int64)
+
+    before,after=get_window_rows(tracking_home,params) if window_rows is None else window_rows
+    window=before+1+after
+    features=list(params["features"])
+    padded,players=__build_frames(tracking_home,tracking_away,features,params["dtype"],before,after)
+    frames=padded[before:len(padded)-after]
+    # Windows are views: the window starting at padded row r is centered at the frame of row r. Padding is Period 0
+    periods=np.concatenate([np.zeros(before),tracking_home["Period"].to_numpy(dtype=float),np.zeros(after)])
+    # Read-only strided views, the window axis steps over the frames (numpy 1.19 has no sliding_window_view)
+    frame_windows=np.lib.stride_tricks.as_strided(padded,shape=(len(padded)-window+1,)+padded.shape[1:]+(window,),
+                                                   strides=padded.strides+padded.strides[:1],writeable=False) # (frames,columns,features,window)
+    period_windows=np.lib.stride_tricks.as_strided(periods,shape=(len(periods)-window+1,window),strides=periods.strides*2,writeable=False)
+
+    n_slots=params["n_slots"]
+    shape=(len(positions),window,2*n_slots+1,len(features))
+    out=np.empty(shape,dtype=params["dtype"]) if out is None else out
+    assert out.shape==shape,"out should be in shape {}.".format(shape)
+    slot_players=np.empty((len(positions),2*n_slots+1),dtype=players["names"].dtype)
+
+    for first in range(0,len(positions),batch_size):
+        batch=positions[first:first+batch_size]
+        rows=anchor_rows[batch]
+        tracked=rows>=0
+        rows=np.where(tracked,rows,0)
+        slots=__get_slots(frames,players,rows,event_index["team"][batch],n_slots,params["slot_order"])
+        slots[~tracked,:-1]=frames.shape[1]-2
+        # Only the windows of the batch are copied, in shape (batch,slots,features,window)
+        gathered=frame_windows[rows[:,None],slots]
+        outside=(period_windows[rows]!=periods[before+rows][:,None]) | ~tracked[:,None]
+        gathered[np.broadcast_to(outside[:,None,None,:],gathered.shape)]=np.nan
+        out[first:first+len(batch)]=gathered.transpose(0,3,1,2)
+        slot_players[first:first+len(batch)]=players["names"][slots]
+        mmon.progress("extract_event_windows",first+len(batch),len(positions))
+
+    return out,slot_players
+
+
+def __prepare_game(DATA_DIR,game_id,velocity_params):
+    '''
+    Event and Tracking Data of a game in meters, with a single playing direction and velocities.
+    '''
+
+    event=mio.transform_coord_system(mio.read_event_data(DATA_DIR,game_id))
+    tracking_home=mio.transform_coord_system(mio.read_tracking_data(DATA_DIR,game_id,"Home"))
+    tracking_away=mio.transform_coord_system(mio.read_tracking_data(DATA_DIR,game_id,"Away"))
+    event,tracking_home,tracking_away=mio.set_single_playing_direction(event,tracking_home,tracking_away)
+    tracking_home=mvel.calc_player_velocities(tracking_home,**velocity_params)
+    tracking_away=mvel.calc_player_velocities(tracking_away,**velocity_params)
+
+    return event,tracking_home,tracking_away
+
+
+@mmon.timed
+def save_event_windows(path,DATA_DIR,game_ids,params=None,velocity_params=None,batch_size=500):
+    '''
+    Saves the windows of the events of many games (e.g. a season) in a memory-mapped file, one game at a time.
+    Every event of params["event_types"] has a window, NaN if its anchor frame is not tracked. Every window has the rows
+    of the first game (get_window_rows), games with another sampling interval are logged.
+    Files in the directory path:
+        "windows.npy": Windows of all events, see extract_event_windows.
+        "players.npy": Player of every slot of every event.
+        "events.csv": Game, Event (id), Type, Team, Period and Anchor Frame of every window, in the order of the windows.
+        "params.json": Event window parameters and "window_rows", the (before,after) rows of every window.
+
+    Parameters
+    ----------
+    path: Directory of the files, created if it doesn't exist.
+    DATA_DIR: Directory of the data, as in Metrica_IO.read_event_data.
+    game_ids: List with ids of games.
+    params: Dictionary with event window parameters. Default is None, that is get_window_parameters().
+    velocity_params: Dictionary with keyword arguments of Metrica_Velocities.calc_player_velocities. Default is None, that is
+                     {"max_speed":11,"smoothing":True,"window":5}.
+    batch_size: Number of events gathered at once. Default is 500.
+
+    Returns
+    -------
+    windows: np.memmap of "windows.npy", read only.
+    '''
+
+    params=get_window_parameters() if params is None else params
+    velocity_params={"max_speed":11,"smoothing":True,"window":5} if velocity_params is None else velocity_params
+    assert len(game_ids)>0,"No games given."
+    assert len(set(game_ids))==len(game_ids),"Every game should be given once."
+    os.makedirs(path,exist_ok=True)
+
+    # Events of every game first, for the size of the file. Event Data is small, Tracking Data is read one game at a time below
+    event_ids={}
+    for game_id in game_ids:
+        event=mio.read_event_data(DATA_DIR,game_id)
+        event_ids[game_id]=event.index[event["Type"].isin(params["event_types"])]
+    n_events=sum(len(ids) for ids in event_ids.values())
+
+    windows=None
+    window_rows=None
+    players=[]
+    index=[]
+    offset=0
+    for game_id in game_ids:
+        event,tracking_home,tracking_away=__prepare_game(DATA_DIR,game_id,velocity_params)
+        if windows is None: # Rows of the window from the sampling interval of the first game, the same for every game
+            window_rows=get_window_rows(tracking_home,params)
+            windows=np.lib.format.open_memmap(os.path.join(path,"windows.npy"),mode="w+",dtype=params["dtype"],
+                                              shape=(n_events,sum(window_rows)+1,2*params["n_slots"]+1,len(params["features"])))
+        elif get_window_rows(tracking_home,params)!=window_rows:
+            logger.warning("Game %s has another sampling interval, its windows have the rows of the first game %s and not the same seconds",
+                           game_id,window_rows)
+        ids=event_ids[game_id]
+        _,game_players=extract_event_windows(event,tracking_home,tracking_away,params,ids,out=windows[offset:offset+len(ids)],batch_size=batch_size,
+                                             window_rows=window_rows)
+        windows.flush()
+        players.append(game_players)
+        index.append(pd.DataFrame({"Game":game_id,"Event":ids,"Type":event.loc[ids,"Type"].to_numpy(),"Team":event.loc[ids,"Team"].to_numpy(),
+                                   "Period":event.loc[ids,"Period"].to_numpy(),"Anchor Frame":event.loc[ids,params["anchor"].capitalize()+" Frame"].to_numpy()}))
+        offset+=len(ids)
+        logger.info("Game %s: %d event windows",game_id,len(ids))
+    del windows
+
+    np.save(os.path.join(path,"players.npy"),np.concatenate(players))
+    pd.concat(index,ignore_index=True).to_csv(os.path.join(path,"events.csv"),index=False)
+    with open(os.path.join(path,"params.json"),"w") as file:
+        json.dump(dict(params,window_rows=list(window_rows)),file,indent=2)
+
+    return load_event_windows(path)[0]
+
+
+def load_event_windows(path):
+    '''
+    Reads the files of save_event_windows, the windows memory-mapped.
+
+    Parameters
+    ----------
+    path: Directory of the files.
+
+    Returns
+    -------
+    windows: np.memmap in shape (n_events,window,2*n_slots+1,n_features), read only.
+    players: np.array in shape (n_events,2*n_slots+1) with the player of every slot.
+    events: pd.DataFrame with Game, Event, Type, Team, Period and Anchor Frame of every window.
+    '''
+
+    windows=np.load(os.path.join(path,"windows.npy"),mmap_mode="r")
+    players=np.load(os.path.join(path,"players.npy"))
+    events=pd.read_csv(os.path.join(path,"events.csv"))
+
+    return windows,players,events
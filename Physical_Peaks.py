@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+
+Peak intensity metrics for players (worst-case scenarios).
+For every player, the maximum distance, high speed distance and number of sprints within rolling time windows (e.g. 1, 3 and 5 minutes)
+and the time that each peak occurred.
+Rolling sums are differences of cumulative sums, so every window length costs O(frames) for all players at once.
+
+
+@author: Apatsidis Ioannis
+"""
+
+import numpy as np
+import pandas as pd
+import Metrica_IO as mio
+import Metrica_Velocities as mvel
+import Metrica_Monitor as mmon
+import Physical_Performace as mphy
+
+logger=mmon.get_logger(__name__)
+
+
+def get_peak_parameters():
+    '''
+    Setting the rolling windows and thresholds for peak intensity metrics.
+
+    Returns
+    -------
+    params: Dictionary with peak parameters
+    '''
+    params={}
+    params["windows"]=[1,3,5] # Rolling windows in minutes
+    params["high_speed"]=5.5 # High speed running when: 5.5 m/s <= speed (19.8 km/h)
+
+    return params
+
+
+@mmon.timed
+def get_players_peaks(team,params=None,summary_params=None):
+    '''
+    Calculates peak distance, high speed distance and number of sprints of each player over rolling windows.
+    Windows don't cross Periods. Frames that a player is not in (e.g. before a substitution) or has NaN speed add nothing.
+
+    Parameters
+    ----------
+    team: pd.DataFrame of Tracking data for teams' players.
+    params: Dictionary with peak parameters. Default is None, that is get_peak_parameters().
+    summary_params: Dictionary with frame duration and sprint rules. Default is None, that is Physical_Performace.get_summary_parameters().
+
+    Returns
+    -------
+    peaks: pd.DataFrame with a row per player and for every window W columns:
+        "Peak Distance W min (m)","Peak HSR W min (m)","Peak Sprints W min" and the time of each peak
+        "Peak Distance W min Time [s]","Peak HSR W min Time [s]","Peak Sprints W min Time [s]" (Time [s] of the first frame of the window).
+        Peaks are NaN when every Period is shorter than the window, times are NaN when the peak is zero.
+    '''
+
+    params=get_peak_parameters() if params is None else params
+    summary_params=mphy.get_summary_parameters() if summary_params is None else summary_params
+
+    # Velocities are necessary for calculations
+    if not (any("_speed" in col for col in team.columns)):
+        logger.info("Velocities need to be calculated for peaks")
+        team=mvel.calc_player_velocities(team)
+
+    player_indices=np.unique([x[:-2] for x in team.columns if x[-2:]=='_x' and 'ball' not in x])
+    speed=team[[p+"_speed" for p in player_indices]].to_numpy(dtype=float)
+    times=team["Time [s]"].to_numpy(dtype=float)
+    periods=team["Period"].to_numpy()
+    frame_duration=mio.get_frame_duration(team) if summary_params["frame_duration"] is None else summary_params["frame_duration"]
+
+    # Per frame distance, high speed distance and sprint starts. NaN speed adds nothing.
+    valid=~np.isnan(speed)
+    speed=np.where(valid,speed,0.)
+    distance=speed*frame_duration
+    high_speed_distance=np.where(speed>=params["high_speed"],distance,0.)
+    sprint_frames=max(1,int(round(summary_params["sprint_duration"]/frame_duration)))
+    sprint_players,sprint_starts,_=mphy.find_runs(valid & (speed>=summary_params["sprint_speed"]),min_length=sprint_frames)
+    sprints=np.zeros(speed.shape)
+    sprints[sprint_starts,sprint_players]=1
+
+    # Cumulative sums with a leading zero row, sum of frames [a,b) is cumsum[b]-cumsum[a]
+    metrics={}
+    for name,values in [("Distance",distance),("HSR",high_speed_distance),("Sprints",sprints)]:
+        metrics[name]=np.concatenate([np.zeros((1,len(player_indices))),np.cumsum(values,axis=0)])
+
+    # Row positions where each Period starts and ends
+    bounds=np.concatenate([[0],np.flatnonzero(np.diff(periods)!=0)+1,[len(periods)]])
+
+    peaks=pd.DataFrame(index=player_indices)
+    for window in params["windows"]:
+        window_frames=int(round(window*60/frame_duration))
+        for name,cumsum in metrics.items():
+            best=np.full(len(player_indices),-np.inf)
+            best_time=np.full(len(player_indices),np.nan)
+            for start,end in zip(bounds[:-1],bounds[1:]):
+                if end-start<window_frames:
+                    continue
+                # Rolling sums of all windows starting at frames [start,end-window_frames] of this Period
+                rolling=cumsum[start+window_frames:end+1]-cumsum[start:end+1-window_frames]
+                peak_rows=np.argmax(rolling,axis=0)
+                peak=rolling[peak_rows,np.arange(len(player_indices))]
+                better=peak>best
+                best[better]=peak[better]
+                best_time[better]=times[start+peak_rows[better]]
+
+            unit=" (m)" if name!="Sprints" else ""
+            column="Peak {0} {1} min".format(name,window)
+            peaks[column+unit]=np.where(np.isinf(best),np.nan,best)
+            peaks[column+" Time [s]"]=np.where(best>0,best_time,np.nan) # no time when there is no peak
+
+    # Group the columns of each window: values first, then times
+    value_columns=[col for col in peaks.columns if not col.endswith("Time [s]")]
+    time_columns=[col for col in peaks.columns if col.endswith("Time [s]")]
+
+    return peaks[value_columns+time_columns]
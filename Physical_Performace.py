@@ -8,20 +8,50 @@ Physical Performance metrics for players.
 @author: Apatsidis Ioannis
 """
 
+import Metrica_IO as mio
 import Metrica_Velocities as mvel
+import Metrica_Monitor as mmon
 import numpy as np
 import pandas as pd
 
-def get_players_summary(team):
+logger=mmon.get_logger(__name__)
+
+def get_summary_parameters():
+    '''
+    Speed zones and sprint rules for the summary performance metrics, based on average athletes.
+    
+    Returns
+    -------
+    params: Dictionary with summary parameters
+    '''
+    params={}
+    # Walking when : speed < 2 m/s , Jogging when : 2 m/s <= speed < 4 m/s
+    # Running when : 4 m/s <= speed < 7 m/s , Sprinting when: 7 m/s <= speed
+    params["zone_edges"]=[2.,4.,7.] # m/s
+    params["zone_names"]=["Walking","Jogging","Running","Sprinting"] # one more name than edges
+    # Sprint thresholds for calculating # of continous sprints
+    params["sprint_speed"]=7. # Sprinting when: 7 m/s <= speed
+    params["sprint_duration"]=1. # Sprinting for at least 1 sec (25 frames)
+    params["frame_duration"]=None # Seconds between frames, None for the sampling interval of the data (Metrica_IO.get_frame_duration)
+    
+    return params
+
+
+@mmon.timed
+def get_players_summary(team,params=None):
     
     '''
     
     Calculates summary performance metrics for each player of the given team:
     ["Minutes Played","Distance (km)","Walking (km)","Jogging (km)","Running (km)","Sprinting (km)","# of Sprints"]
+    Zone columns follow params["zone_names"].
+    All players are calculated at once: speeds are binned to zones with np.digitize and summed with np.bincount,
+    sprints are counted with run-length encoding.
     
     Parameters
     ----------
     team: pd.DataFrame of Tracking data for teams' players. 
+    params: Dictionary with summary parameters. Default is None, that is get_summary_parameters().
     
     Returns
     -------
@@ -29,68 +59,107 @@ def get_players_summary(team):
     
     '''
     
+    params=get_summary_parameters() if params is None else params
+    
     # Velocities are necessary for calculations
     if not (any("_speed" in col for col in team.columns)):
-        print("Velocities need to be calculated for summary")
+        logger.info("Velocities need to be calculated for summary")
         team=mvel.calc_player_velocities(team)
     
     # Creating the Summary DataFrame
     player_indices=np.unique([x[:-2] for x in team.columns if x[-2:]=='_x' and 'ball' not in x])
-    columns=["Minutes Played","Distance (km)","Walking (km)","Jogging (km)","Running (km)","Sprinting (km)","# of Sprints"]
-    summary=pd.DataFrame(index=player_indices,columns=columns)
+    zone_columns=[name+" (km)" for name in params["zone_names"]]
+    columns=["Minutes Played","Distance (km)"]+zone_columns+["# of Sprints"]
+    summary=pd.DataFrame(index=player_indices,columns=columns,dtype=float)
     
+    n_players=len(player_indices)
+    n_zones=len(params["zone_edges"])+1
+    frame_duration=mio.get_frame_duration(team) if params["frame_duration"] is None else params["frame_duration"]
+    speed=team[[p+"_speed" for p in player_indices]].to_numpy(dtype=float)
     
-    # Sprint thresholds for calculating # of continous sprints
-    speed_threshold=7 # Sprinting when: 7 m/s <= speed
-    time_threshold=25 # Sprinting for at least 25 frames (1 sec)
-    
-    
-    for player in player_indices:
-         
-        # Calculating Minutes Played
-        first_frame=team.loc[~pd.isna(team[player+"_x"]),"Time [s]"].min()
-        last_frame=team.loc[~pd.isna(team[player+"_x"]),"Time [s]"].max()
-        
-        # Seconds into minutes
-        summary.loc[player,"Minutes Played"]=(last_frame-first_frame)/60
-        
-        
-        # Calculating Distance       
-        summary.loc[player,"Distance (km)"]=(team[player+"_speed"].sum()*0.04)/1000 # Sample every 0.04 ms
-        
-        
-        # SETTING THRESHOLDS based on average athletes
-        # Walking when : speed < 2 m/s
-        summary.loc[player,"Walking (km)"]=(team.loc[team[player+"_speed"]<2,player+"_speed"].sum()*0.04)/1000
-        # Jogging when : 2 m/s <= speed < 4 m/s
-        summary.loc[player,"Jogging (km)"]=(team.loc[(team[player+"_speed"]>=2) & (team[player+"_speed"]<4),player+"_speed"].sum()*0.04)/1000
-        # Running when : 4 m/s <= speed < 7 m/s
-        summary.loc[player,"Running (km)"]=(team.loc[(team[player+"_speed"]>=4) & (team[player+"_speed"]<7),player+"_speed"].sum()*0.04)/1000 
-        # Sprinting when: 7 m/s <= speed
-        summary.loc[player,"Sprinting (km)"]=(team.loc[team[player+"_speed"]>=7,player+"_speed"].sum()*0.04)/1000
-        
-        
-        # Calculating # of sprints
-        
-        # Convolution of speed with time_threshold window
-        # Convolution to get the number of consecutive frames
-        conv=np.convolve(1*(team[player+"_speed"]>=speed_threshold),np.ones(time_threshold),mode='same')
-        # Set 1 where cell>=time_threshold consecutive frames
-        player_sprints=np.diff(1*(conv>=time_threshold))
-        # Adding all the 1's that represent a continous sprint
-        summary.loc[player,"# of Sprints"]=np.sum(player_sprints==1)
-                    
-        '''
-        e.g. time_threshold=5 , speed_threshold=7
-        
-        convolution of ( [0,0,1,1,1,0,1,1,1,1,1],[1,1,1,1,1] ,mode='same') -> [0,0,1,2,3,3,4,4,4,4,5,4,3,2,1]
-                                      sprint no1
-        5 indicates that there is 5 concecutive 1's which means 5 concecutive speeds > speed_threshold
-        
-        player_sprints= 0,  0,  0,  0,  0,  0,  0,  0,  0,  1, -1,  0,  0,  0] , 1 indicates a sprint
-        
-        np.sum(player_sprints==1) : # of sprints
-        '''
+    # Calculating Minutes Played from the first and last frame that each player is in
+    times=team["Time [s]"].to_numpy(dtype=float)
+    in_frame=~np.isnan(team[[p+"_x" for p in player_indices]].to_numpy(dtype=float))
+    first_frame=times[np.argmax(in_frame,axis=0)]
+    last_frame=times[len(times)-1-np.argmax(in_frame[::-1],axis=0)]
+    # Seconds into minutes
+    summary["Minutes Played"]=np.where(in_frame.any(axis=0),(last_frame-first_frame)/60,np.nan)
+    
+    # Calculating Distance per zone, every valid speed is added to the zone of its player
+    valid=~np.isnan(speed)
+    zones=np.digitize(speed[valid],params["zone_edges"])
+    players=np.nonzero(valid)[1]
+    zone_distances=np.bincount(players*n_zones+zones,weights=speed[valid]*frame_duration,minlength=n_players*n_zones)
+    zone_distances=zone_distances.reshape(n_players,n_zones)/1000
+    summary[zone_columns]=zone_distances
+    summary["Distance (km)"]=zone_distances.sum(axis=1)
+    
+    # Calculating # of sprints, runs of at least sprint_duration at speed >= sprint_speed
+    sprint_frames=max(1,int(round(params["sprint_duration"]/frame_duration)))
+    sprinting=np.zeros(speed.shape,dtype=bool)
+    sprinting[valid]=speed[valid]>=params["sprint_speed"]
+    sprint_players,_,_=find_runs(sprinting,min_length=sprint_frames)
+    summary["# of Sprints"]=np.bincount(sprint_players,minlength=n_players)
+    
+    return summary
+
+
+def get_squad_summary(teams,params=None,aggregate=True):
+    '''
+    Calculates summary performance metrics for the players of many games in a single call.
+    
+    Parameters
+    ----------
+    teams: Dictionary from game id to pd.DataFrame of Tracking data, e.g. {1:tracking_home_game_1,2:tracking_home_game_2}.
+    params: Dictionary with summary parameters. Default is None, that is get_summary_parameters().
+    aggregate: Sum the metrics of every player over all games. Default is True.
+    
+    Returns
+    -------
+    summary: pd.DataFrame with summary performance metrics per player, or per (game, player) if aggregate is False.
+             Aggregated summary has also the number of games of each player.
+    '''
+    
+    summaries=pd.concat({game_id:get_players_summary(team,params) for game_id,team in teams.items()},names=["Game","Player"])
+    if not aggregate:
+        return summaries
+    
+    games=summaries["Minutes Played"].notna().groupby(level="Player").sum().rename("Games")
+    summary=summaries.groupby(level="Player").sum(min_count=1)
+    summary.insert(0,"Games",games)
+    
+    return summary
 
+
+def find_runs(mask,min_length=1):
+    '''
+    Finds runs of consecutive True values along the first axis (time) of a 2-D boolean array, for all columns at once,
+    with run-length encoding.
+    
+    Parameters
+    ----------
+    mask: Boolean np.array in shape (frames,players).
+    min_length: Minimum number of frames of a run. Default is 1.
+    
+    Returns
+    -------
+    columns: np.array with the column (player) of each run.
+    starts: np.array with the first frame (row position) of each run.
+    ends: np.array with the frame after the last frame of each run.
+    '''
+    
+    n_frames,n_columns=mask.shape
+    # Columns one after the other, separated with False so that runs don't join
+    padded=np.zeros((n_columns,n_frames+2),dtype=np.int8)
+    padded[:,1:-1]=mask.T
+    changes=np.diff(padded.ravel())
+    starts=np.flatnonzero(changes==1) # position of first True in padded, flattened
+    ends=np.flatnonzero(changes==-1)
+    
+    columns=starts//(n_frames+2)
+    starts=starts%(n_frames+2)
+    ends=ends%(n_frames+2)
+    
+    long_runs=ends-starts>=min_length
     
-    return summary
\ No newline at end of file
+    return columns[long_runs],starts[long_runs],ends[long_runs]
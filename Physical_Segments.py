@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+
+Segmentation of players' movement into sprints, high intensity runs, accelerations and decelerations.
+Every segment is a row of a table with start and end frame, duration, peak speed, distance and start/end positions,
+with the column names of the Event Data ("Start Frame","End Frame","Start X",...), so that segments can be joined with events.
+Segments of all players are found at once with run-length encoding.
+
+
+@author: Apatsidis Ioannis
+"""
+
+import numpy as np
+import pandas as pd
+import Metrica_IO as mio
+import Metrica_Velocities as mvel
+import Metrica_Monitor as mmon
+import Metrica_Kinematics as mkin
+import Physical_Performace as mphy
+
+logger=mmon.get_logger(__name__)
+
+
+def get_segment_parameters():
+    '''
+    Setting thresholds for each type of segment. A segment is at least "duration" seconds over (or under) its threshold.
+
+    Returns
+    -------
+    params: Dictionary from segment type to (variable,threshold,duration).
+    '''
+    params={}
+    params["Sprint"]=("speed",7.,1.) # 7 m/s <= speed for at least 1 sec, same as get_players_summary
+    params["High Intensity Run"]=("speed",5.5,1.) # 5.5 m/s <= speed for at least 1 sec
+    params["Acceleration"]=("acceleration",2.,0.5) # 2 m/s^2 <= acceleration for at least 0.5 sec
+    params["Deceleration"]=("acceleration",-2.,0.5) # acceleration <= -2 m/s^2 for at least 0.5 sec
+
+    return params
+
+
+@mmon.timed
+def get_players_segments(team,params=None,summary_params=None,frame_mask=None):
+    '''
+    Finds the sprints, high intensity runs, accelerations and decelerations of all players.
+    Segments don't cross Periods. Accelerations are taken from "_acc" columns (Metrica_Kinematics.add_player_kinematics)
+    or calculated with Metrica_Kinematics.calc_player_kinematics when they are missing, only if a segment type needs them.
+
+    Parameters
+    ----------
+    team: pd.DataFrame of Tracking data for teams' players.
+    params: Dictionary with segment thresholds. Default is None, that is get_segment_parameters().
+    summary_params: Dictionary with frame duration. Default is None, that is Physical_Performace.get_summary_parameters().
+    frame_mask: Boolean pd.DataFrame with the index of team and a column per player (like "Home_1"), segments have only frames
+                that are True for their player, e.g. frames without the ball. Default is None, that is all frames.
+
+    Returns
+    -------
+    segments: pd.DataFrame with a row per segment and columns:
+        "Player","Type","Period","Start Frame","End Frame","Start Time [s]","End Time [s]","Duration [s]",
+        "Peak Speed (m/s)","Peak Acceleration (m/s^2)","Distance (m)","Start X","Start Y","End X","End Y".
+        End Frame is the last frame of the segment. Peak Acceleration is the minimum for decelerations,
+        NaN when no segment type needs accelerations.
+    '''
+
+    params=get_segment_parameters() if params is None else params
+    summary_params=mphy.get_summary_parameters() if summary_params is None else summary_params
+    frame_duration=mio.get_frame_duration(team) if summary_params["frame_duration"] is None else summary_params["frame_duration"]
+
+    # Velocities are necessary for calculations
+    if not (any("_speed" in col for col in team.columns)):
+        logger.info("Velocities need to be calculated for segments")
+        team=mvel.calc_player_velocities(team)
+
+    player_indices=np.unique([x[:-2] for x in team.columns if x[-2:]=='_x' and 'ball' not in x])
+    n_players=len(player_indices)
+    variables={}
+    variables["speed"]=team[[p+"_speed" for p in player_indices]].to_numpy(dtype=float)
+    # Accelerations only when a segment type needs them
+    if any(variable=="acceleration" for variable,_,_ in params.values()):
+        if all(p+"_acc" in team.columns for p in player_indices):
+            variables["acceleration"]=team[[p+"_acc" for p in player_indices]].to_numpy(dtype=float)
+        else:
+            kinematics=mkin.calc_player_kinematics(team)
+            variables["acceleration"]=kinematics["acceleration"][:,np.searchsorted(kinematics["players"],player_indices)]
+    x=team[[p+"_x" for p in player_indices]].to_numpy(dtype=float)
+    y=team[[p+"_y" for p in player_indices]].to_numpy(dtype=float)
+    frames=team.index.to_numpy()
+    times=team["Time [s]"].to_numpy(dtype=float)
+    periods=team["Period"].to_numpy()
+
+    # Distance covered up to each frame, with a leading zero row
+    speed=np.where(np.isnan(variables["speed"]),0.,variables["speed"])
+    distance=np.concatenate([np.zeros((1,n_players)),np.cumsum(speed*frame_duration,axis=0)])
+
+    # Row positions where each Period starts and ends
+    bounds=np.concatenate([[0],np.flatnonzero(np.diff(periods)!=0)+1,[len(periods)]])
+
+    tables=[]
+    for segment_type,(variable,threshold,duration) in params.items():
+        values=variables[variable]
+        with np.errstate(invalid='ignore'):
+            mask=values<=threshold if threshold<0 else values>=threshold # NaN is never in a segment
+        if frame_mask is not None:
+            mask&=frame_mask[player_indices].to_numpy(dtype=bool)
+        min_length=max(1,int(round(duration/frame_duration)))
+
+        players,starts,ends=[],[],[]
+        for start,end in zip(bounds[:-1],bounds[1:]):
+            columns,run_starts,run_ends=mphy.find_runs(mask[start:end],min_length)
+            players.append(columns)
+            starts.append(run_starts+start)
+            ends.append(run_ends+start)
+        players=np.concatenate(players)
+        starts=np.concatenate(starts)
+        ends=np.concatenate(ends) # frame after the last frame
+        if players.size==0:
+            continue
+
+        # Peaks within every segment, with reduceat on the (players,frames) layout
+        last=ends-1
+        speed_peak=__reduce_segments(np.fmax,variables["speed"],players,starts,ends)
+        if "acceleration" not in variables:
+            acceleration_peak=np.full(len(players),np.nan)
+        elif threshold<0:
+            acceleration_peak=__reduce_segments(np.fmin,variables["acceleration"],players,starts,ends)
+        else:
+            acceleration_peak=__reduce_segments(np.fmax,variables["acceleration"],players,starts,ends)
+
+        table=pd.DataFrame({"Player":player_indices[players],"Type":segment_type,"Period":periods[starts],
+                            "Start Frame":frames[starts],"End Frame":frames[last],
+                            "Start Time [s]":times[starts],"End Time [s]":times[last],
+                            "Duration [s]":(ends-starts)*frame_duration,
+                            "Peak Speed (m/s)":speed_peak,"Peak Acceleration (m/s^2)":acceleration_peak,
+                            "Distance (m)":distance[ends,players]-distance[starts,players],
+                            "Start X":x[starts,players],"Start Y":y[starts,players],"End X":x[last,players],"End Y":y[last,players]})
+        tables.append(table)
+
+    columns=["Player","Type","Period","Start Frame","End Frame","Start Time [s]","End Time [s]","Duration [s]",
+             "Peak Speed (m/s)","Peak Acceleration (m/s^2)","Distance (m)","Start X","Start Y","End X","End Y"]
+    if not tables:
+        return pd.DataFrame(columns=columns)
+
+    segments=pd.concat(tables,ignore_index=True)
+    segments=segments.sort_values(["Start Frame","Player"],kind="mergesort").reset_index(drop=True)
+
+    return segments[columns]
+
+
+def __reduce_segments(function,values,players,starts,ends):
+    '''
+    Reduces the values of every segment with a ufunc (e.g. np.fmax) for all segments at once.
+
+    Parameters
+    ----------
+    function: numpy ufunc with reduceat, e.g. np.fmax or np.fmin (they ignore NaN).
+    values: np.array in shape (frames,players).
+    players: np.array with the player (column) of each segment.
+    starts: np.array with the first frame (row position) of each segment.
+    ends: np.array with the frame after the last frame of each segment.
+
+    Returns
+    -------
+    reduced: np.array with the reduced value of each segment.
+    '''
+
+    n_frames=values.shape[0]
+    flat=np.append(values.T.ravel(),np.nan) # players one after the other, plus one so that the last end is a valid index
+    indices=np.empty(2*len(starts),dtype=np.int64)
+    indices[0::2]=players*n_frames+starts
+    indices[1::2]=players*n_frames+ends
+
+    return function.reduceat(flat,indices)[0::2]
+
+
+def link_segments_to_events(segments,event):
+    '''
+    Links every segment to the last event that started at or before the Start Frame of the segment.
+
+    Parameters
+    ----------
+    segments: pd.DataFrame with segments from get_players_segments.
+    event: pd.Dataframe with Event Data.
+
+    Returns
+    -------
+    segments: pd.DataFrame with segments and columns "Event ID" (index of event, NaN before the first event),"Event Team","Event Type".
+    '''
+
+    event_frames=event["Start Frame"].to_numpy()
+    order=np.argsort(event_frames,kind="mergesort")
+    positions=np.searchsorted(event_frames[order],segments["Start Frame"].to_numpy(),side="right")-1
+
+    segments=segments.copy()
+    found=positions>=0
+    linked=order[np.where(found,positions,0)]
+    segments["Event ID"]=np.where(found,event.index.to_numpy()[linked],np.nan)
+    segments["Event Team"]=np.where(found,event["Team"].to_numpy(dtype=object)[linked],None)
+    segments["Event Type"]=np.where(found,event["Type"].to_numpy(dtype=object)[linked],None)
+
+    return segments
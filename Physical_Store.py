@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+
+Season store for physical performance metrics.
+Summary and peak metrics of every player are calculated once per game and kept in a single SQLite file (no server needed),
+so season aggregates are queries on the file and never touch raw Tracking Data again.
+Every game is stored with a hash of the velocity, zone and peak settings, games calculated with other settings are stale
+and they are recalculated by update_store.
+Tracking Data labels players by side ("Home_1"), and the club that plays at Home changes from game to game. Games stored with
+a mapping from label to a stable player id (and side to a team id) are aggregated per player over the season, without a mapping
+players are their labels, so cross-game aggregates are per label only.
+
+
+@author: Apatsidis Ioannis
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+import Metrica_IO as mio
+import Metrica_Velocities as mvel
+import Metrica_Monitor as mmon
+import Physical_Performace as mphy
+import Physical_Peaks as mpeak
+
+logger=mmon.get_logger(__name__)
+
+
+def get_store_settings(velocity_params=None,summary_params=None,peak_params=None):
+    '''
+    Collects every setting that changes the stored metrics.
+
+    Parameters
+    ----------
+    velocity_params: Dictionary with keyword arguments of Metrica_Velocities.calc_player_velocities. Default is None, that is
+                     {"max_speed":11,"smoothing":True,"window":5}.
+    summary_params: Dictionary with summary parameters. Default is None, that is Physical_Performace.get_summary_parameters().
+    peak_params: Dictionary with peak parameters. Default is None, that is Physical_Peaks.get_peak_parameters().
+
+    Returns
+    -------
+    settings: Dictionary with "velocity","summary" and "peaks" settings.
+    '''
+
+    settings={}
+    settings["velocity"]={"max_speed":11,"smoothing":True,"window":5} if velocity_params is None else dict(velocity_params)
+    settings["summary"]=mphy.get_summary_parameters() if summary_params is None else dict(summary_params)
+    settings["peaks"]=mpeak.get_peak_parameters() if peak_params is None else dict(peak_params)
+
+    return settings
+
+
+def get_settings_hash(settings):
+    '''
+    Hash of the settings, the same settings always give the same hash.
+
+    Parameters
+    ----------
+    settings: Dictionary from get_store_settings.
+
+    Returns
+    -------
+    settings_hash: Hexadecimal SHA-1 of the settings as JSON with sorted keys.
+    '''
+
+    return hashlib.sha1(json.dumps(settings,sort_keys=True,default=float).encode("utf-8")).hexdigest()
+
+
+def create_store(path):
+    '''
+    Creates the tables of the store, if they don't exist.
+
+    Tables:
+        games(game_id,settings_hash,settings,updated): a row per stored game.
+        player_metrics(game_id,team,player,metric,value,label): a row per game, player and metric. player and team are
+        the stable ids given to add_game (or the label like "Home_1" and the side "Home"), label is the label in Tracking Data.
+
+    Parameters
+    ----------
+    path: Path of the SQLite file.
+    '''
+
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE IF NOT EXISTS games (game_id TEXT PRIMARY KEY,settings_hash TEXT NOT NULL,"
+                           "settings TEXT NOT NULL,updated REAL NOT NULL)")
+        connection.execute("CREATE TABLE IF NOT EXISTS player_metrics (game_id TEXT NOT NULL,team TEXT NOT NULL,"
+                           "player TEXT NOT NULL,metric TEXT NOT NULL,value REAL,label TEXT,PRIMARY KEY (game_id,player,metric))")
+        # Stores of older versions have no labels, their players are the labels
+        if "label" not in [column[1] for column in connection.execute("PRAGMA table_info(player_metrics)")]:
+            connection.execute("ALTER TABLE player_metrics ADD COLUMN label TEXT")
+            connection.execute("UPDATE player_metrics SET label=player")
+        connection.execute("CREATE INDEX IF NOT EXISTS player_metrics_player ON player_metrics (player,metric)")
+    connection.close()
+
+
+@mmon.timed
+def add_game(path,game_id,tracking_home,tracking_away,settings=None,player_ids=None,team_ids=None):
+    '''
+    Calculates summary and peak metrics of the players of a game and stores them. A game that is already stored is replaced.
+    Velocities are calculated with the velocity settings, already calculated velocities are replaced.
+
+    Parameters
+    ----------
+    path: Path of the SQLite file.
+    game_id: Id of the game.
+    tracking_home: pd.DataFrame with Tracking Data of Home team, in meters.
+    tracking_away: pd.DataFrame with Tracking Data of Away team, in meters.
+    settings: Dictionary from get_store_settings. Default is None, that is get_store_settings().
+    player_ids: Dictionary from the labels of the players in this game (like "Home_1") to stable player ids, given for every player.
+                Default is None, that is the labels.
+    team_ids: Dictionary from "Home" and "Away" to stable team ids in this game. Default is None, that is "Home" and "Away".
+    '''
+
+    settings=get_store_settings() if settings is None else settings
+    team_ids={"Home":"Home","Away":"Away"} if team_ids is None else team_ids
+    if player_ids is not None:
+        assert len(set(player_ids.values()))==len(player_ids),"Every player should have a different id."
+    create_store(path)
+
+    rows=[]
+    for team_name,team in [("Home",tracking_home),("Away",tracking_away)]:
+        team=mvel.calc_player_velocities(team,**settings["velocity"])
+        summary=mphy.get_players_summary(team,settings["summary"])
+        peaks=mpeak.get_players_peaks(team,settings["peaks"],settings["summary"])
+        metrics=summary.join(peaks)
+        metrics.index.name="player"
+        if player_ids is not None:
+            missing=[player for player in metrics.index if player not in player_ids]
+            assert not missing,"Players without id in game {}: {}.".format(game_id,missing)
+        metrics=metrics.reset_index().melt(id_vars="player",var_name="metric",value_name="value").dropna(subset=["value"])
+        rows+=[(str(game_id),str(team_ids[team_name]),player if player_ids is None else str(player_ids[player]),metric,float(value),player)
+               for player,metric,value in metrics.itertuples(index=False)]
+
+    # One transaction, so that a game is either stored completely or not at all
+    with sqlite3.connect(path) as connection:
+        connection.execute("DELETE FROM player_metrics WHERE game_id=?",(str(game_id),))
+        connection.executemany("INSERT INTO player_metrics VALUES (?,?,?,?,?,?)",rows)
+        connection.execute("INSERT OR REPLACE INTO games VALUES (?,?,?,?)",
+                           (str(game_id),get_settings_hash(settings),json.dumps(settings,sort_keys=True,default=float),time.time()))
+    connection.close()
+
+
+def get_stored_games(path):
+    '''
+    Parameters
+    ----------
+    path: Path of the SQLite file.
+
+    Returns
+    -------
+    games: pd.DataFrame indexed by game id with "settings_hash" and "updated" (seconds since epoch) of every stored game.
+    '''
+
+    create_store(path)
+    with sqlite3.connect(path) as connection:
+        games=pd.read_sql_query("SELECT game_id,settings_hash,updated FROM games ORDER BY game_id",connection,index_col="game_id")
+    connection.close()
+
+    return games
+
+
+def get_stale_games(path,game_ids,settings=None):
+    '''
+    Finds the games that need to be calculated: games that are not stored or were stored with other settings.
+
+    Parameters
+    ----------
+    path: Path of the SQLite file.
+    game_ids: List with ids of games.
+    settings: Dictionary from get_store_settings. Default is None, that is get_store_settings().
+
+    Returns
+    -------
+    stale: List with the ids of stale games, in the order of game_ids.
+    '''
+
+    settings=get_store_settings() if settings is None else settings
+    settings_hash=get_settings_hash(settings)
+    stored=get_stored_games(path)["settings_hash"]
+
+    return [game_id for game_id in game_ids if stored.get(str(game_id))!=settings_hash]
+
+
+def update_store(path,DATA_DIR,game_ids,settings=None,force=False,player_ids=None,team_ids=None):
+    '''
+    Brings the store up to date: reads the Tracking Data only of stale games (see get_stale_games) and stores their metrics.
+
+    Parameters
+    ----------
+    path: Path of the SQLite file.
+    DATA_DIR: Directory of the data, as in Metrica_IO.read_tracking_data.
+    game_ids: List with ids of games.
+    settings: Dictionary from get_store_settings. Default is None, that is get_store_settings().
+    force: Recalculate every game, even if it is up to date. Default is False.
+    player_ids: Dictionary from game id to the player_ids of the game, see add_game. Default is None, that is the labels.
+                Games stored before with other ids are not stale, recalculate them with force.
+    team_ids: Dictionary from game id to the team_ids of the game, see add_game. Default is None, that is "Home" and "Away".
+
+    Returns
+    -------
+    updated: List with the ids of the games that were calculated.
+    '''
+
+    settings=get_store_settings() if settings is None else settings
+    updated=list(game_ids) if force else get_stale_games(path,game_ids,settings)
+    mmon.count("store.games_up_to_date",len(game_ids)-len(updated))
+
+    for k,game_id in enumerate(updated):
+        logger.info("Storing game %s",game_id)
+        tracking_home=mio.transform_coord_system(mio.read_tracking_data(DATA_DIR,game_id,"Home"))
+        tracking_away=mio.transform_coord_system(mio.read_tracking_data(DATA_DIR,game_id,"Away"))
+        add_game(path,game_id,tracking_home,tracking_away,settings,
+                 None if player_ids is None else player_ids[game_id],None if team_ids is None else team_ids[game_id])
+        mmon.progress("update_store",k+1,len(updated))
+
+    return updated
+
+
+def remove_game(path,game_id):
+    '''
+    Removes a game from the store.
+
+    Parameters
+    ----------
+    path: Path of the SQLite file.
+    game_id: Id of the game.
+    '''
+
+    create_store(path)
+    with sqlite3.connect(path) as connection:
+        connection.execute("DELETE FROM player_metrics WHERE game_id=?",(str(game_id),))
+        connection.execute("DELETE FROM games WHERE game_id=?",(str(game_id),))
+    connection.close()
+
+
+def query_store(path,players=None,game_ids=None,metrics=None,aggregate=True,teams=None):
+    '''
+    Metrics of players from the store, without reading any Tracking Data.
+
+    Parameters
+    ----------
+    path: Path of the SQLite file.
+    players: List with players, stable ids or labels like "Home_1" (see add_game). Default is None, that is all players.
+    game_ids: List with ids of games. Default is None, that is all games.
+    metrics: List with metrics like "Distance (km)". Default is None, that is all metrics.
+    aggregate: Aggregate every player over the games. Default is True.
+               Peaks are the maximum over the games, times of peaks are left out and the rest of metrics are summed.
+               Games stored without player ids are aggregated per label, that is per side and shirt, not per person.
+    teams: List with teams, stable ids or "Home","Away" (see add_game). Default is None, that is all teams.
+
+    Returns
+    -------
+    result: pd.DataFrame with a row per player (aggregate) or per (Game, Player) and a column per metric.
+            Aggregated result has also the number of games of each player.
+    '''
+
+    create_store(path)
+    conditions,arguments=[],[]
+    for column,values in [("player",players),("game_id",game_ids),("metric",metrics),("team",teams)]:
+        if values is not None:
+            values=[str(value) for value in values]
+            conditions.append("{0} IN ({1})".format(column,",".join("?"*len(values))))
+            arguments+=values
+    where=" WHERE "+" AND ".join(conditions) if conditions else ""
+
+    with sqlite3.connect(path) as connection:
+        if aggregate:
+            # Aggregation happens in SQLite, only one row per player and metric is read
+            query=("SELECT player,metric,CASE WHEN metric LIKE 'Peak %' THEN MAX(value) ELSE SUM(value) END AS value,"
+                   "COUNT(DISTINCT game_id) AS games FROM player_metrics"+where+
+                   (" AND " if where else " WHERE ")+"metric NOT LIKE '% Time [s]' GROUP BY player,metric")
+            values=pd.read_sql_query(query,connection,params=arguments)
+        else:
+            values=pd.read_sql_query("SELECT game_id,player,metric,value FROM player_metrics"+where,connection,params=arguments)
+    connection.close()
+
+    if aggregate:
+        result=values.pivot(index="player",columns="metric",values="value")
+        result.insert(0,"Games",values.groupby("player")["games"].max().astype(np.int64))
+        result.index.name="Player"
+    else:
+        result=values.pivot_table(index=["game_id","player"],columns="metric",values="value",aggfunc="first")
+        result.index.names=["Game","Player"]
+    result.columns.name=None
+
+    # Same order of metrics as get_players_summary and get_players_peaks
+    order={metric:position for position,metric in enumerate(
+        ["Games","Minutes Played","Distance (km)"]+[name+" (km)" for name in mphy.get_summary_parameters()["zone_names"]]+["# of Sprints"])}
+    columns=sorted(result.columns,key=lambda column:(order.get(column,len(order)),column.endswith("Time [s]")))
+
+    return result[columns]
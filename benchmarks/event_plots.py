@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+
+Plots per second of Metrica_Vizuals.save_event_plots against building a new figure for every event (naive_save_event_plots below).
+Events are the passes of a synthetic game (benchmarks/synthetic.py), pitch control surfaces are random.
+All plots are saved to a temporary directory.
+
+Usage: python benchmarks/event_plots.py [n_events]
+
+
+@author: Apatsidis Ioannis
+"""
+
+import os
+import sys
+import tempfile
+import time
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+import Metrica_Vizuals as miz
+import Metrica_Velocities as mvel
+import synthetic
+
+
+def naive_save_event_plots(event_ids,event,tracking_home,tracking_away,file_path,kind,pc_surfaces,epv_grid):
+    '''
+    A new figure for every event, as the plot functions are used one by one.
+    '''
+
+    for event_id in event_ids:
+        if kind=="events":
+            frame=event.loc[event_id,"Start Frame"]
+            fig,ax=miz.plot_frame(tracking_home.loc[frame],tracking_away.loc[frame],True)
+            miz.plot_events(event.loc[event_id:event_id],figax=(fig,ax))
+        elif kind=="pitch_control":
+            fig,ax=miz.plot_pitch_control_for_event(event_id,event,tracking_home,tracking_away,pc_surfaces[event_id],None,None,include_player_velocities=True)
+        else:
+            fig,ax=miz.plot_EPV_grid_for_event(event_id,event,tracking_home,tracking_away,epv_grid,pc_surfaces[event_id],include_player_velocities=True)
+        fig.savefig(os.path.join(file_path,"{}_{}.png".format(kind,event_id)),dpi=100)
+        plt.close(fig)
+
+
+def benchmark(n_events=50):
+    '''
+    Returns
+    -------
+    results: Dictionary from (kind, implementation) to plots per second.
+    '''
+
+    tracking_home,tracking_away=synthetic.make_tracking_data(n_events*200)
+    tracking_home=mvel.calc_player_velocities(tracking_home)
+    tracking_away=mvel.calc_player_velocities(tracking_away)
+    event=synthetic.make_event_data(tracking_home,tracking_away)
+    event=event[event["Type"]=="PASS"].iloc[:n_events]
+    rng=np.random.default_rng(0)
+    pc_surfaces={event_id:rng.random((32,50)) for event_id in event.index}
+    epv_grid=np.genfromtxt(os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","EPV_grid.csv"),delimiter=",")
+
+    results={}
+    with tempfile.TemporaryDirectory() as directory:
+        for kind in ["events","pitch_control","EPV"]:
+            start=time.perf_counter()
+            naive_save_event_plots(event.index,event,tracking_home,tracking_away,directory,kind,pc_surfaces,epv_grid)
+            results[(kind,"naive")]=len(event)/(time.perf_counter()-start)
+            results[(kind,"save_event_plots")]=miz.save_event_plots(event.index,event,tracking_home,tracking_away,directory,kind,pc_surfaces,epv_grid,
+                                                                    include_player_velocities=True)
+            if os.cpu_count()>1:
+                results[(kind,"n_jobs={}".format(os.cpu_count()))]=miz.save_event_plots(event.index,event,tracking_home,tracking_away,directory,kind,
+                                                                                          pc_surfaces,epv_grid,include_player_velocities=True,n_jobs=-1)
+
+    return results
+
+
+if __name__=="__main__":
+    # Worker processes of save_event_plots import this module again on spawn
+    n_events=int(sys.argv[1]) if len(sys.argv)>1 else 50
+    results=benchmark(n_events)
+    for (kind,name),plots_per_second in results.items():
+        print("{:<15}{:<18}{:8.1f} plots/s".format(kind,name,plots_per_second))
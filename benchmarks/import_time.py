@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+
+Import time of every module, each one imported in a new interpreter (as a process pool worker or a command line run does),
+and whether pandas and matplotlib were imported with it. numpy, pandas and matplotlib.pyplot are timed too as references.
+With --check the exit code is 1 if a module of the analysis (everything but the plots) imports matplotlib.
+
+Usage: python benchmarks/import_time.py [--repeat 5] [--check]
+
+
+@author: Apatsidis Ioannis
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT=os.path.join(os.path.dirname(os.path.abspath(__file__)),"..")
+
+REFERENCES=["numpy","pandas","matplotlib.pyplot"]
+ANALYSIS_MODULES=["Metrica_Monitor","Metrica_IO","Metrica_Velocities","Metrica_Kinematics","Metrica_Pitch_Control","Metrica_EPV","Metrica_Heatmaps","Metrica_Shape","Metrica_Events","Metrica_Windows","Metrica_Pressure","Metrica_Runs",
+                  "Metrica_Live","Metrica_Pipeline","Physical_Performace","Physical_Peaks","Physical_Segments","Physical_Store"]
+PLOT_MODULES=["Metrica_Vizuals"]
+
+# Run by every new interpreter: time of the import and the heavy libraries it brought in
+__SCRIPT='''
+import sys,time
+start=time.perf_counter()
+import {module}
+seconds=time.perf_counter()-start
+print(seconds,"pandas" in sys.modules,"matplotlib" in sys.modules)
+'''
+
+
+def time_import(module,repeat=5):
+    '''
+    Parameters
+    ----------
+    module: Name of the module.
+    repeat: Number of new interpreters, the median time is kept. Default is 5.
+
+    Returns
+    -------
+    result: Dictionary with "seconds" (median), "pandas" and "matplotlib" (True if imported with the module).
+    '''
+
+    runs=[]
+    for _ in range(repeat):
+        output=subprocess.run([sys.executable,"-c",__SCRIPT.format(module=module)],cwd=ROOT,capture_output=True,text=True,check=True).stdout.split()
+        runs.append((float(output[-3]),output[-2]=="True",output[-1]=="True"))
+    seconds=sorted(run[0] for run in runs)[len(runs)//2]
+
+    return {"seconds":seconds,"pandas":runs[0][1],"matplotlib":runs[0][2]}
+
+
+def benchmark(repeat=5):
+    '''
+    Returns
+    -------
+    results: Dictionary from module name to the result of time_import, references first.
+    '''
+
+    return {module:time_import(module,repeat) for module in REFERENCES+ANALYSIS_MODULES+PLOT_MODULES}
+
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Import time of every module in a new interpreter.")
+    parser.add_argument("--repeat",type=int,default=5,help="New interpreters per module, the median time is kept.")
+    parser.add_argument("--check",action="store_true",help="Exit with 1 if a module of the analysis imports matplotlib.")
+    arguments=parser.parse_args()
+
+    results=benchmark(arguments.repeat)
+    print("{:<24}{:>10}{:>8}{:>12}".format("module","time (s)","pandas","matplotlib"))
+    for module,result in results.items():
+        print("{:<24}{:10.3f}{:>8}{:>12}".format(module,result["seconds"],"yes" if result["pandas"] else "no","yes" if result["matplotlib"] else "no"))
+
+    heavy=[module for module in ANALYSIS_MODULES if results[module]["matplotlib"]]
+    if heavy:
+        print("Modules of the analysis importing matplotlib:",", ".join(heavy))
+    if arguments.check and heavy:
+        sys.exit(1)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+
+Frames per second of Metrica_Vizuals.save_movie against the previous implementation (legacy_save_movie below),
+which created, plotted and removed every artist for every frame.
+With more than one CPU, save_movie with a process per CPU (n_jobs=-1) is measured too.
+All movies are written with ffmpeg to a temporary directory.
+
+Usage: python benchmarks/movie_fps.py [n_frames]
+
+
+@author: Apatsidis Ioannis
+"""
+
+import os
+import re
+import sys
+import tempfile
+import time
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import matplotlib.animation as animation
+import numpy as np
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+import Metrica_Vizuals as miz
+import Metrica_Velocities as mvel
+import synthetic
+
+
+def legacy_save_movie(tracking_home,tracking_away,file_path,file_name,fps=25,figax=None, field_dimensions = (106.0,68.0),include_player_velocities=False,home_team_color='black',away_team_color='red',marker='o',player_alpha=0.7):
+    '''
+    save_movie as it was before persistent artists, kept as the reference of the benchmark.
+    '''
+
+    assert np.all(list(tracking_home.index)==list(tracking_away.index)),"Tracking Home index should be same with Tracking Away index."
+
+    if figax==None: #create new pitch
+        fig,ax=miz.plot_pitch(field_dimensions=field_dimensions)
+    else: # overlay on existing pitch
+        fig,ax=figax
+    fig.set_tight_layout(True)
+
+    index=tracking_away.index
+    metadata=dict(title="Tracking Data",comment="Metrica tracking data movie")
+    ffmpeg=animation.FFMpegWriter(fps=fps,metadata=metadata)
+    file_path=os.path.join(file_path,file_name+".mp4")
+
+    with ffmpeg.saving(fig=fig,outfile=file_path,dpi=100):
+        for idx in index:
+            objects=[]
+            for team, color in zip([tracking_home.loc[idx],tracking_away.loc[idx]], [home_team_color,away_team_color]):
+                player_x_columns=[x for x in team.index if (re.match(r"Home_[0-9]+_x|Away_[0-9]+_x",x))]
+                player_y_columns=[y for y in team.index if (re.match(r"Home_[0-9]+_y|Away_[0-9]+_y",y))]
+                obj,=ax.plot(team[player_x_columns],team[player_y_columns],marker,color=color,markersize=10,alpha=player_alpha)
+                objects.append(obj)
+                if include_player_velocities:
+                    vx_columns=[x.replace("_x","_vx") for x in player_x_columns]
+                    vy_columns=[y.replace("_y","_vy") for y in player_y_columns]
+                    obj=ax.quiver(team[player_x_columns],team[player_y_columns],team[vx_columns],team[vy_columns],color=color,alpha=1,
+                                  scale_units='inches', scale=10.,width=0.0015,headlength=5,headwidth=3,zorder=4)
+                    objects.append(obj)
+            obj,=ax.plot(team["ball_x"],team["ball_y"],marker,markersize=3,color='white')
+            objects.append(obj)
+            frame_minute=int(team["Time [s]"]/60.0)
+            frame_second=(team["Time [s]"]/60.0 - frame_minute)*60
+            timer_text="{}:{:.1f}".format(frame_minute,frame_second)
+            obj=ax.text(-8,field_dimensions[1]/2 +8,timer_text,bbox=dict(facecolor='#3C83F6', alpha=0.5,edgecolor='blue'))
+            objects.append(obj)
+            ffmpeg.grab_frame()
+            for object in objects:
+                object.remove()
+
+        plt.clf()
+        plt.close(fig)
+
+
+def benchmark(n_frames=250):
+    '''
+    Returns
+    -------
+    results: Dictionary from implementation to frames per second.
+    '''
+
+    tracking_home,tracking_away=synthetic.make_tracking_data(n_frames)
+    tracking_home=mvel.calc_player_velocities(tracking_home)
+    tracking_away=mvel.calc_player_velocities(tracking_away)
+
+    results={}
+    with tempfile.TemporaryDirectory() as directory:
+        runs=[("legacy",legacy_save_movie,{}),("save_movie",miz.save_movie,{})]
+        if os.cpu_count()>1:
+            runs.append(("n_jobs={}".format(os.cpu_count()),miz.save_movie,{"n_jobs":-1}))
+        for name,function,kwargs in runs:
+            start=time.perf_counter()
+            function(tracking_home,tracking_away,directory,name.replace("=","_"),include_player_velocities=True,**kwargs)
+            results[name]=n_frames/(time.perf_counter()-start)
+
+    return results
+
+
+if __name__=="__main__":
+    # Worker processes of save_movie import this module again on spawn
+    n_frames=int(sys.argv[1]) if len(sys.argv)>1 else 250
+    results=benchmark(n_frames)
+    for name,fps in results.items():
+        print("{:<12}{:8.1f} frames/s".format(name,fps))
+    print("Speed up: {:.1f}x".format(results["save_movie"]/results["legacy"]))
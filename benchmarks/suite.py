@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+
+Times every stage of the pipeline on a synthetic game written as Metrica CSV files (benchmarks/synthetic.py):
+loading, normalisation (coordinates and single playing direction), velocities, summary metrics, pitch control and
+EPV added of passes and frames of a movie. Timings are written as JSON, with the version of the code and of the libraries,
+so runs of different versions can be compared with --compare. With --metrics the counters of Metrica_Monitor
+(e.g. pitch control cells resolved by integration) are saved too.
+
+Usage: python benchmarks/suite.py [--frames 141000] [--events 20] [--movie-frames 250] [--metrics] [--output results.json] [--compare previous.json]
+
+
+@author: Apatsidis Ioannis
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import pandas as pd
+
+ROOT=os.path.join(os.path.dirname(os.path.abspath(__file__)),"..")
+sys.path.insert(0,ROOT)
+import Metrica_IO as mio
+import Metrica_Velocities as mvel
+import Metrica_Pitch_Control as mpc
+import Metrica_EPV as mepv
+import Metrica_Vizuals as miz
+import Metrica_Monitor as mmon
+import Physical_Performace as mphy
+import synthetic
+
+
+def __get_version():
+    '''
+    Commit of the code (with "-dirty" for uncommitted changes) and versions of Python and the libraries.
+    '''
+
+    try:
+        commit=subprocess.run(["git","describe","--always","--dirty"],cwd=ROOT,capture_output=True,text=True,check=True).stdout.strip()
+    except (OSError,subprocess.CalledProcessError):
+        commit=None
+
+    return {"commit":commit,"python":platform.python_version(),"numpy":np.__version__,"pandas":pd.__version__,
+            "matplotlib":matplotlib.__version__,"platform":platform.platform(),"cpus":os.cpu_count()}
+
+
+def run_suite(n_frames=141000,n_events=20,n_movie_frames=250,seed=0,metrics=False):
+    '''
+    Runs every stage once, in the order of the pipeline.
+
+    Parameters
+    ----------
+    n_frames: Number of frames of the synthetic game. Default is 141000 (about a full match).
+    n_events: Number of passes for pitch control and EPV added. Default is 20.
+    n_movie_frames: Number of frames of the movie, 0 to skip it. It is skipped too when ffmpeg is not found. Default is 250.
+    seed: Seed of the synthetic game. Default is 0.
+    metrics: Collect the metrics of Metrica_Monitor while the stages run. Default is False.
+
+    Returns
+    -------
+    results: Dictionary with "version", "settings" and "stages": stage name to {"seconds","items","seconds_per_item"},
+             and "metrics" (Metrica_Monitor.Metrics.summary) when metrics is True.
+    '''
+
+    if metrics:
+        collected=mmon.enable(mmon.Metrics())
+
+    stages={}
+    def record(name,start,items=1):
+        seconds=time.perf_counter()-start
+        stages[name]={"seconds":seconds,"items":items,"seconds_per_item":seconds/items}
+        print("{:<28}{:10.3f} s".format(name,seconds))
+
+    with tempfile.TemporaryDirectory() as DATA_DIR:
+        start=time.perf_counter()
+        tracking_home,tracking_away=synthetic.make_tracking_data(n_frames,seed=seed)
+        event=synthetic.make_event_data(tracking_home,tracking_away,seed=seed)
+        synthetic.write_metrica_game(DATA_DIR,1,tracking_home,tracking_away,event)
+        record("generate",start)
+
+        start=time.perf_counter()
+        event=mio.read_event_data(DATA_DIR,1)
+        tracking_home=mio.read_tracking_data(DATA_DIR,1,"Home")
+        tracking_away=mio.read_tracking_data(DATA_DIR,1,"Away")
+        record("load",start,n_frames)
+
+    start=time.perf_counter()
+    event=mio.transform_coord_system(event)
+    tracking_home=mio.transform_coord_system(tracking_home)
+    tracking_away=mio.transform_coord_system(tracking_away)
+    event,tracking_home,tracking_away=mio.set_single_playing_direction(event,tracking_home,tracking_away)
+    record("normalise",start,n_frames)
+
+    start=time.perf_counter()
+    tracking_home=mvel.calc_player_velocities(tracking_home)
+    tracking_away=mvel.calc_player_velocities(tracking_away)
+    record("calc_player_velocities",start,n_frames)
+
+    start=time.perf_counter()
+    mphy.get_players_summary(tracking_home)
+    mphy.get_players_summary(tracking_away)
+    record("get_players_summary",start,n_frames)
+
+    params=mpc.get_model_parameters()
+    GK_NAMES=(mio.get_goalkeeper_name(tracking_home),mio.get_goalkeeper_name(tracking_away))
+    passes=event[event["Type"]=="PASS"].index[:n_events]
+
+    start=time.perf_counter()
+    for event_id in passes:
+        mpc.find_pitch_control_for_event(event_id,event,tracking_home,tracking_away,params,GK_NAMES)
+    record("find_pitch_control_for_event",start,len(passes))
+
+    epv_grid=np.genfromtxt(os.path.join(ROOT,"EPV_grid.csv"),delimiter=",")
+    start=time.perf_counter()
+    for event_id in passes:
+        mepv.calculate_EPV_added(event_id,event,tracking_home,tracking_away,GK_NAMES,params,epv_grid)
+    record("calculate_EPV_added",start,len(passes))
+
+    if n_movie_frames>0 and shutil.which("ffmpeg") is not None:
+        with tempfile.TemporaryDirectory() as directory:
+            start=time.perf_counter()
+            miz.save_movie(tracking_home.iloc[:n_movie_frames],tracking_away.iloc[:n_movie_frames],directory,"movie",include_player_velocities=True)
+            record("save_movie",start,n_movie_frames)
+    else:
+        print("Skipping save_movie")
+
+    settings={"n_frames":n_frames,"n_events":len(passes),"n_movie_frames":n_movie_frames,"seed":seed}
+    results={"version":__get_version(),"settings":settings,"stages":stages}
+    if metrics:
+        mmon.disable()
+        results["metrics"]=collected.summary()
+
+    return results
+
+
+def compare_results(results,previous):
+    '''
+    Prints seconds per item of every stage of two runs and the ratio (previous/results, above 1 is faster).
+
+    Parameters
+    ----------
+    results: Dictionary from run_suite.
+    previous: Dictionary from run_suite of another run (e.g. another version).
+    '''
+
+    print("{:<28}{:>14}{:>14}{:>9}".format("stage","previous (s)","current (s)","speed up"))
+    for name,stage in results["stages"].items():
+        if name not in previous["stages"]:
+            continue
+        before=previous["stages"][name]["seconds_per_item"]
+        after=stage["seconds_per_item"]
+        print("{:<28}{:14.4g}{:14.4g}{:8.2f}x".format(name,before,after,before/after))
+
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Times every stage of the pipeline on a synthetic game.")
+    parser.add_argument("--frames",type=int,default=141000,help="Frames of the synthetic game.")
+    parser.add_argument("--events",type=int,default=20,help="Passes for pitch control and EPV added.")
+    parser.add_argument("--movie-frames",type=int,default=250,help="Frames of the movie, 0 to skip it.")
+    parser.add_argument("--seed",type=int,default=0,help="Seed of the synthetic game.")
+    parser.add_argument("--metrics",action="store_true",help="Save the counters of Metrica_Monitor too.")
+    parser.add_argument("--output",default="benchmark_results.json",help="JSON file for the results.")
+    parser.add_argument("--compare",default=None,help="JSON file of a previous run to compare with.")
+    arguments=parser.parse_args()
+
+    results=run_suite(arguments.frames,arguments.events,arguments.movie_frames,arguments.seed,arguments.metrics)
+    with open(arguments.output,"w") as json_file:
+        json.dump(results,json_file,indent=2)
+    print("Results saved at",arguments.output)
+
+    if arguments.compare is not None:
+        with open(arguments.compare) as json_file:
+            compare_results(results,json.load(json_file))
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+
+Synthetic games for benchmarks, since only the Event Data of the sample games are shipped.
+Tracking Data are in the layout of Metrica_IO.read_tracking_data after Metrica_IO.transform_coord_system
+(meters, origin at the center of the pitch, teams change sides at half time) and write_metrica_game writes them
+(and Event Data) as Metrica CSV files, so that Metrica_IO reads them like the sample games.
+Players keep a 4-4-2 shape that follows the ball and wander around it with smooth random motion, so speeds and
+distances are close to a real match, but the data have no football meaning.
+
+
+@author: Apatsidis Ioannis
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+
+def __smooth_noise(rng,n_frames,n_columns,window):
+    '''
+    Smooth random signals with unit standard deviation: white noise filtered twice with a moving average of window frames.
+    '''
+
+    noise=rng.normal(0,1,(n_frames+2*window,n_columns))
+    for _ in range(2):
+        cumsum=np.concatenate([np.zeros((1,n_columns)),np.cumsum(noise,axis=0)])
+        noise=(cumsum[window:]-cumsum[:-window])/window
+    noise=noise[:n_frames]
+
+    return noise/noise.std(axis=0)
+
+
+def __get_gaps(rng,n_frames,n_columns,n_gaps,min_length,max_length):
+    '''
+    Boolean mask in shape (n_frames,n_columns), True in n_gaps random gaps per column.
+    '''
+
+    mask=np.zeros((n_frames,n_columns),dtype=bool)
+    for column in range(n_columns):
+        for start,length in zip(rng.integers(0,n_frames,n_gaps),rng.integers(min_length,max_length+1,n_gaps)):
+            mask[start:start+length,column]=True
+
+    return mask
+
+
+def make_tracking_data(n_frames=141000,n_players=14,seed=0,field_dimensions=(106.,68.),n_gaps=5):
+    '''
+    Creates Tracking Data for Home and Away team: 11 starters and n_players-11 substitutes per team, 25 frames per second
+    and two Periods. Home starts from the left side. Substitutes replace the 8th, 9th and 10th starter (in turns) during the second Period.
+    The ball is NaN when it is out of play and players have short tracking gaps (NaN).
+
+    Parameters
+    ----------
+    n_frames: Number of frames, 25 frames per second. Default is 141000 (about a full match).
+    n_players: Number of players of each team, at least 11. Default is 14 (11 starters and 3 substitutes).
+    seed: Seed of the random generator. Default is 0.
+    field_dimensions: Field dimensions in meters (Width x Height). Default is (106,68).
+    n_gaps: Number of tracking gaps (0.2-2 sec) per player and of out of play spells (2-10 sec) of the ball. Default is 5.
+
+    Returns
+    -------
+    tracking_home,tracking_away: pd.DataFrames with Tracking Data, indexed by "Frame".
+    '''
+
+    assert n_players>=11,"Teams need at least 11 players."
+    rng=np.random.default_rng(seed)
+    frames=np.arange(1,n_frames+1)
+    periods=np.where(frames<=n_frames//2,1,2)
+    half_length,half_width=field_dimensions[0]/2,field_dimensions[1]/2
+
+    # Ball wanders slowly over the whole field, passes are faster changes on top
+    ball_slow=np.array([0.55*half_length,0.45*half_width])*__smooth_noise(rng,n_frames,2,250)
+    ball_x=np.clip(ball_slow[:,0]+3*__smooth_noise(rng,n_frames,1,25)[:,0],-half_length,half_length)
+    ball_y=np.clip(ball_slow[:,1]+2*__smooth_noise(rng,n_frames,1,25)[:,0],-half_width,half_width)
+    out_of_play=__get_gaps(rng,n_frames,1,n_gaps,50,250)[:,0]
+
+    # 4-4-2 of a team attacking from left to right, goalkeeper first
+    formation=np.array([[-48,0],[-33,-22],[-33,-8],[-33,8],[-33,22],[-15,-24],[-15,-8],[-15,8],[-15,24],[-3,-8],[-3,8]],dtype=float)
+    formation*=np.array([half_length/53,half_width/34])
+
+    teams=[]
+    for team_name,first_jersey,direction in [("Home",1,1),("Away",n_players+1,-1)]:
+        # Teams change sides at half time
+        side=np.where(periods==1,direction,-direction)[:,np.newaxis]
+        replaced=[7+k%3 for k in range(n_players-11)] # substitutes replace the 8th, 9th and 10th starter, in turns
+        anchors=np.concatenate([formation,formation[replaced]])
+
+        # Outfield players move with the ball, the goalkeeper stays close to the goal
+        shift=np.full(n_players,0.3)
+        shift[0]=0.1
+        wander=np.full(n_players,1.)
+        wander[0]=0.3
+        x=side*anchors[:,0]+shift*ball_slow[:,[0]]+wander*(5*__smooth_noise(rng,n_frames,n_players,250)+1.2*__smooth_noise(rng,n_frames,n_players,40))
+        y=side*anchors[:,1]+shift*ball_slow[:,[1]]+wander*(4*__smooth_noise(rng,n_frames,n_players,250)+1.2*__smooth_noise(rng,n_frames,n_players,40))
+        x=np.clip(x,-half_length-2,half_length+2)
+        y=np.clip(y,-half_width-2,half_width+2)
+
+        # Substitutions in the second Period, a starter is replaced only once
+        on_field=np.arange(11)
+        for k in range(n_players-11):
+            frame=n_frames//2+int((0.2+0.6*(k+1)/(n_players-10))*(n_frames-n_frames//2))
+            player=on_field[replaced[k]]
+            x[:frame,11+k]=np.nan
+            y[:frame,11+k]=np.nan
+            x[frame:,player]=np.nan
+            y[frame:,player]=np.nan
+            on_field[replaced[k]]=11+k
+
+        gaps=__get_gaps(rng,n_frames,n_players,n_gaps,5,50)
+        x[gaps]=np.nan
+        y[gaps]=np.nan
+
+        columns={"Period":periods,"Time [s]":np.round(frames*0.04,2)}
+        for player in range(n_players):
+            columns["{}_{}_x".format(team_name,first_jersey+player)]=x[:,player]
+            columns["{}_{}_y".format(team_name,first_jersey+player)]=y[:,player]
+        columns["ball_x"]=np.where(out_of_play,np.nan,ball_x)
+        columns["ball_y"]=np.where(out_of_play,np.nan,ball_y)
+        teams.append(pd.DataFrame(columns,index=pd.Index(frames,name="Frame")))
+
+    return teams[0],teams[1]
+
+
+def make_event_data(tracking_home,tracking_away,seed=0,mean_interval=3.):
+    '''
+    Creates Event Data along the ball path of the Tracking Data: a KICK OFF at the start of each Period and then passes,
+    shots, lost balls and recoveries about every mean_interval seconds. Passes are from the player of the team in possession
+    that is closest to the ball at the Start Frame to the teammate closest to the ball at the End Frame.
+
+    Parameters
+    ----------
+    tracking_home,tracking_away: pd.DataFrames with Tracking Data from make_tracking_data.
+    seed: Seed of the random generator. Default is 0.
+    mean_interval: Mean time between events in seconds. Default is 3.
+
+    Returns
+    -------
+    event: pd.DataFrame with Event Data in meters, with the columns of Metrica_IO.read_event_data.
+    '''
+
+    rng=np.random.default_rng(seed)
+    frames=tracking_home.index.to_numpy()
+    periods=tracking_home["Period"].to_numpy()
+    times=tracking_home["Time [s]"].to_numpy()
+    ball=tracking_home[["ball_x","ball_y"]].to_numpy()
+    in_play=~np.isnan(ball).any(axis=1)
+
+    players={}
+    for team_name,team in [("Home",tracking_home),("Away",tracking_away)]:
+        names=np.unique([x[:-2] for x in team.columns if x[-2:]=='_x' and 'ball' not in x])
+        players[team_name]=(np.array(["Player"+name.split("_")[1] for name in names]),
+                            team[[p+"_x" for p in names]].to_numpy(),team[[p+"_y" for p in names]].to_numpy())
+
+    def closest(team_name,row,exclude=None):
+        names,x,y=players[team_name]
+        distance=np.hypot(x[row]-ball[row,0],y[row]-ball[row,1])
+        distance[np.isnan(distance)]=np.inf
+        if exclude is not None:
+            distance[names==exclude]=np.inf
+        return names[np.argmin(distance)]
+
+    rows=[]
+    team_name="Home"
+    for period in np.unique(periods):
+        period_rows=np.flatnonzero(periods==period)
+        first,last=period_rows[0],period_rows[-1]
+        player=closest(team_name,first)
+        rows.append((team_name,"SET PIECE","KICK OFF",period,frames[first],times[first],0,0.,player,np.nan,np.nan,np.nan,np.nan,np.nan))
+
+        start=first
+        while True:
+            end=start+rng.integers(10,60)
+            if end>last:
+                break
+            if in_play[start] and in_play[end]:
+                kind=rng.choice(["PASS","SHOT","BALL LOST"],p=[0.88,0.02,0.10])
+                player=closest(team_name,start)
+                if kind=="PASS":
+                    to=closest(team_name,end,exclude=player)
+                    subtype=np.nan
+                elif kind=="SHOT":
+                    to=np.nan
+                    subtype=rng.choice(["ON TARGET-SAVED","OFF TARGET-OUT","HEAD-ON TARGET-GOAL"],p=[0.5,0.4,0.1])
+                else:
+                    to=np.nan
+                    subtype="INTERCEPTION"
+                rows.append((team_name,kind,subtype,period,frames[start],times[start],frames[end],times[end],player,to,
+                             ball[start,0],ball[start,1],ball[end,0],ball[end,1]))
+                if kind!="PASS": # The other team recovers the ball
+                    team_name="Away" if team_name=="Home" else "Home"
+                    rows.append((team_name,"RECOVERY",np.nan,period,frames[end],times[end],frames[end],times[end],closest(team_name,end),np.nan,
+                                 ball[end,0],ball[end,1],np.nan,np.nan))
+            start=end+rng.integers(1,max(2,int(2*mean_interval/0.04)-35))
+        team_name="Away" if period==1 else "Home"
+
+    columns=["Team","Type","Subtype","Period","Start Frame","Start Time [s]","End Frame","End Time [s]","From","To",
+             "Start X","Start Y","End X","End Y"]
+
+    return pd.DataFrame(rows,columns=columns)
+
+
+def write_metrica_game(DATA_DIR,game_id,tracking_home,tracking_away,event,field_dimensions=(106.,68.)):
+    '''
+    Writes a game as Metrica CSV files (coordinates from 0 to 1, origin at the top left of the field), to the paths that
+    Metrica_IO.read_tracking_data and Metrica_IO.read_event_data read.
+
+    Parameters
+    ----------
+    DATA_DIR: Directory of the data, as in Metrica_IO.read_tracking_data.
+    game_id: Id of the game.
+    tracking_home,tracking_away: pd.DataFrames with Tracking Data in meters, e.g. from make_tracking_data.
+    event: pd.DataFrame with Event Data in meters, e.g. from make_event_data.
+    field_dimensions: Field dimensions in meters (Width x Height). Default is (106,68).
+
+    Returns
+    -------
+    game_dir: Directory of the game files.
+    '''
+
+    game_dir=os.path.join(DATA_DIR,"data","Sample_Game_{0}".format(game_id))
+    os.makedirs(game_dir,exist_ok=True)
+
+    def to_metrica(values,axis):
+        return values/field_dimensions[0]+0.5 if axis=="x" else 0.5-values/field_dimensions[1]
+
+    for team_name,team in [("Home",tracking_home),("Away",tracking_away)]:
+        players=[x[:-2] for x in team.columns if x[-2:]=='_x' and 'ball' not in x]
+        header=[["","",""],["","",""],["Period","Frame","Time [s]"]]
+        for player in players:
+            header[0]+=[team_name,""]
+            header[1]+=[player.split("_")[1],""]
+            header[2]+=["Player"+player.split("_")[1],""]
+        header[0]+=["",""]
+        header[1]+=["",""]
+        header[2]+=["Ball",""]
+
+        table=pd.DataFrame({"Period":team["Period"].to_numpy(),"Frame":team.index.to_numpy(),"Time [s]":team["Time [s]"].to_numpy()})
+        for column in [p+suffix for p in players+["ball"] for suffix in ("_x","_y")]:
+            table[column]=np.round(to_metrica(team[column].to_numpy(),column[-1]),5)
+
+        csv_path=os.path.join(game_dir,"Sample_Game_{0}_RawTrackingData_{1}_Team.csv".format(game_id,team_name))
+        with open(csv_path,"w") as csvfile:
+            csvfile.write("\n".join(",".join(row) for row in header)+"\n")
+            table.to_csv(csvfile,header=False,index=False,na_rep="NaN")
+
+    event=event.copy()
+    for column in ["Start X","End X","Start Y","End Y"]:
+        event[column]=np.round(to_metrica(event[column].to_numpy(dtype=float),column[-1].lower()),2)
+    event.to_csv(os.path.join(game_dir,"Sample_Game_{0}_RawEventsData.csv".format(game_id)),index=False,na_rep="NaN")
+
+    return game_dir